@@ -1,16 +1,26 @@
-from fastapi import FastAPI , Request
+from fastapi import FastAPI , Request , HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.responses import Response , JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.responses import HTMLResponse , RedirectResponse
 from uvicorn import run as app_run
 
+import time
+import asyncio
 from typing import Optional
+from io import BytesIO
 
 from src.us_visa.constants import APP_HOST , APP_PORT
-from src.us_visa.pipeline.prediction_pipeline import UsVisaData , UsVisaClassifier
-from src.us_visa.pipeline.training_pipeline import TrainingPipeline
+from src.us_visa.pipeline.prediction_pipeline import UsVisaData , predict_usvisa , predict_usvisa_batch , warm_up_usvisa_model
+from src.us_visa.pipeline.prediction_pipeline import init_usvisa_worker
+from src.us_visa.pipeline.prediction_pipeline import get_usvisa_drift_report , get_prediction_cache
+from src.us_visa.pipeline.training_job_runner import TrainingJobRunner
+from src.us_visa.pipeline.micro_batcher import UsVisaMicroBatcher
+from src.us_visa.pipeline.bounded_executor import BoundedExecutor , ServerBusyError
+from src.us_visa.entity.config_entity import UsVisaPredictorConfig
+from src.us_visa.constants import TRAINING_JOBS_DIR
+from src.us_visa.logger import logging
 
 
 app = FastAPI()
@@ -20,6 +30,63 @@ templates = Jinja2Templates(directory = 'templates')
 
 origins = ["*"]
 
+predictor_config = UsVisaPredictorConfig()
+
+# blocking work never runs on the event loop, it goes to these bounded pools
+inference_executor = BoundedExecutor(
+    name = "inference",
+    max_workers = predictor_config.executor_max_workers,
+    max_pending = predictor_config.executor_max_pending,
+    kind = predictor_config.executor_kind,
+    # every worker process loads and warms up its own model before its first task
+    process_initializer = init_usvisa_worker,
+    process_initargs = (predictor_config.warmup_rounds , )
+)
+
+# training runs in its own worker process, /train only submits the job
+training_job_runner = TrainingJobRunner(jobs_dir = TRAINING_JOBS_DIR)
+
+# concurrent single row predictions are scored together in one model call
+micro_batcher = UsVisaMicroBatcher(
+    predict_fn = predict_usvisa,
+    max_batch_size = predictor_config.micro_batch_max_size,
+    max_wait_ms = predictor_config.micro_batch_max_wait_ms,
+    executor = inference_executor
+)
+
+
+# /ready stays unhealthy until the model is loaded and warmed up
+readiness = {"ready": False, "started_at": time.time(), "attempts": 0, "error": None, "warmup": None}
+
+
+async def warm_up_model():
+    while not readiness["ready"]:
+        readiness["attempts"] += 1
+        try:
+            # the pool threads share the one resident model, a single warm-up loads it for all of them.
+            # pool processes warm up their own model in init_usvisa_worker, this run checks the model can be served
+            result = await inference_executor.run(warm_up_usvisa_model, predictor_config.warmup_rounds)
+            readiness.update(ready = True , error = None , warmup = result)
+            logging.info(f"Model warmed up after {time.time() - readiness['started_at']:.1f}s, worker is ready")
+        except Exception as e:
+            readiness["error"] = f"{e}"
+            logging.info(f"Model warm-up failed, retrying in {predictor_config.warmup_retry_seconds}s: {e}")
+            await asyncio.sleep(predictor_config.warmup_retry_seconds)
+
+
+@app.on_event("startup")
+async def startup_event():
+    # runs in the background, /live answers while the model is still loading
+    readiness["task"] = asyncio.create_task(warm_up_model())
+
+
+@app.exception_handler(ServerBusyError)
+async def server_busy_handler(request: Request, exc: ServerBusyError):
+    # shed load instead of letting the latency grow without bound
+    return JSONResponse(
+        {"status": False, "error": f"{exc}"}, status_code = 503, headers = {"Retry-After": "1"}
+    )
+
 
 app.add_middleware(
     CORSMiddleware,
@@ -68,16 +135,24 @@ async def index(request: Request):
 @app.get("/train")
 async def trainRouteClient():
     try:
-        train_pipeline = TrainingPipeline()
-
-        train_pipeline.run_training_pipeline()
+        submission = training_job_runner.submit()
 
-        return Response("Training successful !!")
+        return JSONResponse({"status": True, **submission} , status_code = 202)
 
     except Exception as e:
         return Response(f"Error Occurred! {e}")
 
 
+@app.get("/train/{job_id}")
+async def trainStatusRouteClient(job_id: str):
+    job_status = training_job_runner.get_status(job_id)
+
+    if job_status is None:
+        raise HTTPException(status_code = 404 , detail = f"Unknown training job [{job_id}]")
+
+    return JSONResponse(job_status)
+
+
 @app.post("/")
 async def predictRouteClient(request: Request):
     try:
@@ -99,9 +174,7 @@ async def predictRouteClient(request: Request):
         
         usvisa_df = usvisa_data.get_usvisa_input_data_frame()
 
-        model_predictor = UsVisaClassifier()
-
-        value = model_predictor.predict(dataframe = usvisa_df)[0]
+        value = (await micro_batcher.submit(usvisa_df))[0]
 
         status = None
         if value == 1:
@@ -113,11 +186,97 @@ async def predictRouteClient(request: Request):
             "usvisa.html",
             {"request": request, "context": status},
         )
+    
+    except ServerBusyError:
+        raise
         
     except Exception as e:
         return {"status": False, "error": f"{e}"}
 
 
+@app.post("/predict/batch")
+async def batchPredictRouteClient(request: Request):
+    """ 
+    Scores many applicant records with one model call.
+    Accepts a json array of records, a csv body (text/csv) or a csv file upload (form field "file")
+    """
+    try:
+        content_type = request.headers.get("content-type" , "")
+        
+        if content_type.startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("file")
+            usvisa_df = await inference_executor.run(
+                UsVisaData.get_batch_input_data_frame_from_csv, BytesIO(await upload.read())
+            )
+        elif content_type.startswith("text/csv"):
+            body = await request.body()
+            usvisa_df = await inference_executor.run(UsVisaData.get_batch_input_data_frame_from_csv, BytesIO(body))
+        else:
+            records = await request.json()
+            usvisa_df = UsVisaData.get_batch_input_data_frame(records)
+        
+        predictions , invalid_rows = await inference_executor.run(predict_usvisa_batch, usvisa_df)
+        
+        # the invalid rows get a null prediction and the rules they break
+        return JSONResponse({
+            "status": True, "count": len(predictions), "predictions": predictions,
+            "n_invalid_rows": len(invalid_rows),
+            "invalid_rows": [{"row": row, "violations": violations} for row , violations in invalid_rows.items()]
+        })
+    
+    except ServerBusyError:
+        raise
+    
+    except Exception as e:
+        return JSONResponse({"status": False, "error": f"{e}"} , status_code = 400)
+
+
+@app.get("/live")
+async def liveRouteClient():
+    # the process is up and the event loop answers, whether or not the model is loaded
+    return JSONResponse({"status": "alive"})
+
+
+@app.get("/ready")
+async def readyRouteClient():
+    state = {key: value for key , value in readiness.items() if key != "task"}
+    return JSONResponse(
+        {"status": "ready" if readiness["ready"] else "warming_up", **state},
+        status_code = 200 if readiness["ready"] else 503
+    )
+
+
+@app.get("/monitoring/prediction_cache")
+async def predictionCacheStatsRouteClient():
+    # only the process wide cache is read, no classifier (s3 client, model cache) is built on the event loop
+    return JSONResponse(get_prediction_cache(predictor_config).get_stats())
+
+
+@app.get("/monitoring/batching")
+async def batchingStatsRouteClient():
+    return JSONResponse({
+        "micro_batcher": micro_batcher.get_stats(),
+        "inference_executor": inference_executor.get_stats(),
+    })
+
+
+@app.get("/monitoring/drift")
+async def driftRouteClient():
+    """ 
+    Compares the features and predictions scored in the sliding window with the reference profile
+    of the model, a drifted window is the signal to retrain
+    """
+    try:
+        report = await inference_executor.run(get_usvisa_drift_report)
+        return JSONResponse(report)
+    
+    except ServerBusyError:
+        raise
+    
+    except Exception as e:
+        return JSONResponse({"status": False, "error": f"{e}"} , status_code = 503)
+
 
 if __name__ == "__main__":
     app_run(app , host = APP_HOST , port = APP_PORT)
\ No newline at end of file
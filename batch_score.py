@@ -0,0 +1,32 @@
+import os
+import argparse
+from src.us_visa.pipeline.bulk_scoring_pipeline import BulkScoringPipeline
+
+# Score a large csv/parquet file with the current model
+# usage: python batch_score.py --input cases.parquet --output predictions.csv [--resume]
+parser = argparse.ArgumentParser(description = "Score a csv or parquet file of visa applications in chunks")
+parser.add_argument("--input" , required = True , help = "csv or parquet file with the applicant records")
+parser.add_argument("--output" , required = True , help = "csv file where the predictions are written")
+parser.add_argument("--chunk-size" , type = int , default = 50000 , help = "rows scored per chunk")
+parser.add_argument("--workers" , type = int , default = os.cpu_count() or 1 , help = "number of worker processes")
+parser.add_argument("--model-path" , default = None , help = "local model.pkl (default: the model in the s3 bucket)")
+parser.add_argument("--id-column" , default = "case_id" , help = "input column copied next to each prediction")
+parser.add_argument("--resume" , action = "store_true" , help = "continue after the last completed chunk")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    bulk_scoring_pipeline = BulkScoringPipeline(
+        input_file_path = args.input,
+        output_file_path = args.output,
+        chunk_size = args.chunk_size,
+        workers = args.workers,
+        model_file_path = args.model_path,
+        id_column = args.id_column
+    )
+    summary = bulk_scoring_pipeline.run(resume = args.resume)
+
+    print(
+        f"Scored {summary['rows']} rows in {summary['chunks']} chunks "
+        f"({summary['rows_per_second']:.0f} rows/sec)"
+    )
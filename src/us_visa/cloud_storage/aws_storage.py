@@ -4,6 +4,8 @@ from typing import Union , List
 import os , sys 
 
 from src.us_visa.configuration.aws_connection import S3Client
+from src.us_visa.cloud_storage.local_model_cache import LocalModelCache
+from src.us_visa.constants import LOCAL_MODEL_CACHE_DIR , LOCAL_MODEL_CACHE_MAX_SIZE_BYTES
 from src.us_visa.exception import UsVisaException
 from src.us_visa.logger import logging
 
@@ -21,6 +23,9 @@ class StorageService:
         s3_client = S3Client()
         self.s3_client = s3_client.s3_client
         self.s3_resource = s3_client.s3_resource
+        self.local_model_cache = LocalModelCache(
+            cache_dir = LOCAL_MODEL_CACHE_DIR , max_size_bytes = LOCAL_MODEL_CACHE_MAX_SIZE_BYTES
+        )
         
         
     def s3_key_path_available(self,bucket_name,s3_key)->bool:
@@ -104,6 +109,67 @@ class StorageService:
         except Exception as e:
             raise UsVisaException(e, sys) from e
     
+    def get_object_version(self, key: str, bucket_name: str) -> str:
+        """
+        Method Name :   get_object_version
+        Description :   This method reads the ETag and LastModified of the key object with a HEAD request
+
+        Output      :   version string of the object is returned (None if the object is not present)
+
+        """
+        logging.info("Entered the get_object_version method of S3Operations class")
+
+        try:
+            response = self.s3_client.head_object(Bucket=bucket_name, Key=key)
+            etag = response["ETag"].strip('"')
+            version = f"{etag}:{response['LastModified'].isoformat()}"
+            logging.info("Exited the get_object_version method of S3Operations class")
+            return version
+
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise UsVisaException(e, sys) from e
+
+        except Exception as e:
+            raise UsVisaException(e, sys) from e
+
+    def get_model_bytes(self, key: str, bucket_name: str) -> bytes:
+        """
+        Method Name :   get_model_bytes
+        Description :   This method returns the bytes of the key object, from the local model cache when
+                        s3 answers 304 Not Modified to the conditional (If-None-Match) request
+
+        Output      :   bytes of the object
+         
+        """
+        cached_etag = self.local_model_cache.get_cached_etag(bucket_name, key)
+
+        response = None
+        if cached_etag is not None:
+            try:
+                # 200 with the new object when it changed, it is used as the download
+                response = self.s3_client.get_object(Bucket=bucket_name, Key=key, IfNoneMatch=f'"{cached_etag}"')
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in ("304", "NotModified"):
+                    raise
+                try:
+                    logging.info(f"{key} is not modified, reading it from the local model cache")
+                    return self.local_model_cache.read(cached_etag)
+                except FileNotFoundError:
+                    # evicted by another worker in between, download it again
+                    logging.info(f"{key} was evicted from the local model cache")
+
+        if response is None:
+            response = self.s3_client.get_object(Bucket=bucket_name, Key=key)
+        try:
+            model_bytes = response["Body"].read()
+        finally:
+            response["Body"].close()
+        self.local_model_cache.put(bucket_name, key, response["ETag"], model_bytes)
+        logging.info(f"Downloaded {key} from {bucket_name} bucket into the local model cache")
+        return model_bytes
+
     def load_model(self, model_name: str, bucket_name: str, model_dir: str = None) -> object:
         """
         Method Name :   load_model
@@ -121,8 +187,7 @@ class StorageService:
                 else model_dir + "/" + model_name
             )
             model_file = func()
-            file_object = self.get_file_object(model_file, bucket_name)
-            model_obj = self.read_object(file_object, decode=False)
+            model_obj = self.get_model_bytes(model_file, bucket_name)
             model = pickle.loads(model_obj)
             logging.info("Exited the load_model method of S3Operations class")
             return model
@@ -0,0 +1,125 @@
+import os
+import json
+import hashlib
+import tempfile
+from typing import Optional
+
+from src.us_visa.logger import logging
+
+
+class LocalModelCache:
+    """
+    This class keeps downloaded model objects on the local disk, content addressed by their s3 ETag.
+
+    blobs/<etag>.pkl        the object bytes, shared by every key that points to the same content
+    refs/<hash of key>.json the ETag the bucket/key pointed to at the last download
+
+    Files are written to a temporary file and renamed into place, so several worker processes
+    can share one cache directory. The blobs are evicted least recently used first once the
+    cache grows past max_size_bytes.
+    """
+
+    def __init__(self, cache_dir: str, max_size_bytes: int):
+        """
+        :param cache_dir: directory of the cache (shared by all the workers of the host)
+        :param max_size_bytes: total size of the blobs kept on disk
+        """
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.blobs_dir = os.path.join(cache_dir, "blobs")
+        self.refs_dir = os.path.join(cache_dir, "refs")
+
+    @staticmethod
+    def _normalize_etag(etag: str) -> str:
+        return etag.strip('"')
+
+    def _ref_path(self, bucket_name: str, key: str) -> str:
+        ref_name = hashlib.sha256(f"{bucket_name}/{key}".encode()).hexdigest()
+        return os.path.join(self.refs_dir, f"{ref_name}.json")
+
+    def blob_path(self, etag: str) -> str:
+        # ETags are hex digests (plus "-<parts>" for multipart uploads), safe as file names
+        return os.path.join(self.blobs_dir, f"{self._normalize_etag(etag)}.pkl")
+
+    def _atomic_write(self, file_path: str, content: bytes) -> None:
+        dir_path = os.path.dirname(file_path)
+        os.makedirs(dir_path, exist_ok = True)
+        file_descriptor, tmp_file_path = tempfile.mkstemp(dir = dir_path, suffix = ".tmp")
+        try:
+            with os.fdopen(file_descriptor, "wb") as file_obj:
+                file_obj.write(content)
+            os.replace(tmp_file_path, file_path)
+        except Exception:
+            if os.path.exists(tmp_file_path):
+                os.remove(tmp_file_path)
+            raise
+
+    def get_cached_etag(self, bucket_name: str, key: str) -> Optional[str]:
+        """
+        Returns the ETag of the cached copy of bucket/key, None if there is no usable copy
+        """
+        try:
+            with open(self._ref_path(bucket_name, key), "r") as file_obj:
+                etag = json.load(file_obj)["etag"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+        return etag if os.path.exists(self.blob_path(etag)) else None
+
+    def read(self, etag: str) -> bytes:
+        """
+        Returns the cached bytes of the etag (raises FileNotFoundError if it was evicted meanwhile)
+        """
+        blob_path = self.blob_path(etag)
+        with open(blob_path, "rb") as file_obj:
+            content = file_obj.read()
+        # mark as recently used for the eviction
+        os.utime(blob_path)
+        return content
+
+    def put(self, bucket_name: str, key: str, etag: str, content: bytes) -> None:
+        """
+        Stores the downloaded bytes of bucket/key and evicts old blobs if the cache is too large
+        """
+        blob_path = self.blob_path(etag)
+        if not os.path.exists(blob_path):
+            self._atomic_write(blob_path, content)
+        else:
+            os.utime(blob_path)
+
+        self._atomic_write(
+            self._ref_path(bucket_name, key),
+            json.dumps({"bucket": bucket_name, "key": key, "etag": self._normalize_etag(etag)}).encode()
+        )
+        self.evict(keep = blob_path)
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """
+        Removes the least recently used blobs until the cache fits in max_size_bytes
+        """
+        if not os.path.isdir(self.blobs_dir):
+            return
+
+        blobs = []
+        for file_name in os.listdir(self.blobs_dir):
+            if not file_name.endswith(".pkl"):
+                continue
+            blob_path = os.path.join(self.blobs_dir, file_name)
+            try:
+                stat = os.stat(blob_path)
+            except FileNotFoundError:
+                continue
+            blobs.append((stat.st_mtime, stat.st_size, blob_path))
+
+        total_size = sum(size for _, size, _ in blobs)
+        for _, size, blob_path in sorted(blobs):
+            if total_size <= self.max_size_bytes:
+                break
+            if blob_path == keep:
+                continue
+            try:
+                os.remove(blob_path)
+                total_size -= size
+                logging.info(f"Evicted [{blob_path}] from the local model cache")
+            except FileNotFoundError:
+                # another worker evicted it first
+                total_size -= size
@@ -1,34 +1,83 @@
 import sys
 import os 
+import json
+import shutil
 
+import numpy as np
+import pandas as pd
+from bson import json_util
+from typing import Dict , Iterator , List , Optional , Tuple
 from pandas import DataFrame
 from sklearn.model_selection import train_test_split
 
 from src.us_visa.entity.config_entity import DataIngestionConfig
 from src.us_visa.entity.artifact_entity import DataIngestionArtifact
+from src.us_visa.entity.artifact_cache import ArtifactCache
 from src.us_visa.exception import UsVisaException
 from src.us_visa.logger import logging
 from src.us_visa.data_access.usvisa_data import USvisaData
+from src.us_visa.utils.main_utils import read_dataframe , write_dataframe , read_yaml_file , iter_dataframe_chunks , get_hash_buckets
+from src.us_visa.utils.main_utils import DataFrameAppender
+from src.us_visa.constants import SCHEMA_FILE_PATH
 
 
 class DataIngestion:
     # take data ingestion config as parameter
-    def __init__(self , data_ingestion_config: DataIngestionConfig = DataIngestionConfig()):
+    def __init__(self , data_ingestion_config: DataIngestionConfig = DataIngestionConfig(),
+                 artifact_cache: Optional[ArtifactCache] = None , usvisa_data: Optional[USvisaData] = None):
         try:
             self.data_ingestion_config = data_ingestion_config
+            self.artifact_cache = artifact_cache
+            # a USvisaData on another client (local mongod, mongomock) can be given for tests
+            self.usvisa_data = usvisa_data
+            self._schema_config = read_yaml_file(file_path = SCHEMA_FILE_PATH)
         except Exception as e:
             raise UsVisaException(e , sys)
     
+    def save_dataframe(self , dataframe: DataFrame , file_path: str) -> None:
+        """ 
+        Writes the dataframe in the background when the run has an artifact cache, right away otherwise
+        """
+        if self.artifact_cache is not None:
+            self.artifact_cache.persist(
+                file_path , dataframe,
+                lambda: write_dataframe(dataframe , file_path , schema_config = self._schema_config)
+            )
+        else:
+            write_dataframe(dataframe , file_path , schema_config = self._schema_config)
+    
+    def get_usvisa_data(self) -> USvisaData:
+        return self.usvisa_data if self.usvisa_data is not None else USvisaData()
+    
+    def get_export_options(self) -> Dict:
+        """ 
+        Returns the feature engineering options of the export. With the pushdown the drop columns
+        the ingestion still needs (dedup column, split key) are kept in the feature store.
+        """
+        config = self.data_ingestion_config
+        keep_columns: List[str] = []
+        if config.incremental:
+            keep_columns.append(config.dedup_column)
+        if config.split_method == "hash":
+            keep_columns.append(config.split_key_column)
+        return {"feature_pushdown": config.feature_pushdown , "keep_columns": keep_columns}
+    
     def export_data_into_feature_store(self) -> DataFrame:
         """ 
         This method exports data from mongodb to csv file
         """
         try:
+           if self.data_ingestion_config.incremental:
+               return self.export_incremental_data_into_feature_store()
+           
            logging.info(f"Getting data from mongodb")
            
-           usvisa_data_obj = USvisaData()
+           usvisa_data_obj = self.get_usvisa_data()
            dataframe = usvisa_data_obj.export_collection_data_as_dataframe(
-               collection_name = self.data_ingestion_config.collection_name
+               collection_name = self.data_ingestion_config.collection_name,
+               n_partitions = self.data_ingestion_config.export_partitions,
+               n_workers = self.data_ingestion_config.export_workers,
+               **self.get_export_options()
             )
            
            logging.info("Data conversion from Collection to DataFrame successful")
@@ -41,7 +90,11 @@ class DataIngestion:
            os.makedirs(feature_store_dir_path , exist_ok = True)
            
            logging.info(f"Saving exported data into feature store file path: {feature_store_file_path}")
-           dataframe.to_csv(feature_store_file_path , index = False , header = True)
+           if self.data_ingestion_config.split_method == "hash":
+               # the hash split streams the file right away and the frame is not kept for it
+               write_dataframe(dataframe , feature_store_file_path , schema_config = self._schema_config)
+           else:
+               self.save_dataframe(dataframe , feature_store_file_path)
            
            return dataframe
            
@@ -49,21 +102,230 @@ class DataIngestion:
             raise UsVisaException(e , sys)
     
     
+    def read_watermark(self):
+        """ 
+        Returns the watermark saved by the previous incremental run,
+        None when there is none or it was taken on another collection / field / export mode
+        """
+        watermark_file_path = self.data_ingestion_config.watermark_file_path
+        if not os.path.exists(watermark_file_path) or not os.path.exists(self.data_ingestion_config.incremental_feature_store_file_path):
+            return None
+        
+        with open(watermark_file_path , "r") as file_obj:
+            watermark = json_util.loads(file_obj.read())
+        
+        if watermark.get("collection_name") != self.data_ingestion_config.collection_name or \
+           watermark.get("field") != self.data_ingestion_config.watermark_field:
+            logging.info("Saved watermark belongs to another collection or field, doing a full export")
+            return None
+        # the stored feature store has the columns of the export mode it was built with
+        if watermark.get("feature_pushdown" , False) != self.data_ingestion_config.feature_pushdown:
+            logging.info("Saved feature store was exported in another feature pushdown mode, doing a full export")
+            return None
+        return watermark["value"]
+    
+    def write_watermark(self , value) -> None:
+        # json_util keeps ObjectId / datetime watermarks round trippable
+        watermark_file_path = self.data_ingestion_config.watermark_file_path
+        tmp_file_path = f"{watermark_file_path}.tmp"
+        with open(tmp_file_path , "w") as file_obj:
+            file_obj.write(json_util.dumps({
+                "collection_name": self.data_ingestion_config.collection_name,
+                "field": self.data_ingestion_config.watermark_field,
+                "feature_pushdown": self.data_ingestion_config.feature_pushdown,
+                "value": value
+            }))
+        os.replace(tmp_file_path , watermark_file_path)
+    
+    def export_incremental_data_into_feature_store(self) -> DataFrame:
+        """ 
+        This method fetches only the documents above the saved watermark, merges them into the
+        persistent feature store (latest document wins per dedup_column) and copies the store
+        into the feature store of this run. The first run, or a run without a usable watermark,
+        does a full export.
+        """
+        try:
+            logging.info("Entered export_incremental_data_into_feature_store method of Data_Ingestion class")
+            
+            config = self.data_ingestion_config
+            usvisa_data_obj = self.get_usvisa_data()
+            watermark = self.read_watermark()
+            
+            # the new watermark is read first, documents inserted during the export go to the next run
+            new_watermark = usvisa_data_obj.get_max_value(
+                collection_name = config.collection_name , field = config.watermark_field
+            )
+            
+            if new_watermark is None:
+                raise ValueError(f"Collection [{config.collection_name}] has no [{config.watermark_field}] value")
+            
+            query = {config.watermark_field: {"$lte": new_watermark}}
+            if watermark is not None:
+                query[config.watermark_field]["$gt"] = watermark
+            
+            logging.info(f"Fetching documents with {query}")
+            delta_dataframe = usvisa_data_obj.export_collection_data_as_dataframe(
+                collection_name = config.collection_name,
+                n_partitions = config.export_partitions if watermark is None else 1,
+                n_workers = config.export_workers,
+                query = query,
+                **self.get_export_options()
+            )
+            logging.info(f"Fetched {len(delta_dataframe)} new or changed documents")
+            
+            if watermark is None:
+                dataframe = delta_dataframe
+            else:
+                stored_dataframe = read_dataframe(config.incremental_feature_store_file_path)
+                # categoricals with different vocabularies would be concatenated as object anyway
+                dataframe = pd.concat([stored_dataframe , delta_dataframe.astype(object)] , ignore_index = True)
+                dataframe = dataframe.drop_duplicates(subset = [config.dedup_column] , keep = "last")
+                dataframe = dataframe.reset_index(drop = True)
+            
+            logging.info(f"Shape of the merged feature store: {dataframe.shape}")
+            
+            # store first, watermark second: a crash in between only refetches the delta
+            os.makedirs(os.path.dirname(config.incremental_feature_store_file_path) , exist_ok = True)
+            file_root , file_extension = os.path.splitext(config.incremental_feature_store_file_path)
+            tmp_file_path = f"{file_root}.tmp{file_extension}"
+            write_dataframe(dataframe , tmp_file_path , schema_config = self._schema_config)
+            os.replace(tmp_file_path , config.incremental_feature_store_file_path)
+            self.write_watermark(new_watermark)
+            
+            # the feature store of the run is a snapshot of the persistent store
+            os.makedirs(os.path.dirname(config.feature_store_file_path) , exist_ok = True)
+            shutil.copyfile(config.incremental_feature_store_file_path , config.feature_store_file_path)
+            
+            logging.info("Exited export_incremental_data_into_feature_store method of Data_Ingestion class")
+            return dataframe
+        
+        except Exception as e:
+            raise UsVisaException(e , sys)
+    
+    
+    def iter_feature_store_chunks(self , dataframe: Optional[DataFrame] = None) -> Iterator[DataFrame]:
+        """ 
+        Yields the feature store in chunks of split_chunk_size rows, from the dataframe when
+        it is given, streamed from the feature store file otherwise
+        """
+        chunk_size = self.data_ingestion_config.split_chunk_size
+        if dataframe is not None:
+            for start in range(0 , len(dataframe) , chunk_size):
+                yield dataframe.iloc[start : start + chunk_size]
+        else:
+            yield from iter_dataframe_chunks(self.data_ingestion_config.feature_store_file_path , chunk_size)
+    
+    def get_test_bucket_thresholds(self , dataframe: Optional[DataFrame] = None) -> Dict[Optional[str] , int]:
+        """ 
+        Returns the hash bucket below which a record goes to the test set, per stratum.
+        
+        Without a stratify column every record is compared with the same fixed threshold, so the
+        side of a record only depends on its key. With a stratify column the threshold of every
+        stratum is the test ratio quantile of the buckets of that stratum, read from a histogram
+        built in one pass over the chunks: each stratum gets the exact test ratio, and records
+        only change sides when their stratum grows enough to move its threshold bucket.
+        """
+        config = self.data_ingestion_config
+        thresholds = {None: int(round(config.train_test_split_ratio * config.split_hash_buckets))}
+        if config.split_stratify_column is None:
+            return thresholds
+        
+        histograms = {}
+        for chunk in self.iter_feature_store_chunks(dataframe):
+            buckets = get_hash_buckets(chunk[config.split_key_column] , config.split_hash_buckets)
+            strata = chunk[config.split_stratify_column].astype(str).to_numpy()
+            for stratum in np.unique(strata):
+                histogram = np.bincount(buckets[strata == stratum] , minlength = config.split_hash_buckets)
+                histograms[stratum] = histograms.get(stratum , 0) + histogram
+        
+        for stratum , histogram in histograms.items():
+            cumulative_counts = np.cumsum(histogram)
+            target = config.train_test_split_ratio * cumulative_counts[-1]
+            # first bucket reaching the target, or the one before it when that is closer
+            bucket = int(np.searchsorted(cumulative_counts , target))
+            below = cumulative_counts[bucket - 1] if bucket > 0 else 0
+            thresholds[stratum] = bucket + 1 if cumulative_counts[bucket] - target <= target - below else bucket
+        
+        logging.info(f"Test bucket thresholds per [{config.split_stratify_column}]: {thresholds}")
+        return thresholds
+    
+    def hash_split_chunk(self , chunk: DataFrame , thresholds: Dict[Optional[str] , int]) -> Tuple[DataFrame , DataFrame]:
+        """ 
+        Splits one chunk into its train and test rows by the hash bucket of the key column
+        """
+        config = self.data_ingestion_config
+        buckets = get_hash_buckets(chunk[config.split_key_column] , config.split_hash_buckets)
+        
+        if config.split_stratify_column is None:
+            bucket_thresholds = thresholds[None]
+        else:
+            # strata that were not seen when the thresholds were built use the plain threshold
+            bucket_thresholds = (
+                chunk[config.split_stratify_column].astype(str)
+                .map(thresholds).fillna(thresholds[None]).to_numpy(dtype = np.int64)
+            )
+        
+        is_test = buckets < bucket_thresholds
+        return chunk[~is_test] , chunk[is_test]
+    
+    def hash_split_as_train_test(self) -> Tuple[int , int]:
+        """ 
+        Assigns every record of the feature store file to the train or the test set by a stable hash
+        of split_key_column, chunk by chunk: the train and test rows of a chunk are appended to the
+        split files right away, so only one chunk is in memory. The same record lands on the same
+        side in every run however many records are added around it.
+        Returns the number of train and test rows
+        """
+        config = self.data_ingestion_config
+        thresholds = self.get_test_bucket_thresholds()
+        
+        with DataFrameAppender(config.training_file_path , self._schema_config) as train_appender , \
+             DataFrameAppender(config.testing_file_path , self._schema_config) as test_appender:
+            for chunk in self.iter_feature_store_chunks():
+                train_chunk , test_chunk = self.hash_split_chunk(chunk , thresholds)
+                train_appender.append(train_chunk)
+                test_appender.append(test_chunk)
+        
+        n_train , n_test = train_appender.n_rows , test_appender.n_rows
+        logging.info(
+            f"Hash split on [{config.split_key_column}]: {n_train} train rows, "
+            f"{n_test} test rows ({n_test / max(1 , n_train + n_test):.4f} test share)"
+        )
+        return n_train , n_test
+    
     # Now do the train test split
-    def split_data_as_train_test(self , dataframe: DataFrame) -> None:
+    def split_data_as_train_test(self , dataframe: Optional[DataFrame] = None) -> Tuple[Optional[DataFrame] , Optional[DataFrame]]:
         """ 
-        This method splits the dataframe into train set and test set based on split ratio.
-        Then save the train and test set as csv file
+        This method splits the dataframe into train set and test set based on split ratio,
+        at random or by the hash of the key column (split_method of the config).
+        The feature store file is used when no dataframe is given.
+        Then save the train and test set in the configured artifact format.
+        The hash split streams the feature store file into the split files and returns no dataframes
         """
         
         logging.info("Entered split_data_as_train_test method of data_ingestion")
         
         try:
-            train_set , test_set = train_test_split(
-                dataframe , 
-                test_size = self.data_ingestion_config.train_test_split_ratio,
-                random_state = 42
-            )
+            split_method = self.data_ingestion_config.split_method
+            
+            if split_method == "hash":
+                self.hash_split_as_train_test()
+                logging.info(f"Saved train and test data as {self.data_ingestion_config.artifact_format} file")
+                return None , None
+            elif split_method == "random":
+                if dataframe is None:
+                    dataframe = read_dataframe(self.data_ingestion_config.feature_store_file_path)
+                train_set , test_set = train_test_split(
+                    dataframe , 
+                    test_size = self.data_ingestion_config.train_test_split_ratio,
+                    random_state = 42
+                )
+            else:
+                raise ValueError(f"Unknown split method [{split_method}], expected \"random\" or \"hash\"")
+            
+            # same row index as the frames read back from the files
+            train_set = train_set.reset_index(drop = True)
+            test_set = test_set.reset_index(drop = True)
             
             # Now make the directory where train and test data will be saved
             train_file_path = self.data_ingestion_config.training_file_path
@@ -73,10 +335,12 @@ class DataIngestion:
             # Create the directory
             os.makedirs(dir_path , exist_ok = True)
             
-            # Now save the train and test set as csv
-            train_set.to_csv(train_file_path , index = False , header = True)
-            test_set.to_csv(test_file_path , index = False , header = True)
-            logging.info("Saved train and test data as csv file")
+            # Now save the train and test set
+            self.save_dataframe(train_set , train_file_path)
+            self.save_dataframe(test_set , test_file_path)
+            logging.info(f"Saved train and test data as {self.data_ingestion_config.artifact_format} file")
+            
+            return train_set , test_set
             
         except Exception as e:
             raise UsVisaException(e , sys)
@@ -95,14 +359,22 @@ class DataIngestion:
             dataframe = self.export_data_into_feature_store()
             logging.info("from initiate_data_ingestion: Got the data from mongodb as Dataframe")
             
+            if self.data_ingestion_config.split_method == "hash":
+                # the hash split streams the feature store file, the exported frame is released first
+                dataframe = None
+            
             # Do the train test split
-            self.split_data_as_train_test(dataframe)
+            train_set , test_set = self.split_data_as_train_test(dataframe)
             
             logging.info("Performed train test split on the dataset")
             
+            # hand the splits over in memory when the run has an artifact cache
+            is_handoff = self.artifact_cache is not None
             data_ingestion_artifact = DataIngestionArtifact(
                 train_file_path = self.data_ingestion_config.training_file_path, 
-                test_file_path = self.data_ingestion_config.testing_file_path
+                test_file_path = self.data_ingestion_config.testing_file_path,
+                train_df = train_set if is_handoff else None,
+                test_df = test_set if is_handoff else None
             ) 
             
             logging.info(f"Data ingestion artifact: {data_ingestion_artifact}")
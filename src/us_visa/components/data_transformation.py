@@ -1,5 +1,7 @@
 import sys
 import os 
+import shutil
+from typing import Iterator , Optional , Tuple
 
 import numpy as np
 import pandas as pd
@@ -11,28 +13,37 @@ from sklearn.compose import ColumnTransformer
 from src.us_visa.constants import TARGET_COLUMN , SCHEMA_FILE_PATH , CURRENT_YEAR
 from src.us_visa.entity.config_entity import DataIngestionConfig , DataTransformationConfig , DataValidationConfig
 from src.us_visa.entity.artifact_entity import DataIngestionArtifact , DataValidationArtifact , DataTransformationArtifact
+from src.us_visa.entity.artifact_cache import ArtifactCache
 
 from src.us_visa.exception import UsVisaException
 from src.us_visa.logger import logging
 
-from src.us_visa.utils.main_utils import save_object , save_numpy_array_data , read_yaml_file , drop_columns , read_csv
+from src.us_visa.utils.main_utils import save_object , load_object , save_numpy_array_data , read_yaml_file , drop_columns , read_dataframe_artifact
+from src.us_visa.utils.main_utils import iter_dataframe_chunks , concatenate_numpy_array_files , narrow_integral
 from src.us_visa.entity.estimator import TargetValueMapping
+from src.us_visa.entity.compiled_preprocessor import CompiledPreprocessor
+from src.us_visa.entity.chunked_preprocessor import ChunkedPreprocessorFitter
+from src.us_visa.entity.reference_profile import ReferenceProfile
+from src.us_visa.entity.schema_validator import SchemaValidator
 
 
 
 class DataTransformation:
     def __init__(self , data_transformation_config: DataTransformationConfig,
                  data_ingestion_artifact: DataIngestionArtifact, 
-                 data_validation_artifact: DataValidationArtifact
+                 data_validation_artifact: DataValidationArtifact,
+                 artifact_cache: Optional[ArtifactCache] = None
                 ):
         
         try:
             self.data_transformation_config = data_transformation_config
             self.data_ingestion_artifact = data_ingestion_artifact
             self.data_validation_artifact = data_validation_artifact
+            self.artifact_cache = artifact_cache
             
             # read the schema file cause we need to know the drop and transformation col names
             self._schema_config = read_yaml_file(file_path = SCHEMA_FILE_PATH)
+            self.schema_validator = SchemaValidator.from_schema(self._schema_config)
         except Exception as e:
             raise UsVisaException(e , sys)
     
@@ -84,6 +95,206 @@ class DataTransformation:
             raise UsVisaException(e , sys)
     
     
+    def get_input_and_target_features(self , dataframe : pd.DataFrame , name : str) -> Tuple[pd.DataFrame , pd.Series]:
+        """ 
+        Does the feature engineering of the train / test dataframe and returns the input features and the
+        mapped target: rows without employees are removed, company_age is added, rows breaking the schema
+        are removed, the drop columns are dropped
+        """
+        # removes rows where no_of_employees are 0 or -ve
+        count_rows_removed = dataframe.shape[0] 
+        dataframe = dataframe[dataframe['no_of_employees'] > 0]
+        count_rows_removed -= dataframe.shape[0]
+        logging.info(f"from {name} data: rows removed for no_of_employees 0/-ve values: {count_rows_removed}")
+        # the missing values went with the removed rows, the column holds integers again like in the
+        # export with the feature pushdown, where mongodb removes these rows
+        dataframe = dataframe.assign(no_of_employees = narrow_integral(dataframe['no_of_employees']))
+        
+        # separete target columns and input features[X , y]
+        input_feature_df = dataframe.drop(columns = [TARGET_COLUMN])
+        target_feature_df = dataframe[TARGET_COLUMN]
+        
+        # make the company age column (already there when the export pushed the feature engineering down)
+        if 'company_age' not in input_feature_df.columns:
+            input_feature_df['company_age'] = CURRENT_YEAR - input_feature_df['yr_of_estab']
+        
+        # the data validation let at most max_invalid_row_rate of the rows break the schema, they are not trained on
+        row_mask = self.schema_validator.validate(
+            input_feature_df.assign(**{TARGET_COLUMN : target_feature_df}) , light = True
+        ).row_mask
+        if not row_mask.all():
+            input_feature_df , target_feature_df = input_feature_df[row_mask] , target_feature_df[row_mask]
+            logging.info(f"from {name} data: rows removed for breaking the schema: {int((~row_mask).sum())}")
+        
+        # drop the unecessary columns
+        columns_need_to_drop = [column for column in self._schema_config['drop_columns'] if column in input_feature_df.columns]
+        input_feature_df = drop_columns(df = input_feature_df , cols = columns_need_to_drop)
+        
+        # the target is read as category, map it through object to get integer labels
+        target_feature_df = target_feature_df.astype(object).replace(
+            TargetValueMapping()._asdict()
+        ).infer_objects()
+        logging.info(f"Feature engineering done on {name} data")
+        
+        return input_feature_df , target_feature_df
+    
+    def get_profile_frame(self , input_feature_df : pd.DataFrame , target_feature_df : pd.Series) -> pd.DataFrame:
+        """ 
+        Returns the model input with the mapped target, the columns kept in the reference profile
+        """
+        return input_feature_df.assign(**{TARGET_COLUMN : target_feature_df})
+    
+    def iter_feature_chunks(self , file_path : str , dataframe : Optional[pd.DataFrame] , name : str) -> Iterator[Tuple[pd.DataFrame , pd.Series]]:
+        """ 
+        Yields the input features and the target of the ingested split chunk by chunk, from the
+        dataframe handed over in memory or streamed from the file. A short chunk is merged into the
+        one before it, so every chunk has enough rows for the SMOTEENN neighbours.
+        """
+        chunk_size = self.data_transformation_config.chunk_size
+        if dataframe is not None:
+            chunks = (dataframe.iloc[start : start + chunk_size] for start in range(0 , len(dataframe) , chunk_size))
+        else:
+            chunks = iter_dataframe_chunks(file_path , chunk_size)
+        
+        pending_chunk = None
+        for chunk in chunks:
+            if pending_chunk is None:
+                pending_chunk = chunk
+            elif len(chunk) < chunk_size // 2:
+                pending_chunk = pd.concat([pending_chunk , chunk] , ignore_index = True)
+            else:
+                yield self.get_input_and_target_features(pending_chunk , name)
+                pending_chunk = chunk
+        if pending_chunk is not None:
+            yield self.get_input_and_target_features(pending_chunk , name)
+    
+    def transform_chunks_to_files(self , preprocessor , file_path : str , dataframe : Optional[pd.DataFrame] , name : str,
+                                  feature_file_path : str , target_file_path : str,
+                                  reference_profile : Optional[ReferenceProfile] = None) -> Tuple[int , int]:
+        """ 
+        Transforms and resamples the split chunk by chunk, every chunk is saved to its own .npy files
+        and the chunk files are concatenated into feature_file_path and target_file_path at the end.
+        The chunks (before resampling) are added to reference_profile when given.
+        Returns the shape of the features.
+        """
+        array_dtype = np.dtype(self.data_transformation_config.transformed_array_dtype)
+        chunks_dir = os.path.join(self.data_transformation_config.chunks_dir , name)
+        os.makedirs(chunks_dir , exist_ok = True)
+        
+        feature_chunk_file_paths , target_chunk_file_paths = [] , []
+        try:
+            for index , (input_feature_df , target_feature_df) in enumerate(self.iter_feature_chunks(file_path , dataframe , name)):
+                input_feature_arr = preprocessor.transform(input_feature_df)
+                if reference_profile is not None:
+                    reference_profile.update(self.get_profile_frame(input_feature_df , target_feature_df))
+                
+                # SMOTEENN only sees the rows of the chunk, its neighbours are searched within the chunk
+                smt = SMOTEENN(sampling_strategy = "minority")
+                input_feature_final , target_feature_final = smt.fit_resample(input_feature_arr , target_feature_df)
+                
+                feature_chunk_file_path = os.path.join(chunks_dir , f"features_{index:05d}.npy")
+                target_chunk_file_path = os.path.join(chunks_dir , f"target_{index:05d}.npy")
+                save_numpy_array_data(feature_chunk_file_path , np.asarray(input_feature_final , dtype = array_dtype))
+                save_numpy_array_data(target_chunk_file_path , np.asarray(target_feature_final , dtype = np.int8))
+                feature_chunk_file_paths.append(feature_chunk_file_path)
+                target_chunk_file_paths.append(target_chunk_file_path)
+                logging.info(f"Transformed {name} chunk {index}: {len(input_feature_df)} rows -> {len(input_feature_final)} resampled rows")
+            
+            if len(feature_chunk_file_paths) == 0:
+                raise ValueError(f"The {name} data is empty")
+            
+            shape = concatenate_numpy_array_files(feature_chunk_file_paths , feature_file_path)
+            concatenate_numpy_array_files(target_chunk_file_paths , target_file_path)
+        finally:
+            shutil.rmtree(chunks_dir , ignore_errors = True)
+        
+        logging.info(f"Saved {name} features {shape} [{array_dtype}] to [{feature_file_path}]")
+        return shape
+    
+    def initiate_chunked_data_transformation(self) -> DataTransformationArtifact:
+        """ 
+        Chunked variant of initiate_data_transformation for training data larger than the memory:
+        the preprocessor is fitted from streamed passes over the train split (ChunkedPreprocessorFitter)
+        and both splits are transformed chunk by chunk into the .npy files. The trainer memory maps them.
+        """
+        try:
+            logging.info("Entered initiate_chunked_data_transformation method of Data_Transformation class")
+            
+            config = self.data_transformation_config
+            train_file_path , train_df = self.data_ingestion_artifact.train_file_path , self.data_ingestion_artifact.train_df
+            test_file_path , test_df = self.data_ingestion_artifact.test_file_path , self.data_ingestion_artifact.test_df
+            
+            fitter = ChunkedPreprocessorFitter(
+                preprocessor = self.get_data_transformation_object(),
+                reservoir_size = config.reservoir_size
+            )
+            preprocessor = fitter.fit(
+                lambda: (input_feature_df for input_feature_df , _ in self.iter_feature_chunks(train_file_path , train_df , "train"))
+            )
+            logging.info(f"Fitted the preprocessor in chunks on {fitter.n_rows} train rows")
+            
+            # the reference profile is filled while the train chunks are transformed
+            first_input_df , first_target_df = next(self.iter_feature_chunks(train_file_path , train_df , "train"))
+            reference_profile = ReferenceProfile(
+                ReferenceProfile.get_column_types(self.get_profile_frame(first_input_df , first_target_df) , self._schema_config),
+                compression = config.profile_compression
+            )
+            
+            train_shape = self.transform_chunks_to_files(
+                preprocessor , train_file_path , train_df , "train",
+                config.transformed_train_data_file_path , config.transformed_train_target_file_path,
+                reference_profile = reference_profile
+            )
+            test_shape = self.transform_chunks_to_files(
+                preprocessor , test_file_path , test_df , "test",
+                config.transformed_test_data_file_path , config.transformed_test_target_file_path
+            )
+            
+            save_object(file_path = config.transformed_object_file_path , obj = preprocessor)
+            logging.info("saved preprocessor object")
+            reference_profile.save(config.reference_profile_file_path)
+            
+            # the serving fast path must match the saved preprocessor on real rows
+            first_test_chunk , _ = next(self.iter_feature_chunks(test_file_path , test_df , "test"))
+            self.check_compiled_preprocessor_parity(
+                preprocessor_file_path = config.transformed_object_file_path,
+                dataframe = first_test_chunk
+            )
+            
+            # the arrays are on disk only, the trainer memory maps them
+            data_transformation_artifact = DataTransformationArtifact(
+                transformed_object_file_path = config.transformed_object_file_path,
+                transformed_train_data_file_path = config.transformed_train_data_file_path,
+                transformed_test_data_file_path = config.transformed_test_data_file_path,
+                transformed_train_target_file_path = config.transformed_train_target_file_path,
+                transformed_test_target_file_path = config.transformed_test_target_file_path,
+                reference_profile_file_path = config.reference_profile_file_path,
+                preprocessing_object = preprocessor if self.artifact_cache is not None else None
+            )
+            logging.info(f"Train features {train_shape}, test features {test_shape}")
+            logging.info("Exited initiate_chunked_data_transformation method of Data_Transformation class")
+            return data_transformation_artifact
+        
+        except Exception as e:
+            raise UsVisaException(e , sys)
+    
+    def check_compiled_preprocessor_parity(self , preprocessor_file_path : str , dataframe : pd.DataFrame) -> bool:
+        """ 
+        Compiles the saved preprocessor.pkl into the serving fast path and checks that it
+        gives bit-for-bit the same features as the ColumnTransformer on the given dataframe
+        """
+        try:
+            saved_preprocessor = load_object(preprocessor_file_path)
+            compiled_preprocessor = CompiledPreprocessor.compile(saved_preprocessor)
+            is_parity = compiled_preprocessor.verify(saved_preprocessor , dataframe)
+        except Exception as e:
+            logging.info(f"Compiled preprocessor parity check failed: {e}")
+            is_parity = False
+        
+        if not is_parity:
+            logging.info("Compiled preprocessor does not match, serving will use the ColumnTransformer")
+        return is_parity
+    
     def initiate_data_transformation(self , ) -> DataTransformationArtifact:
         """ 
         This method initiates the data transformation component for the pipeline
@@ -94,83 +305,38 @@ class DataTransformation:
             if self.data_validation_artifact.validation_status == True:
                 logging.info("Starting data transformation")
                 
+                if self.data_transformation_config.chunked:
+                    return self.initiate_chunked_data_transformation()
+                
                 # get the preprocessor object
                 preprocessor = self.get_data_transformation_object()
                 logging.info("Got the preprocessor object")
 
                 # get the train and test dataframe
-                train_df = read_csv(self.data_ingestion_artifact.train_file_path)
-                test_df = read_csv(self.data_ingestion_artifact.test_file_path)
+                train_df = read_dataframe_artifact(
+                    self.data_ingestion_artifact.train_file_path , self.data_ingestion_artifact.train_df , self._schema_config
+                )
+                test_df = read_dataframe_artifact(
+                    self.data_ingestion_artifact.test_file_path , self.data_ingestion_artifact.test_df , self._schema_config
+                )
                 logging.info(f"from initiate_data_transformation method: train_df shape [{train_df.shape}]")
                 logging.info(f"from initiate_data_transformation method: test_df shape [{test_df.shape}]")   
                 
-                # removes rows where no_of_employees <= 0 from both train and test data
-                count_rows_removed = train_df.shape[0] 
-                # 2. remove these rows where no_of_employees are 0 or -ve
-                train_df = train_df[train_df['no_of_employees'] > 0]
-                
-                count_rows_removed -= train_df.shape[0]
-                logging.info(f"from train data: rows removed for no_of_employees 0/-ve values: {count_rows_removed}")
-                
-                # also remove from test data frame
-                count_rows_removed = test_df.shape[0] 
-                # 2. remove these rows where no_of_employees are 0 or -ve
-                test_df = test_df[test_df['no_of_employees'] > 0]
-                
-                count_rows_removed -= test_df.shape[0]
-                logging.info(f"from test data: rows removed for no_of_employees 0/-ve values: {count_rows_removed}")
-                
-                             
-                # separete target columns and input features[X , y]
-                input_feature_train_df = train_df.drop(columns = [TARGET_COLUMN] , axis = 1)
-                target_feature_train_df = train_df[TARGET_COLUMN]
-                logging.info("Separeting X and y from train dataframe")
-                
-                # Do the feature engineering task on train dataframe
-                
-                # 1. make the company age column
-                input_feature_train_df['company_age'] = CURRENT_YEAR - input_feature_train_df['yr_of_estab']
-                logging.info("Added company_age column to the Training dataset")
-                
-                
-                
-                # 3. drop the unecessary columns
-                columns_need_to_drop = self._schema_config['drop_columns']
-                logging.info(f"got columns_need_to_drop[count = {len(columns_need_to_drop)}]")
-                
-                input_feature_train_df = drop_columns(df = input_feature_train_df , cols = columns_need_to_drop)
-                logging.info("Dropping unecessary columns from train dataframe")
-                
-                
-                # 4. Do the target value mapping
-                mapper = TargetValueMapping()
-                target_feature_train_df = target_feature_train_df.replace(
-                    mapper._asdict()
-                )
-                logging.info(f"target value mapping done for train target data")
-                
-                # separete target columns and input features[X , y] from test data
-                input_feature_test_df = test_df.drop(columns = [TARGET_COLUMN] , axis = 1)
-                target_feature_test_df = test_df[TARGET_COLUMN]
-                
-                # Do the feature engineering task on test dataframe
-                
-                # 1. make the company age column
-                input_feature_test_df['company_age'] = CURRENT_YEAR - input_feature_test_df['yr_of_estab']
-                logging.info("Added company_age column to the Test dataset")
-                
-                
-                # 3. drop the unecessary columns from test data
-                input_feature_test_df = drop_columns(df = input_feature_test_df , cols = columns_need_to_drop)
-                logging.info("Dropping unecessary columns from test dataframe")
+                # feature engineering: remove rows without employees, add company_age, drop columns, map the target
+                input_feature_train_df , target_feature_train_df = self.get_input_and_target_features(train_df , "train")
+                input_feature_test_df , target_feature_test_df = self.get_input_and_target_features(test_df , "test")
+                logging.info("Feature engineering done on both train and test data")
                 
-                # 4. Do the target value mapping
-                target_feature_test_df = target_feature_test_df.replace(
-                    mapper._asdict()
+                # drift baseline of the train features and target (before resampling), profiled in parallel chunks
+                profile_frame = self.get_profile_frame(input_feature_train_df , target_feature_train_df)
+                reference_profile = ReferenceProfile.from_dataframe(
+                    profile_frame,
+                    column_types = ReferenceProfile.get_column_types(profile_frame , self._schema_config),
+                    compression = self.data_transformation_config.profile_compression,
+                    chunk_size = self.data_transformation_config.profile_chunk_size,
+                    max_workers = self.data_transformation_config.profile_workers
                 )
-                logging.info(f"target value mapping done for test target data")
-                
-                logging.info("Feature engineering done on both train and test data")
+                reference_profile.save(self.data_transformation_config.reference_profile_file_path)
                 
                 # do the fit_transform on train data
                 logging.info("Applying preprocessing object on training dataframe and testing dataframe")
@@ -199,17 +365,13 @@ class DataTransformation:
                 )
                 logging.info("Applied SMOTEENN on testing dataset")
                 
-                logging.info("Created train array and test array")
-                
-                logging.info("concatenating input_feature_train_final arr and target_feature_train_final arr")
-                train_arr = np.c_[
-                    input_feature_train_final, np.array(target_feature_train_final)
-                ]
-                
-                logging.info("concatenating input_feature_test_final arr and target_feature_test_final arr")
-                test_arr = np.c_[
-                    input_feature_test_final, np.array(target_feature_test_final)
-                ]
+                # X and y stay separate arrays (no np.c_ copy), X in the configured dtype
+                array_dtype = np.dtype(self.data_transformation_config.transformed_array_dtype)
+                train_feature_arr = np.ascontiguousarray(input_feature_train_final , dtype = array_dtype)
+                test_feature_arr = np.ascontiguousarray(input_feature_test_final , dtype = array_dtype)
+                train_target_arr = np.asarray(target_feature_train_final , dtype = np.int8)
+                test_target_arr = np.asarray(target_feature_test_final , dtype = np.int8)
+                logging.info(f"Created train array {train_feature_arr.shape} and test array {test_feature_arr.shape} [{array_dtype}]")
                 
                 # save the preprocessor object
                 preprocessor_file_path = self.data_transformation_config.transformed_object_file_path
@@ -222,24 +384,44 @@ class DataTransformation:
                 )
                 logging.info("saved preprocessor object")
                 
+                # the serving fast path must match the saved preprocessor on real rows
+                self.check_compiled_preprocessor_parity(
+                    preprocessor_file_path = preprocessor_file_path,
+                    dataframe = input_feature_test_df
+                )
+                
                 
                 # save the train and test data as numpy array
-                save_numpy_array_data(
-                    file_path = self.data_transformation_config.transformed_train_data_file_path,
-                    array = train_arr
-                )
-                logging.info("saved train arr")
-                save_numpy_array_data(
-                    file_path = self.data_transformation_config.transformed_test_data_file_path,
-                    array = test_arr
-                )
-                logging.info("saved test arr")
+                for file_path , array in [
+                    (self.data_transformation_config.transformed_train_data_file_path , train_feature_arr),
+                    (self.data_transformation_config.transformed_train_target_file_path , train_target_arr),
+                    (self.data_transformation_config.transformed_test_data_file_path , test_feature_arr),
+                    (self.data_transformation_config.transformed_test_target_file_path , test_target_arr)
+                ]:
+                    if self.artifact_cache is not None:
+                        # written in the background, the trainer gets the arrays in memory
+                        self.artifact_cache.persist(
+                            file_path , array,
+                            lambda file_path = file_path , array = array: save_numpy_array_data(file_path = file_path , array = array)
+                        )
+                    else:
+                        save_numpy_array_data(file_path = file_path , array = array)
+                logging.info("saved train arr and test arr")
                 
                 # make the data transformation artifact
+                is_handoff = self.artifact_cache is not None
                 data_transformation_artifact = DataTransformationArtifact(
                     transformed_object_file_path = self.data_transformation_config.transformed_object_file_path,
                     transformed_train_data_file_path = self.data_transformation_config.transformed_train_data_file_path,
-                    transformed_test_data_file_path = self.data_transformation_config.transformed_test_data_file_path
+                    transformed_test_data_file_path = self.data_transformation_config.transformed_test_data_file_path,
+                    transformed_train_target_file_path = self.data_transformation_config.transformed_train_target_file_path,
+                    transformed_test_target_file_path = self.data_transformation_config.transformed_test_target_file_path,
+                    reference_profile_file_path = self.data_transformation_config.reference_profile_file_path,
+                    preprocessing_object = preprocessor if is_handoff else None,
+                    train_feature_arr = train_feature_arr if is_handoff else None,
+                    train_target_arr = train_target_arr if is_handoff else None,
+                    test_feature_arr = test_feature_arr if is_handoff else None,
+                    test_target_arr = test_target_arr if is_handoff else None
                 )
                 logging.info("Exited initiate_data_transformation method of Data_Transformation class")
                 
@@ -1,39 +1,69 @@
-import sys , os , json
+import sys , os , json , time
+from typing import Optional
 
+import numpy as np
 import pandas as pd 
 from pandas import DataFrame
 
-from evidently.model_profile import Profile
-from evidently.model_profile.sections import DataDriftProfileSection
-
 from src.us_visa.exception import UsVisaException
 from src.us_visa.logger import logging
-from src.us_visa.utils.main_utils import read_yaml_file , write_yaml_file , read_csv
+from src.us_visa.utils.main_utils import read_yaml_file , write_yaml_file , write_json_file , read_dataframe_artifact
+from src.us_visa.utils.main_utils import get_feature_engineered_columns , is_feature_engineered
 from src.us_visa.entity.config_entity import DataValidationConfig
 from src.us_visa.entity.artifact_entity import DataIngestionArtifact , DataValidationArtifact
-from src.us_visa.constants import SCHEMA_FILE_PATH
+from src.us_visa.entity.artifact_cache import ArtifactCache
+from src.us_visa.entity.drift_detector import DriftDetector , get_compact_drift_report
+from src.us_visa.entity.reference_profile import ReferenceProfile
+from src.us_visa.entity.schema_validator import SchemaValidator
+from src.us_visa.entity.estimator import TargetValueMapping
+from src.us_visa.constants import SCHEMA_FILE_PATH , TARGET_COLUMN , CURRENT_YEAR
 import warnings
 warnings.filterwarnings("ignore")
 
 
 
 class DataValidation:
-    def __init__(self , data_ingestion_artifact : DataIngestionArtifact , data_validation_config: DataValidationConfig):
+    def __init__(self , data_ingestion_artifact : DataIngestionArtifact , data_validation_config: DataValidationConfig ,
+                 artifact_cache : Optional[ArtifactCache] = None):
         try:
             self.data_ingestion_artifact = data_ingestion_artifact
             self.data_validation_config = data_validation_config
+            self.artifact_cache = artifact_cache
+            # drift report write time and size, handed to the stage timing through the artifact
+            self.stage_details = {}
             # read the schema file
             logging.info("reading the schema file from DataValidation")
             self._schema_config = read_yaml_file(SCHEMA_FILE_PATH)
             logging.info("reading the schema file from DataValidation is done")
+            self.schema_validator = SchemaValidator.from_schema(self._schema_config)
         except Exception as e:
             raise UsVisaException(e , sys)     
     
     
+    def get_expected_columns(self , dataframe: DataFrame , columns: list) -> list:
+        """ 
+        Returns the given schema columns as they appear in the dataframe: for a dataset exported with
+        the feature pushdown yr_of_estab is company_age and the drop columns are optional
+        """
+        if not is_feature_engineered(dataframe):
+            return columns
+        engineered_columns = get_feature_engineered_columns(self._schema_config)
+        return [
+            "company_age" if column == "yr_of_estab" else column
+            for column in columns
+            if column in engineered_columns or column == "yr_of_estab"
+        ]
+    
     # validatate number of columns
     def validate_number_of_columns(self , dataframe: DataFrame) -> bool:
         try:
-            total_columns_in_schema = len(self._schema_config['columns'])
+            if is_feature_engineered(dataframe):
+                # the drop columns kept by the ingestion (dedup column, split key) may be there too
+                total_columns_in_schema = len(get_feature_engineered_columns(
+                    self._schema_config , keep_columns = [column for column in self._schema_config['drop_columns'] if column in dataframe.columns]
+                ))
+            else:
+                total_columns_in_schema = len(self._schema_config['columns'])
             total_columns_in_dataframe = len(dataframe.columns)
             
             is_all_column_present = total_columns_in_schema == total_columns_in_dataframe
@@ -48,7 +78,7 @@ class DataValidation:
     def validate_all_numerical_column_exists(self , dataframe: DataFrame) -> bool:
         dataframe_columns = dataframe.columns.to_list()
         
-        schema_numerical_columns = self._schema_config['numerical_columns']
+        schema_numerical_columns = self.get_expected_columns(dataframe , self._schema_config['numerical_columns'])
         
         missing_numerical_columns = []
         
@@ -66,7 +96,7 @@ class DataValidation:
     # Validate all categorical columns exists
     def validate_all_categorical_column_exists(self , dataframe: DataFrame) -> bool:
         dataframe_columns = dataframe.columns.to_list()
-        schema_categorical_columns = self._schema_config['categorical_columns']
+        schema_categorical_columns = self.get_expected_columns(dataframe , self._schema_config['categorical_columns'])
         
         missing_categorical_columns = []
         
@@ -100,6 +130,92 @@ class DataValidation:
             raise UsVisaException(e , sys)
         
         
+    def get_evidently_drift_report(self , reference_df: DataFrame , current_df: DataFrame) -> dict:
+        """ 
+        Runs the evidently DataDriftProfileSection and returns its json report
+        """
+        # evidently is slow to import, it is only loaded when it is used
+        from evidently.model_profile import Profile
+        from evidently.model_profile.sections import DataDriftProfileSection
+        
+        # create the profile
+        data_drift_profile = Profile(sections = [DataDriftProfileSection()]) 
+        data_drift_profile.calculate(reference_data = reference_df , current_data = current_df)
+        
+        # make the report as json
+        return json.loads(data_drift_profile.json())
+    
+    def check_evidently_parity(self , reference_df: DataFrame , current_df: DataFrame , drift_report: dict) -> bool:
+        """ 
+        Runs evidently on the same dataframes and checks that it makes the same decisions as the
+        native drift report: dataset drift, number of drifted columns, and per column drift and score
+        """
+        metrics = self.get_evidently_drift_report(reference_df , current_df)["data_drift"]["data"]["metrics"]
+        
+        mismatches = []
+        for key in ["dataset_drift" , "n_features" , "n_drifted_features"]:
+            if metrics[key] != drift_report[key]:
+                mismatches.append(f"{key}: evidently {metrics[key]} , native {drift_report[key]}")
+        
+        for column , result in drift_report["features"].items():
+            evidently_result = metrics[column]
+            if evidently_result["drift_detected"] != result["drift_detected"] or \
+               not np.isclose(evidently_result["drift_score"] , result["drift_score"] , rtol = 1e-6 , atol = 1e-12):
+                mismatches.append(
+                    f"{column}: evidently {evidently_result['stattest_name']} {evidently_result['drift_score']} "
+                    f"{evidently_result['drift_detected']} , native {result['stattest']} {result['drift_score']} {result['drift_detected']}"
+                )
+        
+        if len(mismatches) > 0:
+            logging.info(f"Native drift report differs from evidently: {mismatches}")
+        else:
+            logging.info("Native drift report matches evidently")
+        return len(mismatches) == 0
+    
+    @staticmethod
+    def get_evidently_features(metrics : dict) -> dict:
+        """ 
+        Returns the per column results of an evidently report in the DriftDetector format, the
+        score of a test is a p-value or a distance depending on the stattest
+        """
+        features = {}
+        for column , result in metrics.items():
+            if not isinstance(result , dict) or "drift_score" not in result:
+                continue
+            is_p_value = "p_value" in result["stattest_name"]
+            features[column] = {
+                "stattest": result["stattest_name"],
+                "drift_score": result["drift_score"],
+                "statistic": None if is_p_value else result["drift_score"],
+                "p_value": result["drift_score"] if is_p_value else None,
+                "drift_detected": result["drift_detected"],
+            }
+        return features
+    
+    def write_drift_report(self , compact_report : dict , get_details) -> None:
+        """ 
+        Writes the compact drift report as json and records its write time and size. The detailed
+        report is only made when it is configured: get_details is called by the writer, in the
+        background when the run has an artifact cache
+        """
+        config = self.data_validation_config
+        
+        start_time = time.perf_counter()
+        report_size = write_json_file(config.data_drift_report_file_path , compact_report)
+        write_seconds = time.perf_counter() - start_time
+        self.stage_details.update({
+            "drift_report_write_seconds": write_seconds,
+            "drift_report_size_bytes": report_size,
+        })
+        logging.info(f"Drift report written in {write_seconds:.3f}s [{report_size} bytes]")
+        
+        if config.drift_report_details:
+            write_details = lambda: write_json_file(config.drift_report_details_file_path , get_details())
+            if self.artifact_cache is not None:
+                self.artifact_cache.persist(config.drift_report_details_file_path , None , write_details)
+            else:
+                write_details()
+    
     # now detect data drift
     def detect_dataset_drift(self , reference_df: DataFrame , current_df: DataFrame) -> bool:
         """ 
@@ -108,31 +224,51 @@ class DataValidation:
         """
         
         try:
-            # create the profile
-            data_drift_profile = Profile(sections = [DataDriftProfileSection()]) 
-            data_drift_profile.calculate(reference_data = reference_df , current_data = current_df)
-            
-            # make the report as json
-            report = data_drift_profile.json()
-            json_report = json.loads(report)
-            
-            # make the directory where report will be saved
-            validation_dir = os.path.dirname(self.data_validation_config.data_drift_report_file_path)
-            
-            logging.info(f"validation_dir: [{validation_dir}]")
-            os.makedirs(validation_dir , exist_ok = True) 
-            # save the json_report as a yaml file
-            write_yaml_file(
-                file_path = self.data_validation_config.data_drift_report_file_path,
-                content = json_report
-            )
+            config = self.data_validation_config
+            
+            if config.drift_engine == "evidently":
+                json_report = self.get_evidently_drift_report(reference_df , current_df)
+                metrics = json_report["data_drift"]["data"]["metrics"]
+                n_features = metrics["n_features"]
+                n_drifted_features = metrics["n_drifted_features"]
+                drift_status = metrics["dataset_drift"]
+                
+                compact_report = get_compact_drift_report({
+                    "dataset_drift": drift_status,
+                    "n_features": n_features,
+                    "n_drifted_features": n_drifted_features,
+                    "share_drifted_features": metrics["share_drifted_features"],
+                    "features": self.get_evidently_features(metrics),
+                })
+                # the evidently report is already made, its bins and distributions are the details
+                get_details = lambda: json_report
+            elif config.drift_engine == "native":
+                drift_detector = DriftDetector.from_schema(
+                    self._schema_config , drift_share = config.drift_share , max_workers = config.drift_workers
+                )
+                json_report = drift_detector.detect(reference_df , current_df)
+                n_features = json_report["n_features"]
+                n_drifted_features = json_report["n_drifted_features"]
+                drift_status = json_report["dataset_drift"]
+                
+                if config.drift_parity_check:
+                    self.check_evidently_parity(reference_df , current_df , json_report)
+                
+                compact_report = get_compact_drift_report(json_report)
+                # the bins are only computed when the details are written
+                get_details = lambda: {
+                    **json_report,
+                    "bins": drift_detector.get_feature_bins(reference_df , current_df , n_bins = config.drift_report_bins),
+                }
+            else:
+                raise ValueError(f"Unknown drift engine [{config.drift_engine}], expected \"native\" or \"evidently\"")
+            
+            logging.info(f"validation_dir: [{os.path.dirname(config.data_drift_report_file_path)}]")
+            self.write_drift_report(compact_report , get_details)
             
-            n_features = json_report["data_drift"]["data"]["metrics"]["n_features"]
-            n_drifted_features = json_report["data_drift"]["data"]["metrics"]["n_drifted_features"]
             data_drift_percentage = (n_drifted_features / n_features) * 100
             logging.info(f"Out of {n_features} columns data drift detected in {n_drifted_features} columns")
             logging.info(f"Data Drift percentage: {data_drift_percentage} %")
-            drift_status = json_report["data_drift"]["data"]["metrics"]["dataset_drift"]
             
             # drift_status == False if no data drift -> everthing is okay
             # drift_status == True -> Data Drift detected 
@@ -140,6 +276,67 @@ class DataValidation:
         except Exception as e:
             raise UsVisaException(e , sys)
     
+    def validate_row_values(self , train_df: DataFrame , test_df: DataFrame) -> bool:
+        """ 
+        Checks every value of the train and test data against the category values and numerical
+        ranges of the schema, chunk by chunk. The violation counts and examples are saved next to
+        the drift report. Returns False when a split has too many missing values or invalid rows.
+        """
+        try:
+            logging.info("Entered into validate_row_values")
+            config = self.data_validation_config
+            
+            schema_report = {}
+            for split_name , dataframe in [("train" , train_df) , ("test" , test_df)]:
+                chunks = (
+                    dataframe.iloc[start : start + config.schema_chunk_size]
+                    for start in range(0 , len(dataframe) , config.schema_chunk_size)
+                )
+                schema_report[split_name] = self.schema_validator.validate_chunks(chunks)
+            
+            write_yaml_file(file_path = config.schema_report_file_path , content = schema_report , replace = True)
+            
+            status = all(summary["is_valid"] for summary in schema_report.values())
+            logging.info(f"Row value validation status is [{status}]")
+            return status
+        except Exception as e:
+            raise UsVisaException(e , sys)
+    
+    def compare_with_reference_profile(self , dataframe: DataFrame) -> dict:
+        """ 
+        Compares the dataframe with the reference profile of a previously trained model, only the
+        saved sketches are read. The report is saved next to the drift report and does not change
+        the validation status. Returns None when no reference profile is configured.
+        """
+        config = self.data_validation_config
+        if config.reference_profile_file_path is None:
+            return None
+        if not os.path.exists(config.reference_profile_file_path):
+            logging.info(f"Reference profile [{config.reference_profile_file_path}] not found, skipping the comparison")
+            return None
+        
+        try:
+            reference_profile = ReferenceProfile.load(config.reference_profile_file_path)
+            
+            # the profile holds the model input and the mapped target, engineered like DataTransformation does
+            dataframe = dataframe[dataframe['no_of_employees'] > 0]
+            if 'company_age' not in dataframe.columns:
+                dataframe = dataframe.assign(company_age = CURRENT_YEAR - dataframe['yr_of_estab'])
+            dataframe = dataframe.assign(**{
+                TARGET_COLUMN : dataframe[TARGET_COLUMN].astype(object).replace(TargetValueMapping()._asdict())
+            })
+            
+            report = reference_profile.compare(dataframe , drift_share = config.drift_share)
+            write_json_file(config.reference_drift_report_file_path , get_compact_drift_report(report))
+            logging.info(
+                f"Drift against the reference profile: {report['n_drifted_features']} of {report['n_features']} columns, "
+                f"dataset drift {report['dataset_drift']}"
+            )
+            return report
+        except Exception as e:
+            logging.info(f"Comparison with the reference profile failed: {e}")
+            return None
+    
     def initiate_data_validation(self) -> DataValidationArtifact:
         """ 
         This method initiates the data validation component for the pipeline
@@ -150,8 +347,12 @@ class DataValidation:
             validation_error_msg = ""
             
             # get the train and test data
-            train_df = read_csv(self.data_ingestion_artifact.train_file_path)
-            test_df = read_csv(self.data_ingestion_artifact.test_file_path)
+            train_df = read_dataframe_artifact(
+                self.data_ingestion_artifact.train_file_path , self.data_ingestion_artifact.train_df , self._schema_config
+            )
+            test_df = read_dataframe_artifact(
+                self.data_ingestion_artifact.test_file_path , self.data_ingestion_artifact.test_df , self._schema_config
+            )
             
             logging.info(f"train_df data shape: {train_df.shape}")
             logging.info(f"test_df data shape: {test_df.shape}")
@@ -169,11 +370,17 @@ class DataValidation:
             # column validation status
             column_validation_status = train_data_column_validity and test_data_column_validity
             
+            # the values are only checked once the columns are there
+            if column_validation_status and not self.validate_row_values(train_df , test_df):
+                validation_error_msg += "[Row values break the schema, see the schema report.]"
+                column_validation_status = False
+            
             # if column_validation_status is OK then start data drift
             if column_validation_status:
                 drift_status = self.detect_dataset_drift(
                     reference_df = train_df , current_df = test_df
                 )
+                self.compare_with_reference_profile(train_df)
                 
                 # if data drift detected 
                 if drift_status:
@@ -193,7 +400,9 @@ class DataValidation:
             data_validation_artifact = DataValidationArtifact(
                 validation_status = data_validation_status,
                 message = validation_error_msg,
-                drift_report_file_path = self.data_validation_config.data_drift_report_file_path
+                drift_report_file_path = self.data_validation_config.data_drift_report_file_path,
+                schema_report_file_path = self.data_validation_config.schema_report_file_path,
+                stage_details = self.stage_details
             )
             
             logging.info(f"Data validation artifact: {data_validation_artifact}")
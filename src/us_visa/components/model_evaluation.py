@@ -6,12 +6,13 @@ from sklearn.metrics import f1_score # we will evaluate models based one f1_scor
 
 from src.us_visa.exception import UsVisaException
 from src.us_visa.logger import logging
-from src.us_visa.constants import TARGET_COLUMN , CURRENT_YEAR
+from src.us_visa.constants import TARGET_COLUMN , CURRENT_YEAR , SCHEMA_FILE_PATH
 from src.us_visa.entity.s3_estimator import USvisaEstimator
 from src.us_visa.entity.estimator import UsVisaModel
 from src.us_visa.entity.estimator import TargetValueMapping
-from us_visa.entity.artifact_entity import DataIngestionArtifact, ModelEvaluationArtifact, ModelTrainerArtifact
-from us_visa.entity.config_entity import ModelEvaluationConfig
+from src.us_visa.utils.main_utils import read_dataframe_artifact , read_yaml_file , drop_columns
+from src.us_visa.entity.artifact_entity import DataIngestionArtifact, ModelEvaluationArtifact, ModelTrainerArtifact
+from src.us_visa.entity.config_entity import ModelEvaluationConfig
 
 
 
@@ -32,6 +33,7 @@ class ModelEvaluation:
             self.model_evaluation_config = model_evaluation_config
             self.data_ingestion_artifact = data_ingestion_artifact
             self.model_trainer_artifact = model_trainer_artifact
+            self._schema_config = read_yaml_file(file_path = SCHEMA_FILE_PATH)
         except Exception as e:
             raise UsVisaException(e , sys) from e
 
@@ -69,7 +71,9 @@ class ModelEvaluation:
         
         try:
             # load the test dataframe
-            test_df = pd.read_csv(self.data_ingestion_artifact.test_file_path)
+            test_df = read_dataframe_artifact(
+                self.data_ingestion_artifact.test_file_path , self.data_ingestion_artifact.test_df , self._schema_config
+            )
             
             # drop any row if needed[check feature engineering]
             # 2. remove these rows where no_of_employees are 0 or -ve
@@ -78,17 +82,20 @@ class ModelEvaluation:
             count_rows_removed -= test_df.shape[0]
             logging.info(f"from test_df data: rows removed for no_of_employees 0/-ve values: {count_rows_removed}")
             
-            # Find the company age
-            test_df['company_age'] = CURRENT_YEAR - test_df['yr_of_estab']
-            # drop columns 
-            test_df = test_df.drop(columns = ['yr_of_estab'] , axis = 1)
+            # Find the company age (already there when the export pushed the feature engineering down)
+            if 'company_age' not in test_df.columns:
+                test_df = test_df.assign(company_age = CURRENT_YEAR - test_df['yr_of_estab'])
             
             # seperate feature and target
             logging.info("seperate input feature and target from test data")
-            X_test , y_test = test_df[ : , : -1] , test_df[ : , -1]
+            X_test , y_test = test_df.drop(columns = [TARGET_COLUMN]) , test_df[TARGET_COLUMN]
+            
+            # drop columns (yr_of_estab, case_id), the ones kept by the export may be there too
+            columns_need_to_drop = [column for column in self._schema_config['drop_columns'] if column in X_test.columns]
+            X_test = drop_columns(df = X_test , cols = columns_need_to_drop)
             
-            #  do the target value mapping
-            y_test = y_test.replace(TargetValueMapping._asdict())
+            #  do the target value mapping, the target is read as category
+            y_test = y_test.astype(object).replace(TargetValueMapping()._asdict()).infer_objects()
             
             # get the f1_score of trained model
             trained_model_f1_score = self.model_trainer_artifact.metric_artifact.f1_score
@@ -106,12 +113,13 @@ class ModelEvaluation:
             
             temp_best_model_score = 0 if best_model_f1_score is None else best_model_f1_score
             
-            is_model_accepted = best_model_f1_score > trained_model_f1_score
-            f1_score_difference = trained_model_f1_score - best_model_f1_score
+            # without a model in the bucket the trained model is compared with a score of 0
+            is_model_accepted = trained_model_f1_score > temp_best_model_score
+            f1_score_difference = trained_model_f1_score - temp_best_model_score
             
             # make the EvaluateModelResponse object to model pusher
             result = EvaluateModelResponse(
-                trained_model_f1_score = temp_best_model_score,
+                trained_model_f1_score = trained_model_f1_score,
                 cloud_model_f1_score = best_model_f1_score,
                 is_model_accepted = is_model_accepted , 
                 f1_score_difference = f1_score_difference
@@ -137,6 +145,7 @@ class ModelEvaluation:
                is_model_accepted = evaluate_model_response.is_model_accepted,
                s3_model_path = s3_model_path , 
                trained_model_path = self.model_trainer_artifact.trained_model_file_path,
+               reference_profile_path = self.model_trainer_artifact.reference_profile_file_path,
                changed_accuracy = evaluate_model_response.f1_score_difference
             )
             
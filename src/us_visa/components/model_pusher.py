@@ -34,10 +34,18 @@ class ModelPusher:
             self.usvisa_estimator.save_model(
                 from_file = self.model_evaluation_artifact.trained_model_path
             )
+            # the drift baseline of the model is kept under its own key next to the model
+            self.s3.upload_file(
+                self.model_evaluation_artifact.reference_profile_path,
+                to_filename = self.model_pusher_config.s3_reference_profile_key_path,
+                bucket_name = self.model_pusher_config.bucket_name,
+                remove = False
+            )
             
             model_pusher_artifact = ModelPusherArtifact(
                 bucket_name = self.model_pusher_config.bucket_name,
-                s3_model_path = self.model_pusher_config.s3_model_key_path
+                s3_model_path = self.model_pusher_config.s3_model_key_path,
+                s3_reference_profile_path = self.model_pusher_config.s3_reference_profile_key_path
             )
             
             logging.info("Uploaded artifacts folder to s3 bucket")
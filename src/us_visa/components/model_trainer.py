@@ -1,4 +1,5 @@
 import sys
+import shutil
 from typing import Tuple
 
 import numpy as np
@@ -24,22 +25,17 @@ class ModelTrainer:
         self.data_transformation_artifact = data_transformation_artifact
         self.model_trainer_config = model_trainer_config
     
-    def get_model_object_and_report(self , train: np.array , test: np.array) -> Tuple[object , object]:
+    def get_model_object_and_report(self , X_train: np.array , y_train: np.array ,
+                                    X_test: np.array , y_test: np.array) -> Tuple[object , object]:
         """ 
         Description :   This function uses ModelFactory to get the best model object and report of the best model.
+        The arrays are used as given (in memory or memory-mapped), no copy is made here.
         Returns metric artifact object and best model object
         """
         
         try:
             logging.info("Entered into get_model_object_and_report method of ModelTrainer class")
-            
-            # 1. seperate input feature and target from train data
-            logging.info("1. seperate input feature and target from train data")
-            X_train , y_train = train[ : , : -1] , train[ : , -1]
-            
-            # 2. seperate input feature and target from test data
-            logging.info("2. seperate input feature and target from test data")
-            X_test , y_test = test[ : , : -1] , test[ : , -1]
+            logging.info(f"X_train {X_train.shape} [{X_train.dtype}] , X_test {X_test.shape} [{X_test.dtype}]")
             
             # 3. use ModelFactory to get the best model object
             
@@ -109,17 +105,22 @@ class ModelTrainer:
         try:
             logging.info("Entered initiate_model_trainer method of ModelTrainer class")
             
-            # 1. load the train and test numpy array
-            train_arr = load_numpy_array_data(
-                file_path = self.data_transformation_artifact.transformed_train_data_file_path
-            )
-            test_arr = load_numpy_array_data(
-                file_path = self.data_transformation_artifact.transformed_test_data_file_path
-            )
+            # 1. get the train and test arrays: handed over in memory when available,
+            # otherwise memory-mapped from the .npy files (read-only, nothing is copied)
+            artifact = self.data_transformation_artifact
+            arrays = []
+            for array , file_path in [
+                (artifact.train_feature_arr , artifact.transformed_train_data_file_path),
+                (artifact.train_target_arr , artifact.transformed_train_target_file_path),
+                (artifact.test_feature_arr , artifact.transformed_test_data_file_path),
+                (artifact.test_target_arr , artifact.transformed_test_target_file_path)
+            ]:
+                arrays.append(array if array is not None else load_numpy_array_data(file_path = file_path , mmap_mode = "r"))
+            X_train , y_train , X_test , y_test = arrays
             
             # 2. call  get_model_object_and_report to get the best model
             best_model_detail , metric_artifact = self.get_model_object_and_report(
-                train = train_arr , test = test_arr
+                X_train = X_train , y_train = y_train , X_test = X_test , y_test = y_test
             )
             
             # 3. check best model accepted or not based on expected_accuracy_score
@@ -130,7 +131,9 @@ class ModelTrainer:
             # 4. Call UsVisaModel to combine preproccessor and best model
             # load the preprocessing object
             logging.info("load the preprocessing object for merging with best model")
-            preprocessing_object = load_object(self.data_transformation_artifact.transformed_object_file_path)
+            preprocessing_object = self.data_transformation_artifact.preprocessing_object
+            if preprocessing_object is None:
+                preprocessing_object = load_object(self.data_transformation_artifact.transformed_object_file_path)
             
             usvisa_model = UsVisaModel(
                 preprocessing_object = preprocessing_object , trained_model_object = best_model_detail.best_model
@@ -143,12 +146,20 @@ class ModelTrainer:
             )
             logging.info("Created usvisa model object with preprocessor and model")
             
+            # the drift baseline goes with the model
+            shutil.copyfile(
+                self.data_transformation_artifact.reference_profile_file_path,
+                self.model_trainer_config.reference_profile_file_path
+            )
+            logging.info(f"Copied the reference profile to [{self.model_trainer_config.reference_profile_file_path}]")
+            
             
             # 6. construct the model trainer artifact
             model_trainer_artifact = ModelTrainerArtifact(
                 trained_model_file_path = self.model_trainer_config.trained_model_file_path,
                 metric_artifact = metric_artifact,
-                tuned_model_report_file_path = self.model_trainer_config.tuned_model_report_file_path
+                tuned_model_report_file_path = self.model_trainer_config.tuned_model_report_file_path,
+                reference_profile_file_path = self.model_trainer_config.reference_profile_file_path
             )
             # 7. return the model trainer artifact
             return model_trainer_artifact
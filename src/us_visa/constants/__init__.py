@@ -6,12 +6,17 @@ load_dotenv()
 
 DATABASE_NAME = "US_VISA"
 COLLECTION_NAME = "visa_data"
+# documents fetched per round trip when the collection is exported
+MONGODB_EXPORT_BATCH_SIZE : int = 10000
 
 FILE_NAME = "usvisa.csv" # Raw data file name
 
 MONGODB_URL_KEY = os.getenv("mongodb_url")
 
 PIPELINE_NAME : str = "usvisa"
+# stages hand their outputs to the next stage in memory, the files are written in the background
+ARTIFACT_IN_MEMORY_HANDOFF : bool = True
+ARTIFACT_PERSIST_WORKERS : int = 2
 
 ARTIFACT_DIR : str = "artifact"
 
@@ -20,6 +25,8 @@ TEST_FILE_NAME = "test.csv"
 
 PREPROCESSOR_OBJECT_FILE_NAME = "preprocessor.pkl"
 MODEL_FILE_NAME = "model.pkl"
+# drift baseline of the model input, saved next to the model
+REFERENCE_PROFILE_FILE_NAME = "reference_profile.json"
 
 
 TARGET_COLUMN = "case_status"
@@ -31,6 +38,10 @@ AWS_ACCESS_KEY_ID_ENV_KEY = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY_ENV_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 REGION_NAME = "us-east-1"
 
+# downloaded models are kept on the local disk and revalidated with their ETag
+LOCAL_MODEL_CACHE_DIR : str = os.getenv("USVISA_MODEL_CACHE_DIR" , os.path.join(ARTIFACT_DIR , "model_cache"))
+LOCAL_MODEL_CACHE_MAX_SIZE_BYTES : int = 2 * 1024 * 1024 * 1024
+
 
 
 
@@ -40,13 +51,59 @@ DATA_INGESTION_DIR_NAME : str = "data_ingestion"
 DATA_INGESTION_FEATURE_STORE_DIR : str = "feature_store"
 DATA_INGESTION_INGESTED_DIR : str = "ingested"
 DATA_INGESTION_TRAIN_TEST_SPLIT_RATIO : str = 0.2 # test size
+# file format of the feature store and the train/test splits: "parquet", "feather" or "csv"
+DATA_INGESTION_ARTIFACT_FORMAT : str = "parquet"
+ARTIFACT_FORMAT_EXTENSIONS : dict = {"csv": ".csv", "parquet": ".parquet", "feather": ".feather"}
+ARTIFACT_COMPRESSION : str = "zstd"
+# the collection is read as this many _id ranges, by this many threads
+DATA_INGESTION_EXPORT_PARTITIONS : int = 8
+DATA_INGESTION_EXPORT_WORKERS : int = 4
+# incremental mode keeps one feature store across runs and only fetches the documents
+# whose watermark field is above the value saved by the previous run
+DATA_INGESTION_INCREMENTAL : bool = False
+DATA_INGESTION_INCREMENTAL_STORE_DIR : str = os.path.join(ARTIFACT_DIR , "incremental_feature_store")
+DATA_INGESTION_WATERMARK_FILE_NAME : str = "watermark.json"
+DATA_INGESTION_WATERMARK_FIELD : str = "_id"
+DATA_INGESTION_DEDUP_COLUMN : str = "case_id"
+# "random": train_test_split of the whole dataframe, "hash": every record goes to train or test
+# by a stable hash of the key column, so a record never changes sides between runs
+DATA_INGESTION_SPLIT_METHOD : str = "random"
+DATA_INGESTION_SPLIT_KEY_COLUMN : str = "case_id"
+# column the hash split is stratified on, None for a plain hash split
+DATA_INGESTION_SPLIT_STRATIFY_COLUMN : str = None
+DATA_INGESTION_SPLIT_HASH_BUCKETS : int = 10000
+# 16 character siphash key of the split, changing it reshuffles every record
+DATA_INGESTION_SPLIT_HASH_KEY : str = "usvisa-split-key"
+DATA_INGESTION_SPLIT_CHUNK_SIZE : int = 100000
+# run the feature engineering (no_of_employees filter, company_age, drop columns) as a mongodb
+# aggregation pipeline, the feature store then holds the engineered columns
+DATA_INGESTION_FEATURE_PUSHDOWN : bool = False
 
 
 
 # Data Validation realted contant start with DATA_VALIDATION 
 DATA_VALIDATION_DIR_NAME : str = "data_validation"
 DATA_VALIDATION_DRIFT_REPORT_DIR : str = "drift_report"
-DATA_VALIDATION_DRIFT_REPORT_FILE_NAME : str = "report.yaml"
+# compact drift report: dataset decision and per feature stattest, statistic, p-value and drift flag
+DATA_VALIDATION_DRIFT_REPORT_FILE_NAME : str = "report.json"
+# the distributions behind the report (the full evidently report with the evidently engine) are only
+# written when asked, in the background when the run has an artifact cache
+DATA_VALIDATION_DRIFT_REPORT_DETAILS : bool = False
+DATA_VALIDATION_DRIFT_REPORT_DETAILS_FILE_NAME : str = "report_details.json"
+DATA_VALIDATION_DRIFT_REPORT_BINS : int = 10
+# "native": numpy drift tests of DriftDetector, "evidently": evidently DataDriftProfileSection
+DATA_VALIDATION_DRIFT_ENGINE : str = "native"
+# the dataset drifts when at least this share of the columns drifts
+DATA_VALIDATION_DRIFT_SHARE : float = 0.5
+DATA_VALIDATION_DRIFT_WORKERS : int = 4
+# also run evidently and log the columns where the two engines disagree
+DATA_VALIDATION_DRIFT_PARITY_CHECK : bool = False
+# reference profile of a previously trained model to also compare the new train data against, None to skip
+DATA_VALIDATION_REFERENCE_PROFILE_FILE_PATH : str = None
+DATA_VALIDATION_REFERENCE_DRIFT_REPORT_FILE_NAME : str = "reference_drift_report.json"
+# row level check of the values against category_values / numerical_ranges of schema.yaml
+DATA_VALIDATION_SCHEMA_REPORT_FILE_NAME : str = "schema_report.yaml"
+DATA_VALIDATION_SCHEMA_CHUNK_SIZE : int = 100000
 
 
 
@@ -55,6 +112,22 @@ DATA_VALIDATION_DRIFT_REPORT_FILE_NAME : str = "report.yaml"
 DATA_TRANSFORMATION_DIR_NAME : str = "data_transformation"
 DATA_TRANSFORMATION_TRANSFORMED_DATA_DIR : str = "transformed_data"
 DATA_TRANSFORMATION_TRANSFORMED_OBJECT_DIR : str = "transformed_object"
+# features (X) and target (y) are saved as separate .npy files, the features in this dtype
+DATA_TRANSFORMATION_TRAIN_TARGET_FILE_NAME : str = "train_target.npy"
+DATA_TRANSFORMATION_TEST_TARGET_FILE_NAME : str = "test_target.npy"
+DATA_TRANSFORMATION_ARRAY_DTYPE : str = "float32"
+# chunked mode fits the preprocessor from streamed chunks and transforms chunk by chunk into
+# .npy files on disk, for training data that does not fit in memory
+DATA_TRANSFORMATION_CHUNKED : bool = False
+DATA_TRANSFORMATION_CHUNK_SIZE : int = 100000
+# rows sampled from the stream to estimate the PowerTransformer lambdas
+DATA_TRANSFORMATION_RESERVOIR_SIZE : int = 100000
+DATA_TRANSFORMATION_CHUNKS_DIR : str = "chunks"
+# the reference profile keeps a t-digest of about compression / 2 centroids per numeric column,
+# it is built from chunks of this many rows on this many threads
+DATA_TRANSFORMATION_PROFILE_COMPRESSION : int = 200
+DATA_TRANSFORMATION_PROFILE_CHUNK_SIZE : int = 100000
+DATA_TRANSFORMATION_PROFILE_WORKERS : int = 4
 
 
 # Model Trainer realted contant start with MODEL_TRAINER
@@ -82,10 +155,39 @@ MODEL_PUSHER_S3_KEY = "model-registry"
 # Prediction Pipeline Constants for web app
 APP_HOST = "0.0.0.0"
 APP_PORT = 8080
+# how often (in seconds) the resident model checks s3 for a new model version
+MODEL_CACHE_REFRESH_INTERVAL_SECONDS : int = 60
+# frames up to this many rows skip the ColumnTransformer and use the compiled preprocessor
+PREDICTION_FAST_PATH_MAX_ROWS : int = 256
+# predictions cached per model version, keyed on the normalized applicant features
+PREDICTION_CACHE_MAX_SIZE : int = 100000
+PREDICTION_CACHE_TTL_SECONDS : int = 3600
+# single row requests are collected for at most this long (or this many rows) before one batched predict
+PREDICTION_MICRO_BATCH_MAX_SIZE : int = 64
+PREDICTION_MICRO_BATCH_MAX_WAIT_MS : float = 2.0
+# blocking inference runs on a bounded pool ("thread" or "process"), extra requests get a 503
+PREDICTION_EXECUTOR_KIND : str = "thread"
+PREDICTION_EXECUTOR_MAX_WORKERS : int = 4
+PREDICTION_EXECUTOR_MAX_PENDING : int = 32
+# synthetic predictions run at startup before /ready reports the worker as ready
+PREDICTION_WARMUP_ROUNDS : int = 3
+PREDICTION_WARMUP_RETRY_SECONDS : int = 10
+# the scored features and predictions are profiled over a sliding window of this many seconds (in
+# this many buckets), /monitoring/drift compares the window with the reference profile of the model
+DRIFT_MONITOR_ENABLED : bool = True
+DRIFT_MONITOR_WINDOW_SECONDS : int = 3600
+DRIFT_MONITOR_WINDOW_BUCKETS : int = 12
+# rows buffered per thread before they are folded into the sketches
+DRIFT_MONITOR_FLUSH_ROWS : int = 256
+# rows the window needs before it is compared with the reference
+DRIFT_MONITOR_MIN_ROWS : int = 200
+DRIFT_MONITOR_DRIFT_SHARE : float = 0.5
+# status files of the training jobs started from the web app
+TRAINING_JOBS_DIR : str = os.path.join(ARTIFACT_DIR , "training_jobs")
 
 """ 
 dummy for wandb[Update when we use it]
 """
-MODEL_EVALUATION_DIR = None
-CLOUD_MODEL_DIR = None
+MODEL_EVALUATION_DIR = "model_evaluation"
+CLOUD_MODEL_DIR = "cloud_model"
 CLOUD_ARTIFACTS = None
\ No newline at end of file
@@ -1,48 +1,252 @@
-import sys 
-import pandas as pd 
+import sys
+import time
+import pandas as pd
 import numpy as np
-from typing import Optional
+from array import array
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict , Iterable , List , Optional
+from pandas.api.types import union_categoricals
 
 from src.us_visa.configuration.mongo_db_connection import MongoDbClient
+from src.us_visa.constants import SCHEMA_FILE_PATH , MONGODB_EXPORT_BATCH_SIZE , CURRENT_YEAR
 from src.us_visa.exception import UsVisaException
+from src.us_visa.logger import logging
+from src.us_visa.utils.main_utils import read_yaml_file , get_feature_engineered_columns , narrow_integral
+
+
+# values stored in the collection for a missing field
+MISSING_VALUES = ("na" , "")
+
+
+def _is_missing(value) -> bool:
+    # value != value is only True for NaN
+    return value is None or value != value or (isinstance(value , str) and value in MISSING_VALUES)
 
 
 class USvisaData:
-    """ 
+    """
     This class helps to export entire mongo db record as pandas dataframe
     """
-    
-    def __init__(self):
+
+    def __init__(self , mongo_client : Optional[MongoDbClient] = None , batch_size : int = MONGODB_EXPORT_BATCH_SIZE):
         # get the client
-        try: 
-           self.mongo_client = MongoDbClient()
+        try:
+           self.mongo_client = mongo_client if mongo_client is not None else MongoDbClient()
+           self.batch_size = batch_size
+           self._schema_config = read_yaml_file(file_path = SCHEMA_FILE_PATH)
         except Exception as e:
             raise UsVisaException(e , sys)
-    
-    def export_collection_data_as_dataframe(self , collection_name: str , database_name: Optional[str] = None) -> pd.DataFrame:
-        """ 
-        Get all the data from the database collection as dict
-        Convert the dict into dataframe
-        Drop the mongodb default _id value and return
-        """
-        
+
+    def get_collection(self , collection_name: str , database_name: Optional[str] = None):
+        if database_name is None:
+            return self.mongo_client.database[collection_name]
+        return self.mongo_client.client[database_name][collection_name]
+
+    def get_schema_columns(self) -> Dict[str , str]:
+        """
+        Returns {column: schema type} for every column of config/schema.yaml, in schema order
+        """
+        return {name : dtype for column in self._schema_config["columns"] for name , dtype in column.items()}
+
+    def export_collection_data_as_dataframe(self , collection_name: str , database_name: Optional[str] = None,
+                                            n_partitions : int = 1 , n_workers : int = 1,
+                                            query : Optional[Dict] = None , feature_pushdown : bool = False,
+                                            keep_columns : Iterable[str] = ()) -> pd.DataFrame:
+        """
+        Streams the schema columns of the collection batch by batch into typed column buffers
+        (category codes / float64) and builds the dataframe from them in a single pass.
+        The _id field is never sent by the server and "na" is turned into NaN while decoding.
+
+        With n_partitions > 1 the collection is split into _id ranges that are read concurrently
+        by n_workers threads over the shared connection pool, and concatenated in _id order.
+        Only the documents matching query are exported when it is given.
+
+        With feature_pushdown the feature engineering runs in mongodb (see get_feature_pipeline)
+        and only the engineered columns are sent, keep_columns are sent even if they are drop columns.
+        """
+
         try:
-            if database_name is None:
-                collection = self.mongo_client.database[collection_name]
-            else:
-                collection = self.mongo_client[database_name][collection_name]
-            
-            # get all the data and convert the data into dataframe
-            df = pd.DataFrame(list(collection.find()))
-            
-            # remove the _id column if present
-            if '_id' in df.columns.to_list():
-                df = df.drop(columns = ['_id'] , axis = 1)
-            
-            # replace na with nan
-            df.replace({"na" : np.nan} , inplace = True)
-            
-            return df 
-        
+            collection = self.get_collection(collection_name , database_name)
+            query = query or {}
+
+            if n_partitions <= 1:
+                return self.read_documents_as_dataframe(
+                    collection = collection , query = query , feature_pushdown = feature_pushdown , keep_columns = keep_columns
+                )
+
+            start_time = time.perf_counter()
+            queries = [
+                {"$and" : [query , partition_query]} if query and partition_query else (query or partition_query)
+                for partition_query in self.get_partition_queries(collection , n_partitions)
+            ]
+
+            # pymongo clients are thread safe, every worker borrows a connection from the same pool
+            with ThreadPoolExecutor(max_workers = max(1 , n_workers) , thread_name_prefix = "mongo-export") as executor:
+                partitions = list(executor.map(
+                    lambda query: self.read_documents_as_dataframe(
+                        collection = collection , query = query , sort_by_id = True,
+                        feature_pushdown = feature_pushdown , keep_columns = keep_columns
+                    ),
+                    queries
+                ))
+
+            dataframe = self.concat_partitions(partitions)
+            logging.info(
+                f"Exported {len(dataframe)} documents in {len(queries)} partitions with {n_workers} workers "
+                f"in {time.perf_counter() - start_time:.2f}s"
+            )
+            return dataframe
+
+        except Exception as e:
+            raise UsVisaException(e , sys)
+
+    def get_max_value(self , collection_name : str , field : str , database_name : Optional[str] = None):
+        """
+        Returns the largest value of field in the collection (None for an empty collection)
+        """
+        try:
+            collection = self.get_collection(collection_name , database_name)
+            documents = list(
+                collection.find({field : {"$exists" : True}} , {field : 1}).sort(field , -1).limit(1)
+            )
+            return documents[0][field] if len(documents) > 0 else None
         except Exception as e:
-            raise UsVisaException(e , sys)
\ No newline at end of file
+            raise UsVisaException(e , sys)
+
+    def get_partition_queries(self , collection , n_partitions : int) -> List[Dict]:
+        """
+        Splits the collection into n_partitions contiguous _id ranges of about the same size.
+        The boundaries are read from the _id index, no document is fetched.
+        """
+        n_documents = collection.estimated_document_count()
+        partition_size = n_documents // n_partitions
+
+        boundaries = []
+        if partition_size > 0:
+            for partition in range(1 , n_partitions):
+                boundary = list(
+                    collection.find({} , {"_id" : 1}).sort("_id" , 1).skip(partition * partition_size).limit(1)
+                )
+                if len(boundary) > 0 and (len(boundaries) == 0 or boundary[0]["_id"] != boundaries[-1]):
+                    boundaries.append(boundary[0]["_id"])
+
+        # [-inf, b1) [b1, b2) ... [bn, +inf)
+        lower_bounds = [None] + boundaries
+        upper_bounds = boundaries + [None]
+        queries = []
+        for lower_bound , upper_bound in zip(lower_bounds , upper_bounds):
+            id_range = {}
+            if lower_bound is not None:
+                id_range["$gte"] = lower_bound
+            if upper_bound is not None:
+                id_range["$lt"] = upper_bound
+            queries.append({"_id" : id_range} if id_range else {})
+        return queries
+
+    def concat_partitions(self , partitions : List[pd.DataFrame]) -> pd.DataFrame:
+        """
+        Concatenates the partition dataframes in order. Every partition has its own category
+        vocabulary, so category columns are merged with union_categoricals to stay categorical.
+        """
+        if len(partitions) == 1:
+            return partitions[0]
+
+        columns = {}
+        for column in partitions[0].columns:
+            if isinstance(partitions[0][column].dtype , pd.CategoricalDtype):
+                columns[column] = pd.Series(union_categoricals([partition[column] for partition in partitions]))
+            else:
+                columns[column] = pd.concat([partition[column] for partition in partitions] , ignore_index = True)
+        return pd.DataFrame(columns)
+
+    def get_feature_pipeline(self , query : Dict , columns : Dict[str , str] , sort_by_id : bool = False) -> List[Dict]:
+        """
+        Returns the aggregation pipeline doing the feature engineering of DataTransformation on the server:
+        $match    the query and no_of_employees > 0
+        $addFields company_age = CURRENT_YEAR - yr_of_estab (null when yr_of_estab is not a number)
+        $project  only the given columns, without _id
+        """
+        employees_filter = {"no_of_employees" : {"$gt" : 0}}
+        pipeline = [{"$match" : {"$and" : [query , employees_filter]} if query else employees_filter}]
+        if sort_by_id:
+            pipeline.append({"$sort" : {"_id" : 1}})
+        pipeline.append({"$addFields" : {"company_age" : {
+            "$cond" : [{"$isNumber" : "$yr_of_estab"} , {"$subtract" : [CURRENT_YEAR , "$yr_of_estab"]} , None]
+        }}})
+        pipeline.append({"$project" : {"_id" : 0 , **{column : 1 for column in columns}}})
+        return pipeline
+
+    def read_documents_as_dataframe(self , collection , query : Dict , sort_by_id : bool = False,
+                                    feature_pushdown : bool = False , keep_columns : Iterable[str] = ()) -> pd.DataFrame:
+        """
+        Streams the documents matching the query into a typed dataframe with the schema columns,
+        or with the engineered columns computed by the server when feature_pushdown is set
+        """
+        if feature_pushdown:
+            columns = get_feature_engineered_columns(self._schema_config , keep_columns)
+            cursor = collection.aggregate(
+                self.get_feature_pipeline(query , columns , sort_by_id) , batchSize = self.batch_size
+            )
+        else:
+            columns = self.get_schema_columns()
+            projection = {"_id" : 0 , **{column : 1 for column in columns}}
+            cursor = collection.find(query , projection , batch_size = self.batch_size)
+            if sort_by_id:
+                cursor = cursor.sort("_id" , 1)
+        buffers = {column : _ColumnBuffer(dtype) for column , dtype in columns.items()}
+
+        n_rows = 0
+        try:
+            while True:
+                batch = list(islice(cursor , self.batch_size))
+                if len(batch) == 0:
+                    break
+                for column , buffer in buffers.items():
+                    buffer.extend([document.get(column) for document in batch])
+                n_rows += len(batch)
+        finally:
+            cursor.close()
+
+        dataframe = pd.DataFrame({column : buffer.to_series() for column , buffer in buffers.items()})
+        logging.info(
+            f"Exported {n_rows} documents from [{collection.name}] {query}, "
+            f"dataframe memory: {dataframe.memory_usage(deep = True).sum() / 1024 ** 2:.2f} MB"
+        )
+        return dataframe
+
+
+class _ColumnBuffer:
+    """
+    Append only buffer of one column: category columns keep int32 codes plus the vocabulary,
+    numeric columns keep float64 values (integral columns are narrowed when the export is done)
+    """
+
+    def __init__(self , dtype : str):
+        self.is_category = dtype == "category"
+        self.values = array("i") if self.is_category else array("d")
+        self.vocabulary : Dict[str , int] = {}
+
+    def extend(self , values : List) -> None:
+        if self.is_category:
+            vocabulary = self.vocabulary
+            self.values.extend([
+                -1 if _is_missing(value) else vocabulary.setdefault(value , len(vocabulary))
+                for value in values
+            ])
+        else:
+            self.values.extend([
+                np.nan if _is_missing(value) else float(value)
+                for value in values
+            ])
+
+    def to_series(self) -> pd.Series:
+        values = np.frombuffer(self.values , dtype = np.int32 if self.is_category else np.float64)
+
+        if self.is_category:
+            return pd.Series(pd.Categorical.from_codes(values , categories = list(self.vocabulary)))
+
+        # integral columns without missing values are stored as int32 when they fit
+        series = narrow_integral(pd.Series(values))
+        # a float series still shares the memory of the buffer
+        return series.copy() if series.dtype == np.float64 else series
@@ -0,0 +1,78 @@
+import sys
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.us_visa.exception import UsVisaException
+from src.us_visa.logger import logging
+
+
+class ArtifactCache:
+    """
+    This class is the per-run object cache of the training pipeline. A stage hands the objects it
+    produced (dataframes, arrays, fitted objects) to the next stage in memory through its artifact,
+    and the files of the artifact are written in the background by a small pool of writer threads.
+    flush() waits for every pending write, the pipeline calls it before the run ends.
+    """
+
+    def __init__(self, max_workers: int):
+        """
+        :param max_workers: number of threads writing the artifact files
+        """
+        self.max_workers = max_workers
+        self._objects: Dict[str, object] = {}
+        self._pending: List[Tuple[str, Future]] = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = "artifact-writer")
+
+    def persist(self, file_path: str, obj: object, write_function: Callable[[], None]) -> object:
+        """
+        Keeps obj in memory under file_path and schedules write_function (which writes obj
+        to file_path) on the writer pool. Returns obj so the caller can put it in its artifact.
+        The caller must not modify obj afterwards.
+        """
+        with self._lock:
+            self._objects[file_path] = obj
+            self._pending.append((file_path, self._executor.submit(self._write, file_path, write_function)))
+        return obj
+
+    @staticmethod
+    def _write(file_path: str, write_function: Callable[[], None]) -> float:
+        start_time = time.perf_counter()
+        write_function()
+        return time.perf_counter() - start_time
+
+    def get(self, file_path: str) -> Optional[object]:
+        """
+        Returns the in-memory object of file_path, None if it was not produced in this run
+        """
+        return self._objects.get(file_path)
+
+    def flush(self) -> None:
+        """
+        Waits for every pending write, raises if any of them failed
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+
+        errors = []
+        for file_path, future in pending:
+            try:
+                duration = future.result()
+                logging.info(f"Persisted artifact [{file_path}] in {duration:.3f}s")
+            except Exception as e:
+                errors.append(f"[{file_path}] {e}")
+
+        if len(errors) > 0:
+            raise UsVisaException(Exception(f"Failed to persist artifacts: {errors}"), sys)
+
+    def close(self) -> None:
+        """
+        Flushes the pending writes and drops the in-memory objects
+        """
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait = True)
+            self._objects.clear()
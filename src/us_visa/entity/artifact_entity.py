@@ -1,10 +1,20 @@
-from dataclasses import dataclass
+from dataclasses import dataclass , field
+from typing import Optional
+
+import numpy as np
+from pandas import DataFrame
+
+
+# the optional in-memory handles are set when the pipeline runs with an ArtifactCache,
+# the next stage uses them instead of reading the files back
 
 
 @dataclass
 class DataIngestionArtifact:
     train_file_path : str 
     test_file_path : str
+    train_df : Optional[DataFrame] = field(default = None , repr = False)
+    test_df : Optional[DataFrame] = field(default = None , repr = False)
 
 
 @dataclass
@@ -12,13 +22,23 @@ class DataValidationArtifact:
     validation_status : bool
     message : str # Data Drift Detected / Not Detected 
     drift_report_file_path : str 
+    schema_report_file_path : Optional[str] = None # row level violations of the schema
+    stage_details : dict = field(default_factory = dict) # drift report write time and size, reported with the stage timing
 
 
 @dataclass
 class DataTransformationArtifact:
     transformed_object_file_path : str
-    transformed_train_data_file_path : str
+    transformed_train_data_file_path : str # features (X)
     transformed_test_data_file_path : str 
+    transformed_train_target_file_path : str # target (y)
+    transformed_test_target_file_path : str
+    reference_profile_file_path : str # drift baseline of the train features and target
+    preprocessing_object : Optional[object] = field(default = None , repr = False)
+    train_feature_arr : Optional[np.ndarray] = field(default = None , repr = False)
+    train_target_arr : Optional[np.ndarray] = field(default = None , repr = False)
+    test_feature_arr : Optional[np.ndarray] = field(default = None , repr = False)
+    test_target_arr : Optional[np.ndarray] = field(default = None , repr = False)
 
 
 @dataclass
@@ -34,6 +54,7 @@ class ModelTrainerArtifact:
     trained_model_file_path : str 
     metric_artifact : ClassificationMetricArtifact
     tuned_model_report_file_path : str
+    reference_profile_file_path : str
     
 
 @dataclass
@@ -42,12 +63,14 @@ class ModelEvaluationArtifact:
     changed_accuracy : float
     s3_model_path : str 
     trained_model_path : str 
+    reference_profile_path : str
 
 
 @dataclass
 class ModelPusherArtifact:
     bucket_name : str 
     s3_model_path : str 
+    s3_reference_profile_path : str
 
 @dataclass
 class CloudModelArtifact:
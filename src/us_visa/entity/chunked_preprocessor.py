@@ -0,0 +1,222 @@
+import sys
+from typing import Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.compose import ColumnTransformer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder, PowerTransformer, StandardScaler
+
+from src.us_visa.exception import UsVisaException
+from src.us_visa.logger import logging
+
+
+class ReservoirSample:
+    """
+    This class keeps a uniform random sample of at most size rows of a stream of dataframes
+    (algorithm R), every row of the stream has the same chance to be in the sample.
+    """
+
+    def __init__(self, size: int, random_state: int = 42):
+        self.size = size
+        self.n_seen = 0
+        self._rng = np.random.default_rng(random_state)
+        self._columns: Dict[str, np.ndarray] = {}
+        self._n_filled = 0
+
+    def add(self, chunk: pd.DataFrame) -> None:
+        if len(chunk) == 0:
+            return
+
+        if not self._columns:
+            # category columns are kept as plain values (the chunks may have different vocabularies),
+            # numeric columns as float64 (a later chunk may have missing values)
+            self._columns = {
+                column: np.empty(self.size, dtype = np.float64 if pd.api.types.is_numeric_dtype(chunk[column].dtype) else object)
+                for column in chunk.columns
+            }
+
+        values = {column: chunk[column].to_numpy(dtype = self._columns[column].dtype) for column in chunk.columns}
+
+        # fill phase: the first size rows go straight into the sample
+        n_fill = min(self.size - self._n_filled, len(chunk))
+        for column, sample in self._columns.items():
+            sample[self._n_filled:self._n_filled + n_fill] = values[column][:n_fill]
+        self._n_filled += n_fill
+
+        # replace phase: row i of the stream replaces a random slot with probability size / (i + 1)
+        stream_index = self.n_seen + np.arange(n_fill, len(chunk))
+        slots = (self._rng.random(len(stream_index)) * (stream_index + 1)).astype(np.int64)
+        is_kept = slots < self.size
+        # later rows win when two rows draw the same slot, like the sequential algorithm
+        for column, sample in self._columns.items():
+            sample[slots[is_kept]] = values[column][n_fill:][is_kept]
+
+        self.n_seen += len(chunk)
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({column: sample[:self._n_filled] for column, sample in self._columns.items()})
+
+
+class ChunkedPreprocessorFitter:
+    """
+    This class fits the ColumnTransformer of DataTransformation.get_data_transformation_object
+    from streamed chunks instead of one fit_transform over the whole training frame:
+
+    first pass   (partial_fit)            vocabularies of the OneHot/Ordinal columns, StandardScaler
+                                          moments (StandardScaler.partial_fit) and a reservoir sample
+    fit          (fit_preprocessor)       the encoders get the full vocabularies as their categories,
+                                          the PowerTransformer lambdas are estimated on the sample
+    second pass  (partial_fit_power_scale) exact mean/std of the Yeo-Johnson output for the
+                                          standardize step of the PowerTransformer
+
+    A standardizing PowerTransformer is fitted as PowerTransformer(standardize = False) followed by a
+    StandardScaler step, which computes the same output. Only public fitted attributes are set (the
+    categories, the mean_ / var_ / scale_ of the StandardScalers), so the result is a plain fitted
+    ColumnTransformer that is pickled, compiled and served like the one of fit_transform.
+    """
+
+    def __init__(self, preprocessor: ColumnTransformer, reservoir_size: int):
+        """
+        :param preprocessor: unfitted ColumnTransformer
+        :param reservoir_size: rows kept to estimate the PowerTransformer lambdas
+        """
+        self.preprocessor = clone(preprocessor)
+        self.reservoir = ReservoirSample(size = reservoir_size)
+        self.vocabularies: Dict[str, set] = {}
+        # columns with missing values, missing is the last category like with categories="auto"
+        self.has_missing: Dict[str, bool] = {}
+        self.scalers: Dict[str, StandardScaler] = {}
+        self.power_scalers: Dict[str, StandardScaler] = {}
+        self.n_rows = 0
+
+        for name, transformer, columns in self.preprocessor.transformers:
+            if isinstance(transformer, (OneHotEncoder, OrdinalEncoder)):
+                if not isinstance(transformer.categories, str) or transformer.categories != "auto":
+                    raise NotImplementedError(f"[{name}] already has explicit categories")
+                for column in columns:
+                    self.vocabularies.setdefault(column, set())
+                    self.has_missing.setdefault(column, False)
+            elif isinstance(transformer, StandardScaler):
+                self.scalers[name] = clone(transformer)
+            elif self._get_power_transformer(transformer) is None:
+                raise NotImplementedError(f"{type(transformer).__name__} in [{name}] can not be fitted in chunks")
+
+    @staticmethod
+    def _get_power_transformer(transformer: object) -> Optional[PowerTransformer]:
+        steps = transformer.steps if isinstance(transformer, Pipeline) else [(None, transformer)]
+        if len(steps) == 1 and isinstance(steps[0][1], PowerTransformer):
+            return steps[0][1]
+        return None
+
+    def _get_columns(self, name: str) -> List[str]:
+        return next(columns for transformer_name, _, columns in self.preprocessor.transformers if transformer_name == name)
+
+    def partial_fit(self, chunk: pd.DataFrame) -> None:
+        """
+        First pass: updates the vocabularies, the scaler moments and the sample with one chunk
+        """
+        if len(chunk) == 0:
+            return
+
+        for column, vocabulary in self.vocabularies.items():
+            is_missing = chunk[column].isna()
+            self.has_missing[column] |= bool(is_missing.any())
+            vocabulary.update(pd.unique(chunk[column][~is_missing].to_numpy(dtype = object)))
+        for name, scaler in self.scalers.items():
+            scaler.partial_fit(chunk[self._get_columns(name)])
+        self.reservoir.add(chunk)
+        self.n_rows += len(chunk)
+
+    def get_categories(self, column: str) -> np.ndarray:
+        """
+        Returns the streamed vocabulary of a column as categories="auto" would: sorted, with missing
+        values as the last category, and an error when strings and numbers are mixed
+        """
+        try:
+            categories = sorted(self.vocabularies[column])
+        except TypeError:
+            value_types = sorted({type(value).__name__ for value in self.vocabularies[column]})
+            raise ValueError(
+                f"Column [{column}] mixes value types {value_types}, the encoders need uniformly strings or numbers"
+            )
+        if self.has_missing[column]:
+            categories.append(np.nan)
+        return np.array(categories, dtype = object)
+
+    @staticmethod
+    def _set_scaler_statistics(scaler: StandardScaler, streamed_scaler: StandardScaler) -> None:
+        # the fitted attributes of StandardScaler, the ones transform reads
+        scaler.mean_ = streamed_scaler.mean_
+        scaler.var_ = streamed_scaler.var_
+        scaler.scale_ = streamed_scaler.scale_
+        scaler.n_samples_seen_ = streamed_scaler.n_samples_seen_
+
+    def fit_preprocessor(self) -> ColumnTransformer:
+        """
+        Fits the ColumnTransformer on the sample with the streamed vocabularies as categories,
+        then sets the streamed statistics on the StandardScalers fitted on the sample
+        """
+        try:
+            transformers = []
+            for name, transformer, columns in self.preprocessor.transformers:
+                if isinstance(transformer, (OneHotEncoder, OrdinalEncoder)):
+                    transformer = clone(transformer).set_params(
+                        categories = [self.get_categories(column) for column in columns]
+                    )
+                else:
+                    power_transformer = self._get_power_transformer(transformer)
+                    if power_transformer is not None and power_transformer.standardize:
+                        # the standardize step is a StandardScaler of its own, fed by the second pass
+                        step_name = transformer.steps[0][0] if isinstance(transformer, Pipeline) else "transformer"
+                        transformer = Pipeline(steps = [
+                            (step_name, clone(power_transformer).set_params(standardize = False)),
+                            ("standardize", StandardScaler()),
+                        ])
+                        self.power_scalers[name] = StandardScaler(copy = False)
+                transformers.append((name, transformer, columns))
+            self.preprocessor.set_params(transformers = transformers)
+
+            sample = self.reservoir.to_frame()
+            logging.info(f"Fitting the preprocessor on a sample of {len(sample)} of {self.n_rows} rows")
+            self.preprocessor.fit(sample)
+
+            for name, streamed_scaler in self.scalers.items():
+                self._set_scaler_statistics(self.preprocessor.named_transformers_[name], streamed_scaler)
+            return self.preprocessor
+
+        except Exception as e:
+            raise UsVisaException(e, sys) from e
+
+    def partial_fit_power_scale(self, chunk: pd.DataFrame) -> None:
+        """
+        Second pass: updates the mean/std of the Yeo-Johnson output with one chunk
+        """
+        if len(chunk) == 0:
+            return
+
+        for name, power_scaler in self.power_scalers.items():
+            # the fitted power step does not standardize
+            power_transformer = self.preprocessor.named_transformers_[name].steps[0][1]
+            power_scaler.partial_fit(power_transformer.transform(chunk[self._get_columns(name)]))
+
+    def finalize(self) -> ColumnTransformer:
+        """
+        Sets the streamed standardize statistics on the standardize steps and returns the preprocessor
+        """
+        for name, power_scaler in self.power_scalers.items():
+            self._set_scaler_statistics(self.preprocessor.named_transformers_[name].named_steps["standardize"], power_scaler)
+        return self.preprocessor
+
+    def fit(self, get_chunks: Callable[[], Iterator[pd.DataFrame]]) -> ColumnTransformer:
+        """
+        Runs both passes, get_chunks() must return a new iterator over the same chunks every call
+        """
+        for chunk in get_chunks():
+            self.partial_fit(chunk)
+        self.fit_preprocessor()
+        if self.power_scalers:
+            for chunk in get_chunks():
+                self.partial_fit_power_scale(chunk)
+        return self.finalize()
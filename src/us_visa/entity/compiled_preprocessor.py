@@ -0,0 +1,251 @@
+import sys
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder, PowerTransformer, StandardScaler
+from scipy import stats
+
+from src.us_visa.exception import UsVisaException
+from src.us_visa.logger import logging
+
+
+# key of the missing value category in the lookup tables
+_MISSING = "__missing__"
+
+
+def _is_missing(value: object) -> bool:
+    return isinstance(value, float) and value != value
+
+
+def _get_code(lookup: Dict, value: object, default: object) -> object:
+    code = lookup.get(value, default)
+    if code is default and _is_missing(value):
+        code = lookup.get(_MISSING, default)
+    return code
+
+
+class CompiledPreprocessor:
+    """
+    This class turns the fitted ColumnTransformer of DataTransformation.get_data_transformation_object
+    into plain lookup tables (OneHot/Ordinal columns) and closed form constants (Yeo-Johnson lambdas,
+    scaler mean/scale), so a few raw records become a feature matrix without sklearn's per call
+    validation and pandas overhead. The output is bit-for-bit the output of ColumnTransformer.transform.
+    """
+
+    def __init__(self, blocks: List[Tuple], n_features: int):
+        """
+        Use CompiledPreprocessor.compile(preprocessor) instead of calling this directly
+        """
+        self.blocks = blocks
+        self.n_features = n_features
+
+    @classmethod
+    def compile(cls, preprocessor: ColumnTransformer) -> "CompiledPreprocessor":
+        """
+        Builds the compiled preprocessor from a fitted ColumnTransformer and checks it
+        against the ColumnTransformer on probe rows. Raises if a step is not supported
+        or the outputs differ, the caller should then keep using the ColumnTransformer.
+        """
+        try:
+            blocks = []
+            offset = 0
+
+            for name, transformer, columns in preprocessor.transformers_:
+                if transformer == "drop" or len(columns) == 0:
+                    continue
+
+                if isinstance(transformer, OneHotEncoder):
+                    block = cls._compile_one_hot(transformer, columns, offset)
+                elif isinstance(transformer, OrdinalEncoder):
+                    block = cls._compile_ordinal(transformer, columns, offset)
+                else:
+                    block = cls._compile_numeric(name, transformer, columns, offset)
+
+                blocks.append(block)
+                offset = block[-1]
+
+            compiled_preprocessor = cls(blocks = blocks, n_features = offset)
+
+            # parity check on probe rows built from the fitted categories and scaler statistics
+            if not compiled_preprocessor.verify(preprocessor, compiled_preprocessor.get_probe_frame()):
+                raise ValueError("compiled preprocessor output differs from ColumnTransformer.transform")
+
+            logging.info(f"Compiled preprocessor into {len(blocks)} blocks and {offset} features")
+            return compiled_preprocessor
+
+        except Exception as e:
+            raise UsVisaException(e, sys) from e
+
+    @staticmethod
+    def _compile_one_hot(encoder: OneHotEncoder, columns: List[str], offset: int) -> Tuple:
+        if getattr(encoder, "drop_idx_", None) is not None or getattr(encoder, "_infrequent_enabled", False):
+            raise NotImplementedError("OneHotEncoder with drop or infrequent categories is not supported")
+
+        lookups = []
+        for categories in encoder.categories_:
+            lookups.append((CompiledPreprocessor._make_lookup(categories, list(range(len(categories)))), len(categories)))
+
+        end = offset + sum(size for _, size in lookups)
+        return ("onehot", list(columns), lookups, encoder.handle_unknown == "ignore", offset, end)
+
+    @staticmethod
+    def _compile_ordinal(encoder: OrdinalEncoder, columns: List[str], offset: int) -> Tuple:
+        if encoder.handle_unknown != "error":
+            raise NotImplementedError("OrdinalEncoder with handle_unknown other than error is not supported")
+
+        lookups = []
+        for categories in encoder.categories_:
+            # a missing value category is encoded as encoded_missing_value, not as its index
+            codes = [
+                float(encoder.encoded_missing_value) if _is_missing(category) else float(index)
+                for index, category in enumerate(categories)
+            ]
+            lookups.append(CompiledPreprocessor._make_lookup(categories, codes))
+        return ("ordinal", list(columns), lookups, offset, offset + len(columns))
+
+    @staticmethod
+    def _make_lookup(categories: np.ndarray, codes: List) -> Dict:
+        # NaN never equals itself, so a NaN category is kept under the _MISSING key and
+        # _get_code sends every NaN there, like sklearn matches missing values
+        return {(_MISSING if _is_missing(category) else category): code for category, code in zip(categories, codes)}
+
+    @classmethod
+    def _compile_numeric(cls, name: str, transformer: object, columns: List[str], offset: int) -> Tuple:
+        steps = transformer.steps if isinstance(transformer, Pipeline) else [(name, transformer)]
+
+        operations = []
+        for _, step in steps:
+            if isinstance(step, PowerTransformer) and step.method == "yeo-johnson":
+                operations.append(("yeo_johnson", [float(lmbda) for lmbda in step.lambdas_], cls._yeo_johnson_function(step)))
+                if step.standardize:
+                    operations.append(("scale", step._scaler.mean_.copy(), step._scaler.scale_.copy()))
+            elif isinstance(step, StandardScaler):
+                operations.append((
+                    "scale",
+                    step.mean_.copy() if step.with_mean else None,
+                    step.scale_.copy() if step.with_std else None
+                ))
+            else:
+                raise NotImplementedError(f"{type(step).__name__} in [{name}] is not supported")
+
+        return ("numeric", list(columns), operations, offset, offset + len(columns))
+
+    @staticmethod
+    def _yeo_johnson_function(power_transformer: PowerTransformer):
+        # use the exact same arithmetic as the installed sklearn: older versions
+        # have their own _yeo_johnson_transform, newer ones call scipy.stats.yeojohnson
+        if hasattr(power_transformer, "_yeo_johnson_transform"):
+            return power_transformer._yeo_johnson_transform
+        return stats.yeojohnson
+
+    def transform_frame(self, dataframe: pd.DataFrame) -> np.ndarray:
+        """
+        Transforms a dataframe of raw records into the feature matrix
+        """
+        columns = {column: dataframe[column].tolist() for column in dataframe.columns}
+        return self._transform_columns(columns, len(dataframe))
+
+    def transform_records(self, records: List[Dict]) -> np.ndarray:
+        """
+        Transforms raw records (dicts with the model input columns) into the feature matrix
+        """
+        columns = {}
+        for block in self.blocks:
+            for column in block[1]:
+                if column not in columns:
+                    columns[column] = [record[column] for record in records]
+        return self._transform_columns(columns, len(records))
+
+    def _transform_columns(self, columns: Dict[str, List], n_rows: int) -> np.ndarray:
+        output = np.zeros((n_rows, self.n_features), dtype = np.float64)
+        rows = np.arange(n_rows)
+
+        for block in self.blocks:
+            kind = block[0]
+
+            if kind == "onehot":
+                _, block_columns, lookups, ignore_unknown, start, _ = block
+                for column, (lookup, size) in zip(block_columns, lookups):
+                    indices = [_get_code(lookup, value, -1) for value in columns[column]]
+                    if -1 in indices and not ignore_unknown:
+                        unknown = [value for value, index in zip(columns[column], indices) if index == -1]
+                        raise ValueError(f"Found unknown categories {unknown} in column [{column}] during transform")
+                    for row, index in zip(rows, indices):
+                        if index >= 0:
+                            output[row, start + index] = 1.0
+                    start += size
+
+            elif kind == "ordinal":
+                _, block_columns, lookups, start, _ = block
+                for position, (column, lookup) in enumerate(zip(block_columns, lookups)):
+                    codes = [_get_code(lookup, value, None) for value in columns[column]]
+                    if None in codes:
+                        unknown = [value for value, code in zip(columns[column], codes) if code is None]
+                        raise ValueError(f"Found unknown categories {unknown} in column [{column}] during transform")
+                    output[:, start + position] = codes
+
+            else:
+                _, block_columns, operations, start, end = block
+                # same layout as sklearn's validated copy, so every ufunc sees the same memory
+                values = np.asarray([columns[column] for column in block_columns], dtype = np.float64).T.copy()
+                for operation in operations:
+                    if operation[0] == "yeo_johnson":
+                        _, lambdas, yeo_johnson = operation
+                        for position, lmbda in enumerate(lambdas):
+                            with np.errstate(invalid = "ignore"):
+                                values[:, position] = yeo_johnson(values[:, position], lmbda)
+                    else:
+                        _, mean, scale = operation
+                        if mean is not None:
+                            values -= mean
+                        if scale is not None:
+                            values /= scale
+                output[:, start:end] = values
+
+        return output
+
+    def get_probe_frame(self) -> pd.DataFrame:
+        """
+        Builds probe rows that hit every known category and a spread of numeric values
+        """
+        categorical_values: Dict[str, List] = {}
+        numeric_values: Dict[str, List[float]] = {}
+
+        for block in self.blocks:
+            if block[0] == "onehot":
+                for column, (lookup, _) in zip(block[1], block[2]):
+                    categorical_values[column] = [np.nan if key == _MISSING else key for key in lookup.keys()]
+            elif block[0] == "ordinal":
+                for column, lookup in zip(block[1], block[2]):
+                    categorical_values[column] = [np.nan if key == _MISSING else key for key in lookup.keys()]
+            else:
+                for position, column in enumerate(block[1]):
+                    probes = [0.0, 1.0, 10.0, 100.0, 1000.0, -1.0]
+                    for operation in block[2]:
+                        if operation[0] == "scale" and operation[1] is not None and operation[2] is not None:
+                            mean, scale = operation[1][position], operation[2][position]
+                            probes += [float(round(mean + k * scale)) for k in (-1.0, -0.5, 0.0, 0.5, 1.0, 3.0)]
+                    numeric_values.setdefault(column, []).extend(probes)
+
+        n_rows = max([len(values) for values in list(categorical_values.values()) + list(numeric_values.values())] + [1])
+        probe = {}
+        for column, values in {**categorical_values, **numeric_values}.items():
+            probe[column] = [values[row % len(values)] for row in range(n_rows)]
+        return pd.DataFrame(probe)
+
+    def verify(self, preprocessor: ColumnTransformer, dataframe: pd.DataFrame) -> bool:
+        """
+        Parity check: True when the compiled output is bit-for-bit ColumnTransformer.transform(dataframe)
+        """
+        expected = preprocessor.transform(dataframe)
+        if hasattr(expected, "toarray"):
+            expected = expected.toarray()
+        expected = np.ascontiguousarray(expected, dtype = np.float64)
+        actual = self.transform_frame(dataframe)
+
+        is_same = expected.shape == actual.shape and np.array_equal(expected.view(np.int64), actual.view(np.int64))
+        logging.info(f"Compiled preprocessor parity check on {len(dataframe)} rows: [{is_same}]")
+        return is_same
@@ -11,6 +11,8 @@ class TrainingPipelineConfig:
     pipeline_name : str = PIPELINE_NAME
     artifact_dir : str = os.path.join(ARTIFACT_DIR , TIMESTAMP)
     timestamp = TIMESTAMP
+    in_memory_handoff : bool = ARTIFACT_IN_MEMORY_HANDOFF
+    persist_workers : int = ARTIFACT_PERSIST_WORKERS
 
 training_pipeline_config : TrainingPipelineConfig = TrainingPipelineConfig()
 
@@ -23,6 +25,28 @@ class DataIngestionConfig:
     testing_file_path : str = os.path.join(data_ingestion_dir , DATA_INGESTION_INGESTED_DIR , TEST_FILE_NAME)
     train_test_split_ratio : float = DATA_INGESTION_TRAIN_TEST_SPLIT_RATIO
     collection_name : str = DATA_INGESTION_COLLECTION_NAME
+    export_partitions : int = DATA_INGESTION_EXPORT_PARTITIONS
+    export_workers : int = DATA_INGESTION_EXPORT_WORKERS
+    incremental : bool = DATA_INGESTION_INCREMENTAL
+    incremental_feature_store_file_path : str = os.path.join(DATA_INGESTION_INCREMENTAL_STORE_DIR , FILE_NAME)
+    watermark_file_path : str = os.path.join(DATA_INGESTION_INCREMENTAL_STORE_DIR , DATA_INGESTION_WATERMARK_FILE_NAME)
+    watermark_field : str = DATA_INGESTION_WATERMARK_FIELD
+    dedup_column : str = DATA_INGESTION_DEDUP_COLUMN
+    artifact_format : str = DATA_INGESTION_ARTIFACT_FORMAT
+    split_method : str = DATA_INGESTION_SPLIT_METHOD
+    split_key_column : str = DATA_INGESTION_SPLIT_KEY_COLUMN
+    split_stratify_column : str = DATA_INGESTION_SPLIT_STRATIFY_COLUMN
+    split_hash_buckets : int = DATA_INGESTION_SPLIT_HASH_BUCKETS
+    split_chunk_size : int = DATA_INGESTION_SPLIT_CHUNK_SIZE
+    feature_pushdown : bool = DATA_INGESTION_FEATURE_PUSHDOWN
+
+    def __post_init__(self):
+        # the artifact files carry the extension of the configured format
+        extension = ARTIFACT_FORMAT_EXTENSIONS[self.artifact_format]
+        for field_name in ["feature_store_file_path" , "training_file_path" , "testing_file_path" ,
+                           "incremental_feature_store_file_path"]:
+            file_path = getattr(self , field_name)
+            setattr(self , field_name , os.path.splitext(file_path)[0] + extension)
 
 
 @dataclass
@@ -31,6 +55,23 @@ class DataValidationConfig:
     data_drift_report_file_path : str = os.path.join(data_validation_dir , DATA_VALIDATION_DRIFT_REPORT_DIR , 
                                                     DATA_VALIDATION_DRIFT_REPORT_FILE_NAME
                                                     )
+    drift_report_details : bool = DATA_VALIDATION_DRIFT_REPORT_DETAILS
+    drift_report_details_file_path : str = os.path.join(data_validation_dir , DATA_VALIDATION_DRIFT_REPORT_DIR , 
+                                                        DATA_VALIDATION_DRIFT_REPORT_DETAILS_FILE_NAME
+                                                        )
+    drift_report_bins : int = DATA_VALIDATION_DRIFT_REPORT_BINS
+    drift_engine : str = DATA_VALIDATION_DRIFT_ENGINE
+    drift_share : float = DATA_VALIDATION_DRIFT_SHARE
+    drift_workers : int = DATA_VALIDATION_DRIFT_WORKERS
+    drift_parity_check : bool = DATA_VALIDATION_DRIFT_PARITY_CHECK
+    reference_profile_file_path : str = DATA_VALIDATION_REFERENCE_PROFILE_FILE_PATH
+    reference_drift_report_file_path : str = os.path.join(data_validation_dir , DATA_VALIDATION_DRIFT_REPORT_DIR , 
+                                                          DATA_VALIDATION_REFERENCE_DRIFT_REPORT_FILE_NAME
+                                                          )
+    schema_report_file_path : str = os.path.join(data_validation_dir , DATA_VALIDATION_DRIFT_REPORT_DIR , 
+                                                 DATA_VALIDATION_SCHEMA_REPORT_FILE_NAME
+                                                 )
+    schema_chunk_size : int = DATA_VALIDATION_SCHEMA_CHUNK_SIZE
     
     
 
@@ -47,11 +88,34 @@ class DataTransformationConfig:
         DATA_TRANSFORMATION_TRANSFORMED_DATA_DIR,
         TEST_FILE_NAME.replace("csv" , "npy")
     )
+    transformed_train_target_file_path : str = os.path.join(
+        data_transformation_dir,
+        DATA_TRANSFORMATION_TRANSFORMED_DATA_DIR,
+        DATA_TRANSFORMATION_TRAIN_TARGET_FILE_NAME
+    )
+    transformed_test_target_file_path : str = os.path.join(
+        data_transformation_dir,
+        DATA_TRANSFORMATION_TRANSFORMED_DATA_DIR,
+        DATA_TRANSFORMATION_TEST_TARGET_FILE_NAME
+    )
+    transformed_array_dtype : str = DATA_TRANSFORMATION_ARRAY_DTYPE
+    chunked : bool = DATA_TRANSFORMATION_CHUNKED
+    chunk_size : int = DATA_TRANSFORMATION_CHUNK_SIZE
+    reservoir_size : int = DATA_TRANSFORMATION_RESERVOIR_SIZE
+    chunks_dir : str = os.path.join(data_transformation_dir , DATA_TRANSFORMATION_CHUNKS_DIR)
     transformed_object_file_path : str = os.path.join(
         data_transformation_dir,
         DATA_TRANSFORMATION_TRANSFORMED_OBJECT_DIR,
         PREPROCESSOR_OBJECT_FILE_NAME
     )
+    reference_profile_file_path : str = os.path.join(
+        data_transformation_dir,
+        DATA_TRANSFORMATION_TRANSFORMED_OBJECT_DIR,
+        REFERENCE_PROFILE_FILE_NAME
+    )
+    profile_compression : int = DATA_TRANSFORMATION_PROFILE_COMPRESSION
+    profile_chunk_size : int = DATA_TRANSFORMATION_PROFILE_CHUNK_SIZE
+    profile_workers : int = DATA_TRANSFORMATION_PROFILE_WORKERS
     
 
 
@@ -62,6 +126,11 @@ class ModelTrainerConfig:
         model_trainer_dir , 
         MODEL_TRAINER_TRAINED_MODEL_DIR , MODEL_FILE_NAME
     )
+    # the reference profile is kept next to the model
+    reference_profile_file_path : str = os.path.join(
+        model_trainer_dir , 
+        MODEL_TRAINER_TRAINED_MODEL_DIR , REFERENCE_PROFILE_FILE_NAME
+    )
     expected_accuracy : float = MODEL_TRAINER_EXPECTED_SCORE
     model_config_file_path : str = MODEL_TRAINER_MODEL_CONFIG_FILE_PATH # path of params to do grid search cv
     
@@ -87,11 +156,30 @@ class ModelEvaluationConfig:
 class ModelPusherConfig:
     bucket_name : str = MODEL_BUCKET_NAME
     s3_model_key_path : str = MODEL_FILE_NAME
+    s3_reference_profile_key_path : str = REFERENCE_PROFILE_FILE_NAME
 
 
 class UsVisaPredictorConfig:
     model_file_path : str = MODEL_FILE_NAME
     model_bucket_name : str = MODEL_BUCKET_NAME
+    model_refresh_interval_seconds : int = MODEL_CACHE_REFRESH_INTERVAL_SECONDS
+    prediction_cache_max_size : int = PREDICTION_CACHE_MAX_SIZE
+    prediction_cache_ttl_seconds : int = PREDICTION_CACHE_TTL_SECONDS
+    micro_batch_max_size : int = PREDICTION_MICRO_BATCH_MAX_SIZE
+    micro_batch_max_wait_ms : float = PREDICTION_MICRO_BATCH_MAX_WAIT_MS
+    executor_kind : str = PREDICTION_EXECUTOR_KIND
+    executor_max_workers : int = PREDICTION_EXECUTOR_MAX_WORKERS
+    executor_max_pending : int = PREDICTION_EXECUTOR_MAX_PENDING
+    warmup_rounds : int = PREDICTION_WARMUP_ROUNDS
+    warmup_retry_seconds : int = PREDICTION_WARMUP_RETRY_SECONDS
+    reference_profile_file_path : str = REFERENCE_PROFILE_FILE_NAME
+    drift_monitor_enabled : bool = DRIFT_MONITOR_ENABLED
+    drift_window_seconds : int = DRIFT_MONITOR_WINDOW_SECONDS
+    drift_window_buckets : int = DRIFT_MONITOR_WINDOW_BUCKETS
+    drift_flush_rows : int = DRIFT_MONITOR_FLUSH_ROWS
+    drift_min_rows : int = DRIFT_MONITOR_MIN_ROWS
+    drift_share : float = DRIFT_MONITOR_DRIFT_SHARE
+    drift_compression : int = DATA_TRANSFORMATION_PROFILE_COMPRESSION
 
 # Holds path for cloud model downloads
 @dataclass
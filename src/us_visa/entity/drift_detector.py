@@ -0,0 +1,268 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import special, stats
+
+from src.us_visa.exception import UsVisaException
+from src.us_visa.logger import logging
+
+
+# default thresholds of the evidently stattests: p-values (ks, chisquare, z) drift below them,
+# distances (jensenshannon, wasserstein) drift at or above them
+STATTEST_THRESHOLDS: Dict[str, float] = {
+    "ks": 0.05,
+    "chisquare": 0.05,
+    "z": 0.05,
+    "jensenshannon": 0.1,
+    "wasserstein": 0.1,
+}
+# stattests whose drift score is a p-value, the others are distances
+P_VALUE_STATTESTS = ("ks", "chisquare", "z")
+
+
+def _value_counts(reference: np.ndarray, current: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the distinct values of reference + current and their counts in reference and in current
+    """
+    codes, uniques = pd.factorize(np.concatenate([reference, current]))
+    n_values = len(uniques)
+    reference_counts = np.bincount(codes[:len(reference)], minlength = n_values)
+    current_counts = np.bincount(codes[len(reference):], minlength = n_values)
+    return np.asarray(uniques), reference_counts, current_counts
+
+
+def _ks(reference: np.ndarray, current: np.ndarray) -> float:
+    return float(stats.ks_2samp(reference, current)[1])
+
+
+def _chisquare(reference: np.ndarray, current: np.ndarray) -> float:
+    _, reference_counts, current_counts = _value_counts(reference, current)
+    expected = reference_counts * (len(current) / len(reference))
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        statistic = np.sum((current_counts - expected) ** 2 / expected)
+    return float(stats.chi2.sf(statistic, len(expected) - 1))
+
+
+def _z(reference: np.ndarray, current: np.ndarray) -> float:
+    values, reference_counts, current_counts = _value_counts(reference, current)
+    if len(values) == 1:
+        return 1.0
+
+    # share of the values other than the smallest one, pooled two proportion z-test
+    first_value = values.tolist().index(min(values.tolist()))
+    p_reference = 1 - reference_counts[first_value] / len(reference)
+    p_current = 1 - current_counts[first_value] / len(current)
+    p_pooled = (p_reference * len(reference) + p_current * len(current)) / (len(reference) + len(current))
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        z_statistic = (p_reference - p_current) / np.sqrt(
+            p_pooled * (1 - p_pooled) * (1 / len(reference) + 1 / len(current))
+        )
+    return float(2 * (1 - stats.norm.cdf(np.abs(z_statistic))))
+
+
+def _jensenshannon(reference: np.ndarray, current: np.ndarray) -> float:
+    _, reference_counts, current_counts = _value_counts(reference, current)
+    p = reference_counts / reference_counts.sum()
+    q = current_counts / current_counts.sum()
+    m = (p + q) / 2
+    divergence = (np.sum(special.rel_entr(p, m)) + np.sum(special.rel_entr(q, m))) / 2
+    return float(np.sqrt(divergence))
+
+
+def _wasserstein(reference: np.ndarray, current: np.ndarray) -> float:
+    # 1-d earth mover's distance: area between the two empirical cdfs
+    reference_sorted = np.sort(reference)
+    current_sorted = np.sort(current)
+    all_values = np.sort(np.concatenate([reference_sorted, current_sorted]))
+    deltas = np.diff(all_values)
+    reference_cdf = np.searchsorted(reference_sorted, all_values[:-1], side = "right") / len(reference_sorted)
+    current_cdf = np.searchsorted(current_sorted, all_values[:-1], side = "right") / len(current_sorted)
+    distance = np.sum(np.abs(reference_cdf - current_cdf) * deltas)
+    return float(distance / max(np.std(reference), 0.001))
+
+
+STATTESTS = {
+    "ks": _ks,
+    "chisquare": _chisquare,
+    "z": _z,
+    "jensenshannon": _jensenshannon,
+    "wasserstein": _wasserstein,
+}
+
+
+def get_compact_drift_report(report: Dict) -> Dict:
+    """
+    Returns the dataset decision of a drift report (DriftDetector or ReferenceProfile format) and, per
+    feature, only the stattest, drift score, statistic, p-value and drift flag. A test gives either a
+    p-value or a distance, the missing one is None unless the report has it (the ReferenceProfile
+    numeric columns also carry the ks statistic and p-value).
+    """
+    features = {}
+    for column, result in report["features"].items():
+        is_p_value = result["stattest"] in P_VALUE_STATTESTS
+        features[column] = {
+            "stattest": result["stattest"],
+            "drift_score": result["drift_score"],
+            "statistic": result.get("statistic", None if is_p_value else result["drift_score"]),
+            "p_value": result.get("p_value", result["drift_score"] if is_p_value else None),
+            "drift_detected": result["drift_detected"],
+        }
+    return {
+        **{key: value for key, value in report.items() if key != "features"},
+        "features": features,
+    }
+
+
+class DriftDetector:
+    """
+    This class detects data drift between a reference and a current dataframe with the default
+    per column tests of evidently's DataDriftProfileSection, computed directly with numpy / scipy:
+
+    reference <= 1000 rows   num: ks (chisquare / z for <= 5 values)   cat: chisquare (z for <= 2 values)
+    reference >  1000 rows   num: wasserstein (jensenshannon for <= 5 values)   cat: jensenshannon
+
+    A column drifts when its test passes the default threshold (STATTEST_THRESHOLDS) and the dataset
+    drifts when the share of drifted columns reaches drift_share, so the decisions match evidently's.
+    The columns are tested in parallel by a thread pool.
+    """
+
+    def __init__(self, column_types: Optional[Dict[str, str]] = None, drift_share: float = 0.5, max_workers: int = 4):
+        """
+        :param column_types: {column: "num" or "cat"}, columns not in it are typed by their dtype
+        :param drift_share: share of drifted columns from which the dataset drifts
+        :param max_workers: number of columns tested at the same time
+        """
+        self.column_types = column_types or {}
+        self.drift_share = drift_share
+        self.max_workers = max_workers
+
+    @classmethod
+    def from_schema(cls, schema_config: dict, drift_share: float = 0.5, max_workers: int = 4) -> "DriftDetector":
+        column_types = {
+            name: "cat" if dtype == "category" else "num"
+            for column in schema_config["columns"] for name, dtype in column.items()
+        }
+        return cls(column_types = column_types, drift_share = drift_share, max_workers = max_workers)
+
+    def get_column_type(self, column: str, series: pd.Series) -> str:
+        if column in self.column_types:
+            return self.column_types[column]
+        return "num" if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype) else "cat"
+
+    @staticmethod
+    def select_stattest(n_reference: int, n_values: int, feature_type: str) -> str:
+        if n_reference <= 1000:
+            if feature_type == "num" and n_values > 5:
+                return "ks"
+            return "chisquare" if n_values > 2 else "z"
+        if feature_type == "num" and n_values > 5:
+            return "wasserstein"
+        return "jensenshannon"
+
+    @staticmethod
+    def get_values(series: pd.Series, feature_type: str) -> np.ndarray:
+        """
+        Returns the values of the column without missing (and infinite) values
+        """
+        if feature_type == "num":
+            values = series.to_numpy(dtype = np.float64, na_value = np.nan)
+            return values[np.isfinite(values)]
+        values = series.to_numpy(dtype = object)
+        return values[~pd.isna(values)]
+
+    def get_column_drift(self, column: str, reference: pd.Series, current: pd.Series) -> Dict:
+        feature_type = self.get_column_type(column, reference)
+        reference_values = self.get_values(reference, feature_type)
+        current_values = self.get_values(current, feature_type)
+        if len(reference_values) == 0 or len(current_values) == 0:
+            raise ValueError(f"An empty column '{column}' was provided for drift calculation")
+
+        n_values = len(pd.unique(np.concatenate([reference_values, current_values])))
+        stattest = self.select_stattest(len(reference_values), n_values, feature_type)
+        threshold = STATTEST_THRESHOLDS[stattest]
+        drift_score = STATTESTS[stattest](reference_values, current_values)
+
+        if stattest in ("jensenshannon", "wasserstein"):
+            drift_detected = drift_score >= threshold
+        elif stattest == "ks":
+            drift_detected = drift_score <= threshold
+        else:
+            drift_detected = drift_score < threshold
+
+        return {
+            "feature_type": feature_type,
+            "stattest": stattest,
+            "drift_score": drift_score,
+            "threshold": threshold,
+            "drift_detected": bool(drift_detected),
+        }
+
+    def get_feature_bins(self, reference_df: pd.DataFrame, current_df: pd.DataFrame, n_bins: int = 10) -> Dict:
+        """
+        Returns the distributions behind the drift report, per column: the counts of reference and
+        current in n_bins shared bins (numeric) or per value (categorical). Only used for the detailed report.
+        """
+        try:
+            bins = {}
+            for column in reference_df.columns:
+                feature_type = self.get_column_type(column, reference_df[column])
+                reference_values = self.get_values(reference_df[column], feature_type)
+                current_values = self.get_values(current_df[column], feature_type)
+                if feature_type == "num":
+                    edges = np.histogram_bin_edges(np.concatenate([reference_values, current_values]), bins = n_bins)
+                    bins[column] = {
+                        "edges": edges.tolist(),
+                        "reference": np.histogram(reference_values, bins = edges)[0].tolist(),
+                        "current": np.histogram(current_values, bins = edges)[0].tolist(),
+                    }
+                else:
+                    values, reference_counts, current_counts = _value_counts(reference_values, current_values)
+                    bins[column] = {
+                        "values": [str(value) for value in values],
+                        "reference": reference_counts.tolist(),
+                        "current": current_counts.tolist(),
+                    }
+            return bins
+
+        except Exception as e:
+            raise UsVisaException(e, sys) from e
+
+    def detect(self, reference_df: pd.DataFrame, current_df: pd.DataFrame) -> Dict:
+        """
+        Tests every column of the reference dataframe, returns the drift report:
+        dataset_drift, n_features, n_drifted_features, share_drifted_features and the result per feature
+        """
+        try:
+            columns = list(reference_df.columns)
+            missing_columns = [column for column in columns if column not in current_df.columns]
+            if len(missing_columns) > 0:
+                raise ValueError(f"Columns {missing_columns} are missing in the current dataframe")
+
+            with ThreadPoolExecutor(max_workers = max(1, self.max_workers), thread_name_prefix = "drift") as executor:
+                results = list(executor.map(
+                    lambda column: self.get_column_drift(column, reference_df[column], current_df[column]),
+                    columns
+                ))
+
+            features = dict(zip(columns, results))
+            n_drifted_features = sum(result["drift_detected"] for result in results)
+            share_drifted_features = n_drifted_features / len(columns)
+            report = {
+                "dataset_drift": bool(share_drifted_features >= self.drift_share),
+                "n_features": len(columns),
+                "n_drifted_features": n_drifted_features,
+                "share_drifted_features": share_drifted_features,
+                "drift_share": self.drift_share,
+                "features": features,
+            }
+            logging.info(
+                f"Drift detected in {n_drifted_features} of {len(columns)} columns: "
+                f"{[column for column, result in features.items() if result['drift_detected']]}"
+            )
+            return report
+
+        except Exception as e:
+            raise UsVisaException(e, sys) from e
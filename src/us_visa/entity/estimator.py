@@ -4,6 +4,8 @@ from sklearn.pipeline import Pipeline
 
 from src.us_visa.exception import UsVisaException
 from src.us_visa.logger import logging
+from src.us_visa.constants import PREDICTION_FAST_PATH_MAX_ROWS
+from src.us_visa.entity.compiled_preprocessor import CompiledPreprocessor
 
 
 class TargetValueMapping:
@@ -24,6 +26,20 @@ class UsVisaModel:
     def __init__(self , preprocessing_object: Pipeline, trained_model_object: object):
         self.preprocessing_object = preprocessing_object
         self.trained_model_object = trained_model_object
+        self.compiled_preprocessor : CompiledPreprocessor = None
+    
+    def compile_preprocessor(self) -> bool:
+        """
+        Compiles the preprocessing object into the single row fast path.
+        Returns False (and keeps using the preprocessing object) when it can not be compiled
+        """
+        try:
+            self.compiled_preprocessor = CompiledPreprocessor.compile(self.preprocessing_object)
+            return True
+        except Exception as e:
+            logging.info(f"Preprocessor not compiled, using the ColumnTransformer: {e}")
+            self.compiled_preprocessor = None
+            return False
     
     
     def predict(self , dataframe : DataFrame) -> DataFrame:
@@ -36,12 +52,19 @@ class UsVisaModel:
         logging.info("Entered into predict method of UsVisaModel class")
         
         try:
-           logging.info("Using the preprocessor to transform the dataframe")
-           transformed_feature = self.preprocessing_object.transform(dataframe)
+           # models pickled before the fast path existed have no compiled_preprocessor attribute
+           compiled_preprocessor = getattr(self , "compiled_preprocessor" , None)
+           
+           if compiled_preprocessor is not None and len(dataframe) <= PREDICTION_FAST_PATH_MAX_ROWS:
+               logging.info("Using the compiled preprocessor to transform the dataframe")
+               transformed_feature = compiled_preprocessor.transform_frame(dataframe)
+           else:
+               logging.info("Using the preprocessor to transform the dataframe")
+               transformed_feature = self.preprocessing_object.transform(dataframe)
            logging.info(f"data transformed in predict method. transformed_feature shape({transformed_feature.shape})")
            
            logging.info("Using the trained model to get predictions")
-           predictions = self.trained_model_object(transformed_feature)
+           predictions = self.trained_model_object.predict(transformed_feature)
            logging.info(f"predictions array shape ({predictions.shape})")
            logging.info("Exiting from predict method of UsVisaModel class")
            return predictions
@@ -0,0 +1,141 @@
+import sys
+import threading
+from typing import Dict, Optional, Tuple
+
+from src.us_visa.cloud_storage.aws_storage import StorageService
+from src.us_visa.entity.estimator import UsVisaModel
+from src.us_visa.exception import UsVisaException
+from src.us_visa.logger import logging
+
+
+class UsVisaModelCache:
+    """
+    This class keeps one UsVisaModel resident in memory for the whole process.
+    A background thread checks the ETag/LastModified of the s3 object and swaps in
+    the new model when it changes, so requests never wait for s3 or unpickling.
+    """
+
+    def __init__(self, bucket_name: str, model_path: str, refresh_interval: int):
+        """
+        :param bucket_name: Name of your model bucket
+        :param model_path: Location of your model in bucket
+        :param refresh_interval: seconds between two version checks (0 disables the background refresh)
+        """
+        self.bucket_name = bucket_name
+        self.model_path = model_path
+        self.refresh_interval = refresh_interval
+        self.s3 = StorageService()
+
+        # (model, version) is kept as one tuple so a reader always gets a matching pair
+        self._state: Tuple[Optional[UsVisaModel], Optional[str]] = (None, None)
+        self._load_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._refresh_thread: Optional[threading.Thread] = None
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._state[1]
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._state[0] is not None
+
+    def get_model(self) -> UsVisaModel:
+        """
+        Returns the resident model. Only the very first call loads it from s3.
+        """
+        return self.get_model_and_version()[0]
+
+    def get_model_and_version(self) -> Tuple[UsVisaModel, str]:
+        """
+        Returns the resident model and its version from one read of the state, so a hot swap
+        can not pair the model of one version with the other version
+        """
+        state = self._state
+        if state[0] is not None:
+            return state
+
+        try:
+            with self._load_lock:
+                # another thread may have loaded the model while we were waiting
+                if self._state[0] is None:
+                    self.refresh()
+                self.start_background_refresh()
+            return self._state
+
+        except Exception as e:
+            raise UsVisaException(e, sys) from e
+
+    def refresh(self) -> bool:
+        """
+        Checks the version of the model in s3 and loads it if it changed.
+        Returns True when a new model was swapped in.
+        """
+        try:
+            current_model, current_version = self._state
+            latest_version = self.s3.get_object_version(
+                key = self.model_path, bucket_name = self.bucket_name
+            )
+
+            if current_model is not None and latest_version == current_version:
+                return False
+
+            logging.info(
+                f"Loading model [{self.model_path}] version [{latest_version}] from [{self.bucket_name}] bucket"
+            )
+            new_model = self.s3.load_model(self.model_path, bucket_name = self.bucket_name)
+            new_model.compile_preprocessor()
+
+            # a single assignment, in-flight requests keep using the model they already hold
+            self._state = (new_model, latest_version)
+            logging.info(f"Resident model swapped from version [{current_version}] to [{latest_version}]")
+            return True
+
+        except Exception as e:
+            raise UsVisaException(e, sys) from e
+
+    def _refresh_loop(self) -> None:
+        while not self._stop_event.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                # keep serving the old model, try again on the next tick
+                logging.info(f"Background model refresh failed: {e}")
+
+    def start_background_refresh(self) -> None:
+        if self.refresh_interval <= 0:
+            return
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self._refresh_thread = threading.Thread(
+            target = self._refresh_loop, name = "usvisa-model-refresh", daemon = True
+        )
+        self._refresh_thread.start()
+        logging.info(f"Started background model refresh every {self.refresh_interval} seconds")
+
+    def stop_background_refresh(self) -> None:
+        self._stop_event.set()
+        if self._refresh_thread is not None:
+            self._refresh_thread.join(timeout = 5)
+            self._refresh_thread = None
+
+
+_model_caches: Dict[Tuple[str, str], UsVisaModelCache] = {}
+_model_caches_lock = threading.Lock()
+
+
+def get_model_cache(bucket_name: str, model_path: str, refresh_interval: int) -> UsVisaModelCache:
+    """
+    Returns the process wide UsVisaModelCache for the given bucket and model path
+    """
+    key = (bucket_name, model_path)
+    with _model_caches_lock:
+        if key not in _model_caches:
+            _model_caches[key] = UsVisaModelCache(
+                bucket_name = bucket_name,
+                model_path = model_path,
+                refresh_interval = refresh_interval
+            )
+        return _model_caches[key]
@@ -0,0 +1,355 @@
+import sys
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+from typing import Dict, Optional, Union
+
+import numpy as np
+import pandas as pd
+from scipy import special, stats
+
+from src.us_visa.entity.drift_detector import STATTEST_THRESHOLDS, DriftDetector
+from src.us_visa.exception import UsVisaException
+from src.us_visa.logger import logging
+
+
+class TDigest:
+    """
+    This class is a mergeable quantile sketch (merging t-digest) of a numeric stream. The values are
+    summarized as centroids (mean, weight), a centroid spans at most one unit of the k1 scale function
+    k(q) = compression / (2 * pi) * asin(2q - 1), so the centroids are large in the middle and single
+    values at the extremes: the tails (and the outliers the wasserstein distance is sensitive to) stay
+    accurate. About compression / 2 centroids are kept whatever the stream length. Updating and merging
+    concatenate the centroids and compress them again. Exact count, min, max, mean and variance are kept
+    on the side.
+    """
+
+    def __init__(self, compression: int = 200):
+        self.compression = compression
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(self.m2 / self.n)) if self.n > 0 else 0.0
+
+    def _compress(self, means: np.ndarray, weights: np.ndarray) -> None:
+        order = np.argsort(means, kind = "stable")
+        means, weights = means[order], weights[order]
+
+        # centroids whose mid rank falls in the same unit of k are merged into one
+        cumulative_weights = np.cumsum(weights)
+        q = (cumulative_weights - weights / 2) / cumulative_weights[-1]
+        clusters = np.floor(self.compression / (2 * np.pi) * np.arcsin(2 * q - 1)).astype(np.int64)
+        clusters -= clusters[0]
+
+        cluster_weights = np.bincount(clusters, weights = weights)
+        cluster_sums = np.bincount(clusters, weights = weights * means)
+        is_used = cluster_weights > 0
+        self.weights = cluster_weights[is_used]
+        self.means = cluster_sums[is_used] / self.weights
+
+    def _add_moments(self, n: int, mean: float, m2: float) -> None:
+        # parallel variance (Chan et al.), exact for any split of the stream
+        total = self.n + n
+        delta = mean - self.mean
+        self.m2 += m2 + delta ** 2 * self.n * n / total
+        self.mean += delta * n / total
+        self.n = total
+
+    def update(self, values: np.ndarray) -> "TDigest":
+        values = np.asarray(values, dtype = np.float64)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return self
+
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        mean = float(values.mean())
+        self._add_moments(len(values), mean, float(np.sum((values - mean) ** 2)))
+        self._compress(np.concatenate([self.means, values]), np.concatenate([self.weights, np.ones(len(values))]))
+        return self
+
+    def merge(self, other: "TDigest") -> "TDigest":
+        if other.n == 0:
+            return self
+
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._add_moments(other.n, other.mean, other.m2)
+        self._compress(np.concatenate([self.means, other.means]), np.concatenate([self.weights, other.weights]))
+        return self
+
+    def _get_knots(self):
+        # centroid means placed at the middle of their weight, the min / max at the ends
+        total_weight = self.weights.sum()
+        centers = np.cumsum(self.weights) - self.weights / 2
+        return (
+            np.concatenate([[self.min], self.means, [self.max]]),
+            np.concatenate([[0.0], centers, [total_weight]]) / total_weight,
+        )
+
+    def quantile(self, q: Union[float, np.ndarray]) -> np.ndarray:
+        if self.n == 0:
+            return np.full(np.shape(q), np.nan)
+        values, ranks = self._get_knots()
+        return np.interp(q, ranks, values)
+
+    def cdf(self, x: Union[float, np.ndarray]) -> np.ndarray:
+        if self.n == 0:
+            return np.full(np.shape(x), np.nan)
+        values, ranks = self._get_knots()
+        return np.interp(x, values, ranks)
+
+    def to_dict(self) -> Dict:
+        return {
+            "compression": self.compression,
+            "n": self.n,
+            "min": self.min if self.n > 0 else None,
+            "max": self.max if self.n > 0 else None,
+            "mean": self.mean,
+            "m2": self.m2,
+            "means": self.means.tolist(),
+            "weights": self.weights.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, content: Dict) -> "TDigest":
+        digest = cls(compression = content["compression"])
+        digest.n = content["n"]
+        digest.min = content["min"] if content["min"] is not None else np.inf
+        digest.max = content["max"] if content["max"] is not None else -np.inf
+        digest.mean = content["mean"]
+        digest.m2 = content["m2"]
+        digest.means = np.asarray(content["means"], dtype = np.float64)
+        digest.weights = np.asarray(content["weights"], dtype = np.float64)
+        return digest
+
+
+class FrequencyTable:
+    """
+    This class counts the values of a categorical stream, the values are kept as strings
+    so the table is json serializable. Merging adds the counts.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.counts: Dict[str, int] = {}
+
+    def update(self, values: np.ndarray) -> "FrequencyTable":
+        if len(values) == 0:
+            return self
+        for value, count in pd.Series(values).astype(str).value_counts(sort = False).items():
+            self.counts[value] = self.counts.get(value, 0) + int(count)
+        self.n += len(values)
+        return self
+
+    def merge(self, other: "FrequencyTable") -> "FrequencyTable":
+        for value, count in other.counts.items():
+            self.counts[value] = self.counts.get(value, 0) + count
+        self.n += other.n
+        return self
+
+    def get_proportions(self) -> Dict[str, float]:
+        return {value: count / self.n for value, count in self.counts.items()} if self.n > 0 else {}
+
+    def to_dict(self) -> Dict:
+        return {"n": self.n, "counts": dict(sorted(self.counts.items()))}
+
+    @classmethod
+    def from_dict(cls, content: Dict) -> "FrequencyTable":
+        table = cls()
+        table.n = content["n"]
+        table.counts = dict(content["counts"])
+        return table
+
+
+class ReferenceProfile:
+    """
+    This class is the drift baseline of a dataframe in O(columns) memory: a TDigest per numeric
+    column, a FrequencyTable per categorical column and the missing values of every column. It is
+    built once when a model is trained and saved next to the model, later data is compared against
+    the profile alone. Profiles of chunks merge into the profile of the whole dataframe, so they are
+    built in parallel (from_dataframe) or from streamed chunks (update).
+
+    compare() gives a report in the format of DriftDetector.detect with the tests evidently uses on
+    large references: normed wasserstein for numeric and jensenshannon for categorical columns,
+    plus the ks / chisquare statistic and p-value of each column.
+    """
+
+    def __init__(self, column_types: Dict[str, str], compression: int = 200):
+        """
+        :param column_types: {column: "num" or "cat"} of the profiled columns
+        :param compression: compression of the t-digests, about compression / 2 centroids per numeric column
+        """
+        self.column_types = dict(column_types)
+        self.compression = compression
+        self.n_rows = 0
+        self.n_missing: Dict[str, int] = {column: 0 for column in self.column_types}
+        self.sketches: Dict[str, Union[TDigest, FrequencyTable]] = {
+            column: TDigest(compression = compression) if feature_type == "num" else FrequencyTable()
+            for column, feature_type in self.column_types.items()
+        }
+
+    @staticmethod
+    def get_column_types(dataframe: pd.DataFrame, schema_config: Optional[dict] = None) -> Dict[str, str]:
+        drift_detector = DriftDetector.from_schema(schema_config) if schema_config is not None else DriftDetector()
+        return {column: drift_detector.get_column_type(column, dataframe[column]) for column in dataframe.columns}
+
+    def update(self, chunk: pd.DataFrame) -> "ReferenceProfile":
+        missing_columns = [column for column in self.column_types if column not in chunk.columns]
+        if len(missing_columns) > 0:
+            raise ValueError(f"Columns {missing_columns} of the profile are missing in the dataframe")
+
+        for column, feature_type in self.column_types.items():
+            values = DriftDetector.get_values(chunk[column], feature_type)
+            self.n_missing[column] += len(chunk) - len(values)
+            self.sketches[column].update(values)
+        self.n_rows += len(chunk)
+        return self
+
+    def merge(self, other: "ReferenceProfile") -> "ReferenceProfile":
+        if other.column_types != self.column_types:
+            raise ValueError("Can not merge profiles of different columns")
+
+        for column, sketch in self.sketches.items():
+            sketch.merge(other.sketches[column])
+            self.n_missing[column] += other.n_missing[column]
+        self.n_rows += other.n_rows
+        return self
+
+    @classmethod
+    def from_dataframe(cls, dataframe: pd.DataFrame, column_types: Optional[Dict[str, str]] = None, compression: int = 200,
+                       chunk_size: int = 100000, max_workers: int = 4) -> "ReferenceProfile":
+        """
+        Profiles the chunks of the dataframe on a thread pool and merges the chunk profiles
+        """
+        try:
+            column_types = column_types or cls.get_column_types(dataframe)
+            chunks = [dataframe.iloc[start : start + chunk_size] for start in range(0, len(dataframe), chunk_size)]
+
+            with ThreadPoolExecutor(max_workers = max(1, max_workers), thread_name_prefix = "profile") as executor:
+                profiles = list(executor.map(lambda chunk: cls(column_types, compression = compression).update(chunk), chunks))
+
+            profile = reduce(lambda profile, other: profile.merge(other), profiles, cls(column_types, compression = compression))
+            logging.info(f"Profiled {profile.n_rows} rows in {len(chunks)} chunks")
+            return profile
+
+        except Exception as e:
+            raise UsVisaException(e, sys) from e
+
+    def get_column_drift(self, column: str, current: "ReferenceProfile") -> Dict:
+        reference_sketch = self.sketches[column]
+        current_sketch = current.sketches[column]
+        if reference_sketch.n == 0 or current_sketch.n == 0:
+            raise ValueError(f"An empty column '{column}' was provided for drift calculation")
+
+        if self.column_types[column] == "num":
+            # wasserstein distance as the mean gap of the two quantile functions, normed like evidently
+            quantiles = (np.arange(10000) + 0.5) / 10000
+            distance = np.mean(np.abs(reference_sketch.quantile(quantiles) - current_sketch.quantile(quantiles)))
+            stattest = "wasserstein"
+            drift_score = float(distance / max(reference_sketch.std, 0.001))
+
+            values = np.union1d(reference_sketch.means, current_sketch.means)
+            statistic = float(np.max(np.abs(reference_sketch.cdf(values) - current_sketch.cdf(values))))
+            effective_n = reference_sketch.n * current_sketch.n / (reference_sketch.n + current_sketch.n)
+            p_value = float(stats.kstwobign.sf(statistic * np.sqrt(effective_n)))
+        else:
+            values = sorted(set(reference_sketch.counts) | set(current_sketch.counts))
+            reference_counts = np.array([reference_sketch.counts.get(value, 0) for value in values], dtype = np.float64)
+            current_counts = np.array([current_sketch.counts.get(value, 0) for value in values], dtype = np.float64)
+            p = reference_counts / reference_counts.sum()
+            q = current_counts / current_counts.sum()
+            m = (p + q) / 2
+            stattest = "jensenshannon"
+            drift_score = float(np.sqrt((np.sum(special.rel_entr(p, m)) + np.sum(special.rel_entr(q, m))) / 2))
+
+            expected = p * current_counts.sum()
+            with np.errstate(divide = "ignore", invalid = "ignore"):
+                statistic = float(np.sum((current_counts - expected) ** 2 / expected))
+            p_value = float(stats.chi2.sf(statistic, max(len(values) - 1, 1)))
+
+        threshold = STATTEST_THRESHOLDS[stattest]
+        return {
+            "feature_type": self.column_types[column],
+            "stattest": stattest,
+            "drift_score": drift_score,
+            "threshold": threshold,
+            "drift_detected": bool(drift_score >= threshold),
+            "statistic": statistic,
+            "p_value": p_value,
+        }
+
+    def compare(self, current: Union[pd.DataFrame, "ReferenceProfile"], drift_share: float = 0.5) -> Dict:
+        """
+        Tests every profiled column of the current dataframe (or of its profile) against the
+        reference, returns the drift report in the format of DriftDetector.detect
+        """
+        try:
+            if isinstance(current, pd.DataFrame):
+                current = ReferenceProfile(self.column_types, compression = self.compression).update(current)
+            elif current.column_types != self.column_types:
+                raise ValueError("Can not compare profiles of different columns")
+
+            columns = list(self.column_types)
+            features = {column: self.get_column_drift(column, current) for column in columns}
+            n_drifted_features = sum(result["drift_detected"] for result in features.values())
+            share_drifted_features = n_drifted_features / len(columns)
+            report = {
+                "dataset_drift": bool(share_drifted_features >= drift_share),
+                "n_features": len(columns),
+                "n_drifted_features": n_drifted_features,
+                "share_drifted_features": share_drifted_features,
+                "drift_share": drift_share,
+                "n_reference_rows": self.n_rows,
+                "n_current_rows": current.n_rows,
+                "features": features,
+            }
+            logging.info(
+                f"Drift against the reference profile in {n_drifted_features} of {len(columns)} columns: "
+                f"{[column for column, result in features.items() if result['drift_detected']]}"
+            )
+            return report
+
+        except Exception as e:
+            raise UsVisaException(e, sys) from e
+
+    def to_dict(self) -> Dict:
+        return {
+            "compression": self.compression,
+            "n_rows": self.n_rows,
+            "column_types": self.column_types,
+            "n_missing": self.n_missing,
+            "sketches": {column: sketch.to_dict() for column, sketch in self.sketches.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, content: Dict) -> "ReferenceProfile":
+        profile = cls(content["column_types"], compression = content["compression"])
+        profile.n_rows = content["n_rows"]
+        profile.n_missing = dict(content["n_missing"])
+        profile.sketches = {
+            column: (TDigest if profile.column_types[column] == "num" else FrequencyTable).from_dict(sketch)
+            for column, sketch in content["sketches"].items()
+        }
+        return profile
+
+    def save(self, file_path: str) -> None:
+        os.makedirs(os.path.dirname(file_path), exist_ok = True)
+        tmp_file_path = f"{file_path}.tmp"
+        with open(tmp_file_path, "w") as file_obj:
+            json.dump(self.to_dict(), file_obj)
+        os.replace(tmp_file_path, file_path)
+        logging.info(f"Saved the reference profile of {self.n_rows} rows to [{file_path}]")
+
+    @classmethod
+    def load(cls, file_path: str) -> "ReferenceProfile":
+        with open(file_path, "r") as file_obj:
+            return cls.from_dict(json.load(file_obj))
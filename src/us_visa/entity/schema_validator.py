@@ -0,0 +1,215 @@
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.us_visa.exception import UsVisaException
+from src.us_visa.logger import logging
+from src.us_visa.utils.main_utils import get_numerical_ranges
+
+
+# values kept per column and rule in the summary
+MAX_EXAMPLES = 5
+
+
+@dataclass
+class ColumnRule:
+    column : str
+    dtype : str # "category" or a numeric type
+    allowed_values : Optional[List] = None
+    min_value : Optional[float] = None
+    max_value : Optional[float] = None
+
+
+@dataclass
+class SchemaValidationResult:
+    summary : Dict
+    row_mask : np.ndarray # True for the rows that break no rule
+    violation_masks : Dict[str, np.ndarray] = field(default_factory = dict, repr = False) # "column:rule" -> rows
+
+    def get_row_violations(self) -> Dict[int, List[str]]:
+        """
+        Returns the "column:rule" violations of every invalid row, by row position
+        """
+        row_violations: Dict[int, List[str]] = {}
+        for name, mask in self.violation_masks.items():
+            for row in np.flatnonzero(mask).tolist():
+                row_violations.setdefault(row, []).append(name)
+        return dict(sorted(row_violations.items()))
+
+
+class SchemaValidator:
+    """
+    This class checks the values of a dataframe against rules compiled from schema.yaml:
+
+    missing            the value is missing (the share of missing values per column is also checked
+                       against max_null_rate)
+    non_numeric        a numeric column holds a value that is not a number
+    unknown_category   a category column holds a value outside category_values
+    below_min / above_max   a number outside numerical_ranges
+
+    Every rule is one vectorized operation over its column (category codes for pandas categories,
+    a hash lookup otherwise), so a chunk is validated in one pass. validate() returns the row masks
+    and a compact summary; light mode skips the example values and is meant for prediction payloads.
+    The rules of the columns missing in the dataframe are skipped, the column checks are done elsewhere.
+    """
+
+    def __init__(self, rules: List[ColumnRule], max_null_rate: float = 0.0, max_invalid_row_rate: float = 0.0):
+        """
+        :param rules: one rule set per column
+        :param max_null_rate: share of missing values from which a column fails
+        :param max_invalid_row_rate: share of invalid rows from which the dataframe fails
+        """
+        self.rules = rules
+        self.max_null_rate = max_null_rate
+        self.max_invalid_row_rate = max_invalid_row_rate
+
+    @classmethod
+    def from_schema(cls, schema_config: dict) -> "SchemaValidator":
+        category_values = schema_config.get("category_values", {})
+        numerical_ranges = get_numerical_ranges(schema_config)
+        rules = []
+        for column in schema_config["columns"] + schema_config.get("derived_columns", []):
+            for name, dtype in column.items():
+                value_range = numerical_ranges.get(name, {})
+                rules.append(ColumnRule(
+                    column = name,
+                    dtype = dtype,
+                    allowed_values = category_values.get(name) if dtype == "category" else None,
+                    min_value = value_range.get("min"),
+                    max_value = value_range.get("max"),
+                ))
+        return cls(
+            rules = rules,
+            max_null_rate = schema_config.get("max_null_rate", 0.0),
+            max_invalid_row_rate = schema_config.get("max_invalid_row_rate", 0.0),
+        )
+
+    @staticmethod
+    def _get_unknown_category_mask(series: pd.Series, allowed_values: List) -> np.ndarray:
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # one lookup per category instead of one per row, the code -1 of missing values picks the appended False
+            is_unknown_category = ~series.cat.categories.isin(allowed_values)
+            return np.append(is_unknown_category, False)[series.cat.codes.to_numpy()]
+        return (~series.isin(allowed_values) & series.notna()).to_numpy()
+
+    def evaluate(self, dataframe: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """
+        Returns the rows breaking each rule as {"column:rule": mask}, rules nobody breaks are left out
+        """
+        masks: Dict[str, np.ndarray] = {}
+        for rule in self.rules:
+            if rule.column not in dataframe.columns:
+                continue
+            series = dataframe[rule.column]
+            is_missing = series.isna().to_numpy()
+            rule_masks = {"missing": is_missing}
+
+            if rule.dtype == "category":
+                if rule.allowed_values is not None:
+                    rule_masks["unknown_category"] = self._get_unknown_category_mask(series, rule.allowed_values)
+            else:
+                values = series if pd.api.types.is_numeric_dtype(series.dtype) else pd.to_numeric(series, errors = "coerce")
+                values = values.to_numpy(dtype = np.float64, na_value = np.nan)
+                rule_masks["non_numeric"] = np.isnan(values) & ~is_missing
+                # nan compares False, missing and non numeric values are not counted twice
+                if rule.min_value is not None:
+                    rule_masks["below_min"] = values < rule.min_value
+                if rule.max_value is not None:
+                    rule_masks["above_max"] = values > rule.max_value
+
+            for name, mask in rule_masks.items():
+                if mask.any():
+                    masks[f"{rule.column}:{name}"] = mask
+        return masks
+
+    def _get_examples(self, dataframe: pd.DataFrame, masks: Dict[str, np.ndarray]) -> Dict[str, List]:
+        examples = {}
+        for name, mask in masks.items():
+            column, rule = name.split(":")
+            if rule != "missing":
+                values = pd.unique(dataframe[column].to_numpy(dtype = object)[mask])[:MAX_EXAMPLES]
+                examples[name] = [value.item() if isinstance(value, np.generic) else value for value in values]
+        return examples
+
+    def _build_summary(self, n_rows: int, n_invalid_rows: int, counts: Dict[str, int],
+                       examples: Optional[Dict[str, List]]) -> Dict:
+        columns: Dict[str, Dict] = {}
+        for name, count in counts.items():
+            column, rule = name.split(":")
+            column_summary = columns.setdefault(column, {"violations": {}})
+            column_summary["violations"][rule] = count
+            if examples is not None and name in examples:
+                column_summary.setdefault("examples", {})[rule] = examples[name]
+
+        failed_columns = []
+        for column, column_summary in columns.items():
+            null_rate = column_summary["violations"].get("missing", 0) / n_rows if n_rows else 0.0
+            column_summary["null_rate"] = null_rate
+            if null_rate > self.max_null_rate:
+                failed_columns.append(column)
+
+        invalid_row_rate = n_invalid_rows / n_rows if n_rows else 0.0
+        return {
+            "is_valid": len(failed_columns) == 0 and invalid_row_rate <= self.max_invalid_row_rate,
+            "n_rows": n_rows,
+            "n_invalid_rows": n_invalid_rows,
+            "invalid_row_rate": invalid_row_rate,
+            "max_invalid_row_rate": self.max_invalid_row_rate,
+            "max_null_rate": self.max_null_rate,
+            "failed_columns": failed_columns,
+            "columns": columns,
+        }
+
+    def validate(self, dataframe: pd.DataFrame, light: bool = False) -> SchemaValidationResult:
+        """
+        Validates the dataframe in one pass, returns the summary and the row masks
+        """
+        try:
+            masks = self.evaluate(dataframe)
+            row_mask = np.ones(len(dataframe), dtype = bool)
+            for mask in masks.values():
+                row_mask &= ~mask
+
+            summary = self._build_summary(
+                n_rows = len(dataframe),
+                n_invalid_rows = int(len(dataframe) - row_mask.sum()),
+                counts = {name: int(mask.sum()) for name, mask in masks.items()},
+                examples = None if light else self._get_examples(dataframe, masks),
+            )
+            return SchemaValidationResult(summary = summary, row_mask = row_mask, violation_masks = masks)
+
+        except Exception as e:
+            raise UsVisaException(e, sys) from e
+
+    def validate_chunks(self, chunks: Iterable[pd.DataFrame]) -> Dict:
+        """
+        Validates the chunks one by one (the masks are not kept) and returns the summary of all of them
+        """
+        try:
+            n_rows, n_invalid_rows = 0, 0
+            counts: Dict[str, int] = {}
+            examples: Dict[str, List] = {}
+            for chunk in chunks:
+                result = self.validate(chunk)
+                n_rows += result.summary["n_rows"]
+                n_invalid_rows += result.summary["n_invalid_rows"]
+                for name, mask in result.violation_masks.items():
+                    counts[name] = counts.get(name, 0) + int(mask.sum())
+                for column, column_summary in result.summary["columns"].items():
+                    for rule, values in column_summary.get("examples", {}).items():
+                        kept_values = examples.setdefault(f"{column}:{rule}", [])
+                        kept_values.extend(value for value in values if value not in kept_values)
+                        del kept_values[MAX_EXAMPLES:]
+
+            summary = self._build_summary(n_rows, n_invalid_rows, counts, examples)
+            logging.info(
+                f"Schema validation: {n_invalid_rows} of {n_rows} rows break the schema, "
+                f"violations {counts}, valid [{summary['is_valid']}]"
+            )
+            return summary
+
+        except Exception as e:
+            raise UsVisaException(e, sys) from e
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from src.us_visa.logger import logging
+
+
+class ServerBusyError(Exception):
+    """
+    Raised when a BoundedExecutor already holds as many tasks as it is allowed to
+    """
+
+
+class BoundedExecutor:
+    """
+    This class runs blocking work (s3 I/O, unpickling, sklearn transform/predict, training)
+    on a worker pool so the asyncio event loop stays free. At most max_workers tasks run
+    and at most max_pending more wait; anything beyond that is rejected with ServerBusyError.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_pending: int, kind: str = "thread",
+                 process_initializer: Optional[Callable] = None, process_initargs: Tuple = ()):
+        """
+        :param name: name used in the logs and the stats
+        :param max_workers: number of tasks running at the same time
+        :param max_pending: number of tasks allowed to wait for a free worker
+        :param kind: "thread" or "process" (the function and its arguments must be picklable for "process")
+        :param process_initializer: called as process_initializer(*process_initargs) in every worker
+            process before its first task, it must not raise (a failing initializer breaks the pool)
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.kind = kind
+        self.process_initializer = process_initializer
+        self.process_initargs = process_initargs
+
+        self._executor : Executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.total_completed = 0
+        self.total_rejected = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(
+                    max_workers = self.max_workers,
+                    initializer = self.process_initializer,
+                    initargs = self.process_initargs
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers = self.max_workers, thread_name_prefix = f"usvisa-{self.name}"
+                )
+            logging.info(f"Created {self.kind} pool [{self.name}] with {self.max_workers} workers")
+        return self._executor
+
+    def _acquire(self) -> None:
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_pending:
+                self.total_rejected += 1
+                raise ServerBusyError(
+                    f"[{self.name}] is saturated: {self._in_flight} tasks in flight"
+                )
+            self._in_flight += 1
+
+    def _release(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self.total_completed += 1
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Runs fn(*args, **kwargs) on the pool and waits for it without blocking the event loop
+        """
+        self._acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), partial(fn, *args, **kwargs))
+        finally:
+            self._release()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "in_flight": self._in_flight,
+                "total_completed": self.total_completed,
+                "total_rejected": self.total_rejected,
+            }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait = False)
+            self._executor = None
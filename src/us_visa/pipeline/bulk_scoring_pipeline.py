@@ -0,0 +1,218 @@
+import os
+import sys
+import json
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.us_visa.constants import CURRENT_YEAR
+from src.us_visa.entity.config_entity import UsVisaPredictorConfig
+from src.us_visa.entity.estimator import TargetValueMapping
+from src.us_visa.exception import UsVisaException
+from src.us_visa.logger import logging
+from src.us_visa.utils.main_utils import load_object
+
+
+# model of the current worker process, loaded once by _init_worker
+_worker_model = None
+
+
+def _init_worker(model_file_path: Optional[str], bucket_name: str, s3_model_path: str) -> None:
+    global _worker_model
+    if model_file_path is not None:
+        _worker_model = load_object(model_file_path)
+    else:
+        from src.us_visa.cloud_storage.aws_storage import StorageService
+        _worker_model = StorageService().load_model(s3_model_path, bucket_name = bucket_name)
+
+
+def _score_chunk(chunk: pd.DataFrame, id_column: Optional[str]) -> pd.DataFrame:
+    """
+    Scores one chunk in a worker process, returns the rows to append to the output file.
+    Rows breaking the schema are not scored, they get an empty prediction and their violations
+    """
+    from src.us_visa.pipeline.prediction_pipeline import UsVisaData, get_schema_validator
+
+    # historical exports carry yr_of_estab instead of company_age
+    if "company_age" not in chunk.columns and "yr_of_estab" in chunk.columns:
+        chunk = chunk.assign(company_age = CURRENT_YEAR - chunk["yr_of_estab"])
+
+    input_df = UsVisaData.select_input_columns(chunk)
+    validation_result = get_schema_validator().validate(input_df, light = True)
+    row_mask = validation_result.row_mask
+
+    labels = np.full(len(input_df), None, dtype = object)
+    if row_mask.any():
+        predictions = _worker_model.predict(dataframe = input_df[row_mask] if not row_mask.all() else input_df)
+        labels[row_mask] = pd.Series(predictions).map(TargetValueMapping().reverse_mapping()).to_numpy()
+
+    violations = np.full(len(input_df), "", dtype = object)
+    for row, row_violations in validation_result.get_row_violations().items():
+        violations[row] = ";".join(row_violations)
+
+    output = pd.DataFrame({"prediction": labels, "violations": violations})
+    if id_column is not None and id_column in chunk.columns:
+        output.insert(0, id_column, chunk[id_column].to_numpy())
+    return output
+
+
+class BulkScoringPipeline:
+    """
+    This class scores an input file of any size (csv or parquet) with the current UsVisaModel.
+    The file is read in fixed size chunks, the chunks are scored on a process pool and the
+    predictions are appended to the output csv in input order. A checkpoint file next to the
+    output records the last completed chunk, so an interrupted run can resume from there.
+    """
+
+    def __init__(self, input_file_path: str, output_file_path: str, chunk_size: int = 50000,
+                 workers: int = os.cpu_count() or 1, model_file_path: Optional[str] = None,
+                 id_column: Optional[str] = "case_id",
+                 prediction_pipeline_config: UsVisaPredictorConfig = UsVisaPredictorConfig()):
+        """
+        :param input_file_path: csv or parquet file with the applicant records
+        :param output_file_path: csv file where the predictions are written
+        :param chunk_size: number of rows scored per chunk
+        :param workers: number of worker processes
+        :param model_file_path: local model.pkl, the model of the s3 bucket is used when None
+        :param id_column: input column copied next to every prediction (skipped if not in the input)
+        """
+        self.input_file_path = input_file_path
+        self.output_file_path = output_file_path
+        self.checkpoint_file_path = f"{output_file_path}.checkpoint.json"
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.model_file_path = model_file_path
+        self.id_column = id_column
+        self.prediction_pipeline_config = prediction_pipeline_config
+
+    def read_chunks(self, skip_chunks: int = 0) -> Iterator[pd.DataFrame]:
+        """
+        Yields the input file chunk by chunk, starting after the first skip_chunks chunks
+        """
+        if self.input_file_path.endswith(".parquet"):
+            import pyarrow.parquet as pq
+
+            parquet_file = pq.ParquetFile(self.input_file_path)
+            for index, batch in enumerate(parquet_file.iter_batches(batch_size = self.chunk_size)):
+                if index >= skip_chunks:
+                    yield batch.to_pandas()
+        else:
+            # the skipped chunks are parsed and dropped one at a time, so a resume holds at most one
+            # chunk however many rows were already scored
+            reader = pd.read_csv(self.input_file_path, chunksize = self.chunk_size, na_values = "na")
+            with reader:
+                for index, chunk in enumerate(reader):
+                    if index >= skip_chunks:
+                        yield chunk
+
+    def read_checkpoint(self) -> Dict:
+        if not os.path.exists(self.checkpoint_file_path):
+            return {"completed_chunks": 0, "output_bytes": 0, "rows": 0}
+
+        with open(self.checkpoint_file_path, "r") as file_obj:
+            checkpoint = json.load(file_obj)
+
+        if checkpoint.get("input_file_path") != self.input_file_path or checkpoint.get("chunk_size") != self.chunk_size:
+            raise ValueError(
+                f"Checkpoint [{self.checkpoint_file_path}] was written for another input file or chunk size"
+            )
+        return checkpoint
+
+    def write_checkpoint(self, completed_chunks: int, output_bytes: int, rows: int) -> None:
+        tmp_file_path = f"{self.checkpoint_file_path}.tmp"
+        with open(tmp_file_path, "w") as file_obj:
+            json.dump({
+                "input_file_path": self.input_file_path,
+                "chunk_size": self.chunk_size,
+                "completed_chunks": completed_chunks,
+                "output_bytes": output_bytes,
+                "rows": rows,
+            }, file_obj)
+        os.replace(tmp_file_path, self.checkpoint_file_path)
+
+    def run(self, resume: bool = False) -> Dict:
+        """
+        Scores the whole input file and returns a summary (rows, chunks, seconds, rows_per_second)
+        """
+        try:
+            logging.info(f"Entered run method of BulkScoringPipeline class [{self.input_file_path}]")
+
+            checkpoint = self.read_checkpoint() if resume else {"completed_chunks": 0, "output_bytes": 0, "rows": 0}
+            completed_chunks = checkpoint["completed_chunks"]
+            rows_done = checkpoint["rows"]
+            rows_this_run = 0
+
+            output_dir = os.path.dirname(self.output_file_path)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok = True)
+
+            # drop whatever was written after the last checkpoint
+            output_file = open(self.output_file_path, "r+b" if resume and os.path.exists(self.output_file_path) else "wb")
+            output_file.truncate(checkpoint["output_bytes"])
+            output_file.seek(checkpoint["output_bytes"])
+
+            if completed_chunks > 0:
+                logging.info(f"Resuming after chunk {completed_chunks} ({rows_done} rows already scored)")
+
+            start_time = time.perf_counter()
+            executor = ProcessPoolExecutor(
+                max_workers = self.workers,
+                initializer = _init_worker,
+                initargs = (
+                    self.model_file_path,
+                    self.prediction_pipeline_config.model_bucket_name,
+                    self.prediction_pipeline_config.model_file_path
+                )
+            )
+
+            try:
+                # at most two chunks per worker are held in memory at any time
+                in_flight = deque()
+                chunks = self.read_chunks(skip_chunks = completed_chunks)
+
+                while True:
+                    while len(in_flight) < 2 * self.workers:
+                        chunk = next(chunks, None)
+                        if chunk is None:
+                            break
+                        in_flight.append(executor.submit(_score_chunk, chunk, self.id_column))
+
+                    if len(in_flight) == 0:
+                        break
+
+                    scored_chunk = in_flight.popleft().result()
+                    output_file.write(
+                        scored_chunk.to_csv(index = False, header = output_file.tell() == 0).encode()
+                    )
+                    output_file.flush()
+
+                    completed_chunks += 1
+                    rows_done += len(scored_chunk)
+                    rows_this_run += len(scored_chunk)
+                    self.write_checkpoint(completed_chunks, output_file.tell(), rows_done)
+
+                    elapsed = time.perf_counter() - start_time
+                    logging.info(
+                        f"Scored chunk {completed_chunks}: {rows_done} rows total, {rows_this_run / elapsed:.0f} rows/sec"
+                    )
+            finally:
+                executor.shutdown(cancel_futures = True)
+                output_file.close()
+
+            elapsed = time.perf_counter() - start_time
+            summary = {
+                "rows": rows_done,
+                "rows_this_run": rows_this_run,
+                "chunks": completed_chunks,
+                "seconds": elapsed,
+                "rows_per_second": rows_this_run / elapsed if elapsed > 0 else 0.0,
+            }
+            logging.info(f"Exited run method of BulkScoringPipeline class: {summary}")
+            return summary
+
+        except Exception as e:
+            raise UsVisaException(e, sys) from e
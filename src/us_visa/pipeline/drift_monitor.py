@@ -0,0 +1,262 @@
+import sys
+import json
+import time
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.us_visa.cloud_storage.aws_storage import StorageService
+from src.us_visa.constants import TARGET_COLUMN
+from src.us_visa.entity.reference_profile import ReferenceProfile
+from src.us_visa.exception import UsVisaException
+from src.us_visa.logger import logging
+
+
+class _Shard:
+    """
+    Profiles of the rows recorded by one thread: the rows not folded yet and one
+    ReferenceProfile per time bucket
+    """
+
+    def __init__(self):
+        # guards pending, only held for an append or a swap
+        self.lock = threading.Lock()
+        self.pending: List[Tuple[int, List[Tuple], np.ndarray]] = []
+        self.n_pending = 0
+        # guards profiles, held while rows are folded or the window is merged
+        self.profiles_lock = threading.Lock()
+        self.profiles: Dict[int, ReferenceProfile] = {}
+
+
+class DriftMonitor:
+    """
+    This class profiles the features scored by the serving process and their predictions over a
+    sliding window, and compares the window with the reference profile of the resident model.
+
+    Every thread records into its own shard, so a request never waits for another request: it only
+    appends its rows (the normalized feature tuples the prediction cache already made) to the shard
+    buffer. A background flusher thread folds a buffer into the shard's ReferenceProfile of its time
+    bucket once it holds flush_rows rows, so the profiling never runs on the request path. The window
+    is window_seconds long in n_buckets buckets, the report merges the buckets of all the shards (the
+    sketches are mergeable) and buckets that slid out of the window are dropped.
+
+    Like the prediction cache, the monitor is per process: with a process executor every worker
+    only sees its own traffic.
+    """
+
+    def __init__(self, feature_columns: List[str], numeric_columns: List[str], bucket_name: str,
+                 reference_profile_path: str, window_seconds: int, n_buckets: int, flush_rows: int,
+                 min_rows: int, drift_share: float = 0.5, compression: int = 200):
+        """
+        :param feature_columns: model input columns, in the order of the recorded rows
+        :param numeric_columns: columns profiled as numbers, the others (and the prediction) as categories
+        :param bucket_name: Name of your model bucket
+        :param reference_profile_path: Location of the reference profile of the model in bucket
+        :param window_seconds: length of the sliding window
+        :param n_buckets: number of time buckets of the window
+        :param flush_rows: rows buffered per thread before the flusher folds them into the sketches
+        :param min_rows: rows the window needs before it is compared with the reference
+        :param drift_share: share of drifted columns from which the traffic drifts
+        :param compression: compression of the t-digests
+        """
+        self.feature_columns = feature_columns
+        self.column_types = {
+            **{column: "num" if column in numeric_columns else "cat" for column in feature_columns},
+            TARGET_COLUMN: "cat",
+        }
+        self.bucket_name = bucket_name
+        self.reference_profile_path = reference_profile_path
+        self.window_seconds = window_seconds
+        self.n_buckets = n_buckets
+        self.bucket_seconds = window_seconds / n_buckets
+        self.flush_rows = flush_rows
+        self.min_rows = min_rows
+        self.drift_share = drift_share
+        self.compression = compression
+
+        self._local = threading.local()
+        self._shards: List[_Shard] = []
+        # only taken when a thread records for the first time or when the shards are read
+        self._shards_lock = threading.Lock()
+        # (profile, version) is kept as one tuple so a reader always gets a matching pair
+        self._reference: Tuple[Optional[ReferenceProfile], Optional[str]] = (None, None)
+        self._reference_lock = threading.Lock()
+        self._s3: Optional[StorageService] = None
+
+        # set by record when a shard is full, the flusher also wakes every bucket to drop old buckets
+        self._flush_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._flush_thread: Optional[threading.Thread] = None
+        self._flush_thread_lock = threading.Lock()
+
+    def _get_shard(self) -> _Shard:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = _Shard()
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def _get_bucket(self, now: Optional[float] = None) -> int:
+        return int((time.time() if now is None else now) // self.bucket_seconds)
+
+    def record(self, rows: List[Tuple], predictions: np.ndarray) -> None:
+        """
+        Records the scored rows (tuples in feature_columns order) and their predictions,
+        only appends them: the flusher thread updates the sketches every flush_rows rows
+        """
+        if len(rows) == 0:
+            return
+
+        shard = self._get_shard()
+        # uncontended: only the flusher and a report take the buffer of another thread
+        with shard.lock:
+            shard.pending.append((self._get_bucket(), rows, np.asarray(predictions)))
+            shard.n_pending += len(rows)
+            is_full = shard.n_pending >= self.flush_rows
+
+        if is_full:
+            self._flush_event.set()
+        if self._flush_thread is None:
+            self.start_background_flush()
+
+    def _flush(self, shard: _Shard) -> None:
+        # must be called with the shard profiles lock held, the buffer is taken under it so a
+        # report never sees rows that left the buffer but are not in the profiles yet
+        with shard.lock:
+            pending = shard.pending
+            shard.pending, shard.n_pending = [], 0
+
+        pending_by_bucket: Dict[int, Tuple[List[Tuple], List[np.ndarray]]] = {}
+        for bucket, rows, predictions in pending:
+            bucket_rows, bucket_predictions = pending_by_bucket.setdefault(bucket, ([], []))
+            bucket_rows.extend(rows)
+            bucket_predictions.append(predictions)
+
+        for bucket, (bucket_rows, bucket_predictions) in pending_by_bucket.items():
+            rows = pd.DataFrame.from_records(bucket_rows, columns = self.feature_columns)
+            rows[TARGET_COLUMN] = np.concatenate(bucket_predictions)
+            # the web form sends numbers as strings, values that are not numbers count as missing
+            for column, feature_type in self.column_types.items():
+                if feature_type == "num":
+                    rows[column] = pd.to_numeric(rows[column], errors = "coerce")
+            profile = shard.profiles.get(bucket)
+            if profile is None:
+                profile = shard.profiles[bucket] = ReferenceProfile(self.column_types, compression = self.compression)
+            profile.update(rows)
+
+        first_bucket = self._get_bucket() - self.n_buckets + 1
+        for bucket in [bucket for bucket in shard.profiles if bucket < first_bucket]:
+            del shard.profiles[bucket]
+
+    def flush(self, min_rows: int = 0) -> None:
+        """
+        Folds the buffers of the shards holding at least min_rows rows into their profiles
+        """
+        with self._shards_lock:
+            shards = list(self._shards)
+
+        for shard in shards:
+            # n_pending is read without the lock, a shard missed now is taken on the next wake up
+            if shard.n_pending < min_rows:
+                continue
+            with shard.profiles_lock:
+                self._flush(shard)
+
+    def _flush_loop(self) -> None:
+        while not self._stop_event.is_set():
+            self._flush_event.wait(self.bucket_seconds)
+            self._flush_event.clear()
+            if self._stop_event.is_set():
+                break
+            try:
+                self.flush(min_rows = self.flush_rows)
+            except Exception as e:
+                # the rows of a failed flush are lost for the window, keep flushing the next ones
+                logging.info(f"Drift monitor flush failed: {e}")
+
+    def start_background_flush(self) -> None:
+        with self._flush_thread_lock:
+            if self._flush_thread is not None and self._flush_thread.is_alive():
+                return
+
+            self._stop_event.clear()
+            self._flush_thread = threading.Thread(
+                target = self._flush_loop, name = "usvisa-drift-flush", daemon = True
+            )
+            self._flush_thread.start()
+            logging.info(f"Started drift monitor flusher every {self.flush_rows} rows per thread")
+
+    def stop_background_flush(self) -> None:
+        self._stop_event.set()
+        self._flush_event.set()
+        if self._flush_thread is not None:
+            self._flush_thread.join(timeout = 5)
+            self._flush_thread = None
+
+    def get_window_profile(self) -> ReferenceProfile:
+        """
+        Merges the profiles of the window of every shard into one profile
+        """
+        first_bucket = self._get_bucket() - self.n_buckets + 1
+        window_profile = ReferenceProfile(self.column_types, compression = self.compression)
+        with self._shards_lock:
+            shards = list(self._shards)
+
+        for shard in shards:
+            with shard.profiles_lock:
+                self._flush(shard)
+                for bucket, profile in shard.profiles.items():
+                    if bucket >= first_bucket:
+                        # merge only reads the shard profile, the window profile gets new arrays
+                        window_profile.merge(profile)
+        return window_profile
+
+    def get_reference_profile(self) -> Tuple[ReferenceProfile, str]:
+        """
+        Returns the reference profile of the model in s3 and its version, it is downloaded
+        again only when its version changed
+        """
+        with self._reference_lock:
+            if self._s3 is None:
+                self._s3 = StorageService()
+            reference_profile, current_version = self._reference
+            latest_version = self._s3.get_object_version(key = self.reference_profile_path, bucket_name = self.bucket_name)
+            if latest_version is None:
+                raise FileNotFoundError(f"Reference profile [{self.reference_profile_path}] not found in [{self.bucket_name}] bucket")
+
+            if reference_profile is None or latest_version != current_version:
+                logging.info(f"Loading reference profile [{self.reference_profile_path}] version [{latest_version}]")
+                content = self._s3.get_model_bytes(self.reference_profile_path, bucket_name = self.bucket_name)
+                self._reference = (ReferenceProfile.from_dict(json.loads(content)), latest_version)
+            return self._reference
+
+    def get_drift_report(self) -> Dict:
+        """
+        Compares the window with the reference profile, returns the drift report of
+        ReferenceProfile.compare with the prediction rates of the reference and of the window
+        """
+        try:
+            window_profile = self.get_window_profile()
+            window = {
+                "window_seconds": self.window_seconds,
+                "n_buckets": self.n_buckets,
+                "n_current_rows": window_profile.n_rows,
+                "min_rows": self.min_rows,
+            }
+            if window_profile.n_rows < self.min_rows:
+                return {"status": "insufficient_data", **window}
+
+            reference_profile, reference_version = self.get_reference_profile()
+            report = reference_profile.compare(window_profile, drift_share = self.drift_share)
+            report["prediction_rate"] = {
+                "reference": reference_profile.sketches[TARGET_COLUMN].get_proportions(),
+                "window": window_profile.sketches[TARGET_COLUMN].get_proportions(),
+            }
+            return {"status": "ok", "reference_version": reference_version, **window, **report}
+
+        except Exception as e:
+            raise UsVisaException(e, sys) from e
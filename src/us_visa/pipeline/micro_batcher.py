@@ -0,0 +1,168 @@
+import sys
+import asyncio
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set
+
+import numpy as np
+import pandas as pd
+
+from src.us_visa.exception import UsVisaException
+from src.us_visa.logger import logging
+from src.us_visa.pipeline.bounded_executor import BoundedExecutor
+
+
+@dataclass
+class _PendingRequest:
+    dataframe : pd.DataFrame
+    future : asyncio.Future
+
+
+class UsVisaMicroBatcher:
+    """
+    This class collects the dataframes of concurrent prediction requests for a short window,
+    scores them with one batched predict call and hands every request back its own rows.
+    When the batched call fails (a bad submission, e.g. an unknown category) every request of
+    the batch is scored again on its own, so only the bad request gets the error.
+    """
+
+    def __init__(self, predict_fn: Callable[[pd.DataFrame], np.ndarray], max_batch_size: int, max_wait_ms: float,
+                 executor: BoundedExecutor):
+        """
+        :param predict_fn: blocking function that scores a dataframe (UsVisaClassifier.predict)
+        :param max_batch_size: a batch is flushed as soon as it holds this many rows
+        :param max_wait_ms: a batch is flushed at most this many milliseconds after its first request
+        :param executor: bounded pool the batched predict call runs on
+        """
+        self.predict_fn = predict_fn
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000.0
+
+        self._queue : Optional[asyncio.Queue] = None
+        self._worker : Optional[asyncio.Task] = None
+        self._loop : Optional[asyncio.AbstractEventLoop] = None
+        self._scoring_tasks : Set[asyncio.Task] = set()
+
+        # stats
+        self._stats_lock = threading.Lock()
+        self.total_requests = 0
+        self.total_batches = 0
+        self.total_rows = 0
+        self.max_observed_batch_size = 0
+        self.last_batch_size = 0
+        self.total_failed_batches = 0
+
+    def _ensure_worker(self) -> None:
+        """
+        (Re)creates the queue and worker task for the running event loop
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+            logging.info(
+                f"Started micro batching worker [max_batch_size = {self.max_batch_size}, max_wait_ms = {self.max_wait_seconds * 1000}]"
+            )
+
+    async def submit(self, dataframe: pd.DataFrame) -> np.ndarray:
+        """
+        Queues the dataframe for the next batch and waits for its predictions
+        """
+        self._ensure_worker()
+        future = self._loop.create_future()
+        await self._queue.put(_PendingRequest(dataframe = dataframe, future = future))
+        return await future
+
+    async def _collect_batch(self) -> List[_PendingRequest]:
+        # wait (without a deadline) for the first request of the batch
+        batch = [await self._queue.get()]
+        rows = len(batch[0].dataframe)
+        deadline = self._loop.time() + self.max_wait_seconds
+
+        while rows < self.max_batch_size:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                request = await asyncio.wait_for(self._queue.get(), timeout = timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(request)
+            rows += len(request.dataframe)
+
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect_batch()
+            # score in the background so the next batch can be collected (and run) meanwhile
+            task = self._loop.create_task(self._score_batch(batch))
+            self._scoring_tasks.add(task)
+            task.add_done_callback(self._scoring_tasks.discard)
+
+    async def _score_batch(self, batch: List[_PendingRequest]) -> None:
+        try:
+            batch_df = pd.concat([request.dataframe for request in batch], ignore_index = True)
+            self._record_batch(requests = len(batch), rows = len(batch_df))
+
+            # the model call is blocking, keep it off the event loop
+            predictions = await self.executor.run(self.predict_fn, batch_df)
+
+            # fan the predictions back out, request by request
+            start = 0
+            for request in batch:
+                end = start + len(request.dataframe)
+                if not request.future.done():
+                    request.future.set_result(predictions[start:end])
+                start = end
+
+        except Exception as e:
+            if len(batch) == 1:
+                if not batch[0].future.done():
+                    batch[0].future.set_exception(e)
+                return
+
+            logging.info(f"Micro batch of {len(batch)} requests failed, scoring them one by one: {e}")
+            with self._stats_lock:
+                self.total_failed_batches += 1
+            await asyncio.gather(*[self._score_request(request) for request in batch])
+
+    async def _score_request(self, request: _PendingRequest) -> None:
+        try:
+            predictions = await self.executor.run(self.predict_fn, request.dataframe)
+            if not request.future.done():
+                request.future.set_result(predictions)
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+
+    def _record_batch(self, requests: int, rows: int) -> None:
+        with self._stats_lock:
+            self.total_requests += requests
+            self.total_batches += 1
+            self.total_rows += rows
+            self.last_batch_size = rows
+            self.max_observed_batch_size = max(self.max_observed_batch_size, rows)
+
+    def get_stats(self) -> Dict:
+        """
+        Returns queue depth and batch size stats of the batcher
+        """
+        try:
+            with self._stats_lock:
+                return {
+                    "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+                    "max_batch_size": self.max_batch_size,
+                    "max_wait_ms": self.max_wait_seconds * 1000,
+                    "total_requests": self.total_requests,
+                    "total_batches": self.total_batches,
+                    "total_rows": self.total_rows,
+                    "average_batch_size": self.total_rows / self.total_batches if self.total_batches else 0.0,
+                    "last_batch_size": self.last_batch_size,
+                    "max_observed_batch_size": self.max_observed_batch_size,
+                    "total_failed_batches": self.total_failed_batches,
+                }
+        except Exception as e:
+            raise UsVisaException(e, sys) from e
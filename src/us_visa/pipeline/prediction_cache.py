@@ -0,0 +1,113 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import pandas as pd
+
+
+class PredictionCache:
+    """
+    This class is a bounded LRU cache with a TTL for model predictions, keyed on the
+    applicant features as the model sees them. Every entry belongs to one model version, the whole
+    cache is dropped as soon as a prediction for another model version comes in.
+    """
+
+    def __init__(self, feature_columns: List[str], numeric_columns: List[str], max_size: int, ttl_seconds: float):
+        """
+        :param feature_columns: model input columns, in the order used for the key
+        :param numeric_columns: columns keyed as float ("42", 42 and 42.0 share a key, the model casts
+            them to the same float64), the other columns are keyed on their raw value
+        :param max_size: maximum number of cached predictions
+        :param ttl_seconds: age after which an entry is not served any more
+        """
+        self.feature_columns = feature_columns
+        self.numeric_columns = set(numeric_columns)
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+
+        self._entries: "OrderedDict[Tuple, Tuple[object, float]]" = OrderedDict()
+        self._model_version: Optional[Hashable] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def make_keys(self, dataframe: pd.DataFrame) -> List[Tuple]:
+        """
+        Returns the key of every row of the dataframe. A category is keyed exactly as the encoders
+        get it (" Asia " is not "Asia"), so a cached prediction is only served for values the model
+        would score the same way
+        """
+        # column lists are much cheaper than itertuples on the small frames of the serving path
+        columns = [
+            [self._normalize_number(value) for value in dataframe[column].tolist()]
+            if column in self.numeric_columns else dataframe[column].tolist()
+            for column in self.feature_columns
+        ]
+        return list(zip(*columns))
+
+    @staticmethod
+    def _normalize_number(value):
+        # float() parses strings like the float64 cast of the preprocessor does
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return value
+
+    def _check_version(self, model_version: Hashable) -> None:
+        # must be called with the lock held
+        if model_version != self._model_version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._model_version = model_version
+
+    def get_many(self, keys: List[Tuple], model_version: Hashable) -> List[Optional[object]]:
+        """
+        Returns the cached prediction of every key (None where there is no fresh entry)
+        """
+        now = time.monotonic()
+        results = []
+        with self._lock:
+            self._check_version(model_version)
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and now - entry[1] <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    results.append(entry[0])
+                    self.hits += 1
+                else:
+                    if entry is not None:
+                        del self._entries[key]
+                    results.append(None)
+                    self.misses += 1
+        return results
+
+    def put_many(self, keys: List[Tuple], predictions: List[object], model_version: Hashable) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(model_version)
+            for key, prediction in zip(keys, predictions):
+                self._entries[key] = (prediction, now)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last = False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "model_version": self._model_version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
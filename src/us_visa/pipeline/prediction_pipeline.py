@@ -1,11 +1,18 @@
 import os 
 import sys 
+import time
+from typing import List , Dict , IO , Optional , Tuple
 
 import numpy as np
 import pandas as pd 
 
 from src.us_visa.entity.config_entity import UsVisaPredictorConfig
-from src.us_visa.entity.s3_estimator import USvisaEstimator
+from src.us_visa.entity.model_cache import UsVisaModelCache , get_model_cache
+from src.us_visa.entity.estimator import TargetValueMapping
+from src.us_visa.constants import PREDICTION_FAST_PATH_MAX_ROWS , SCHEMA_FILE_PATH
+from src.us_visa.entity.schema_validator import SchemaValidator
+from src.us_visa.pipeline.prediction_cache import PredictionCache
+from src.us_visa.pipeline.drift_monitor import DriftMonitor
 from src.us_visa.exception import UsVisaException
 from src.us_visa.logger import logging
 from src.us_visa.utils.main_utils import read_yaml_file
@@ -16,6 +23,20 @@ class UsVisaData:
     """ 
     
     """
+    # input features of the trained model, in the order the web form sends them
+    input_columns : List[str] = [
+        "continent", "education_of_employee", "has_job_experience", "requires_job_training",
+        "no_of_employees", "region_of_employment", "prevailing_wage", "unit_of_wage",
+        "full_time_position", "company_age"
+    ]
+    numeric_columns : List[str] = ["no_of_employees", "prevailing_wage", "company_age"]
+    # a typical application, used for the warm-up predictions at startup
+    sample_record : Dict = {
+        "continent": "Asia", "education_of_employee": "Master's", "has_job_experience": "Y",
+        "requires_job_training": "N", "no_of_employees": 2412, "region_of_employment": "Northeast",
+        "prevailing_wage": 83425.65, "unit_of_wage": "Year", "full_time_position": "Y", "company_age": 23
+    }
+    
     def __init__(self,
         continent , education_of_employee , has_job_experience , requires_job_training,
         no_of_employees , region_of_employment , prevailing_wage , unit_of_wage,
@@ -75,17 +96,109 @@ class UsVisaData:
         """
         try:
            usvisa_input_dict = self.get_usvisa_data_as_dict()
-           return  usvisa_input_dict
+           return  pd.DataFrame(usvisa_input_dict)
+        except Exception as e:
+            raise UsVisaException(e , sys) from e 
+    
+    @classmethod
+    def get_batch_input_data_frame(cls , records : List[Dict]) -> pd.DataFrame:
+        """ 
+        converts a list of applicant records (json array) into one dataframe
+        """
+        try:
+            logging.info(f"Entered get_batch_input_data_frame method of UsVisaData class [records = {len(records)}]")
+            return cls.select_input_columns(pd.DataFrame.from_records(records))
+        except Exception as e:
+            raise UsVisaException(e , sys) from e 
+    
+    @classmethod
+    def get_batch_input_data_frame_from_csv(cls , file : IO) -> pd.DataFrame:
+        """ 
+        reads the applicant records of an uploaded csv file into one dataframe
+        """
+        try:
+            logging.info("Entered get_batch_input_data_frame_from_csv method of UsVisaData class")
+            return cls.select_input_columns(pd.read_csv(file , na_values = "na"))
         except Exception as e:
             raise UsVisaException(e , sys) from e 
+    
+    @classmethod
+    def select_input_columns(cls , dataframe : pd.DataFrame) -> pd.DataFrame:
+        """ 
+        checks that every model feature is present and keeps only those columns
+        """
+        missing_columns = [column for column in cls.input_columns if column not in dataframe.columns]
+        if len(missing_columns) > 0:
+            raise ValueError(f"Missing columns in batch input: {missing_columns}")
+        
+        return dataframe[cls.input_columns]
+
 
 
+# process wide prediction cache, shared by every classifier object
+_prediction_cache : PredictionCache = None
+
+
+def get_prediction_cache(prediction_pipeline_config : UsVisaPredictorConfig) -> PredictionCache:
+    global _prediction_cache
+    if _prediction_cache is None:
+        _prediction_cache = PredictionCache(
+            feature_columns = UsVisaData.input_columns,
+            numeric_columns = UsVisaData.numeric_columns,
+            max_size = prediction_pipeline_config.prediction_cache_max_size,
+            ttl_seconds = prediction_pipeline_config.prediction_cache_ttl_seconds
+        )
+    return _prediction_cache
+
+
+# process wide drift monitor of the scored rows, shared by every classifier object
+_drift_monitor : DriftMonitor = None
+
+
+def get_drift_monitor(prediction_pipeline_config : UsVisaPredictorConfig) -> DriftMonitor:
+    global _drift_monitor
+    if _drift_monitor is None:
+        _drift_monitor = DriftMonitor(
+            feature_columns = UsVisaData.input_columns,
+            numeric_columns = UsVisaData.numeric_columns,
+            bucket_name = prediction_pipeline_config.model_bucket_name,
+            reference_profile_path = prediction_pipeline_config.reference_profile_file_path,
+            window_seconds = prediction_pipeline_config.drift_window_seconds,
+            n_buckets = prediction_pipeline_config.drift_window_buckets,
+            flush_rows = prediction_pipeline_config.drift_flush_rows,
+            min_rows = prediction_pipeline_config.drift_min_rows,
+            drift_share = prediction_pipeline_config.drift_share,
+            compression = prediction_pipeline_config.drift_compression
+        )
+    return _drift_monitor
+
+
+# process wide validator of the batch payloads, compiled once from the schema
+_schema_validator : SchemaValidator = None
+
+
+def get_schema_validator() -> SchemaValidator:
+    global _schema_validator
+    if _schema_validator is None:
+        _schema_validator = SchemaValidator.from_schema(read_yaml_file(SCHEMA_FILE_PATH))
+    return _schema_validator
+
 
 class UsVisaClassifier:
     def __init__(self , prediction_pipeline_config : UsVisaPredictorConfig = UsVisaPredictorConfig() , ) -> None:
         try:
             
             self.prediction_pipeline_config = prediction_pipeline_config 
+            
+            # process wide model, loaded once and shared by every classifier object
+            self.model_cache : UsVisaModelCache = get_model_cache(
+                bucket_name = self.prediction_pipeline_config.model_bucket_name,
+                model_path = self.prediction_pipeline_config.model_file_path,
+                refresh_interval = self.prediction_pipeline_config.model_refresh_interval_seconds
+            )
+            self.prediction_cache : PredictionCache = get_prediction_cache(self.prediction_pipeline_config)
+            self.drift_monitor : DriftMonitor = get_drift_monitor(self.prediction_pipeline_config)
+            self.schema_validator : SchemaValidator = get_schema_validator()
         except Exception as e:
             raise UsVisaException(e , sys) from e 
     
@@ -98,13 +211,139 @@ class UsVisaClassifier:
         try:
             logging.info("Entered predict method of USvisaClassifier class")
         
-            model = USvisaEstimator(
-                bucket_name = self.prediction_pipeline_config.model_bucket_name,
-                model_path = self.prediction_pipeline_config.model_file_path
-            ) 
+            # one read, the cache keys must carry the version of the model that made the predictions
+            model , model_version = self.model_cache.get_model_and_version()
             
-            result = model.predict(dataframe = dataframe)
+            # serve repeated applicants from the cache, only the misses go through the model
+            keys = self.prediction_cache.make_keys(dataframe)
+            result = self.prediction_cache.get_many(keys , model_version)
+            missing_rows = [row for row , prediction in enumerate(result) if prediction is None]
+            
+            if len(missing_rows) > 0:
+                predictions = model.predict(dataframe = dataframe.iloc[missing_rows])
+                self.prediction_cache.put_many([keys[row] for row in missing_rows] , list(predictions) , model_version)
+                for row , prediction in zip(missing_rows , predictions):
+                    result[row] = prediction
+            
+            result = np.array(result)
+            if self.prediction_pipeline_config.drift_monitor_enabled:
+                try:
+                    # the cache keys are the normalized feature tuples of the rows
+                    self.drift_monitor.record(keys , result)
+                except Exception as e:
+                    # monitoring never fails a prediction
+                    logging.info(f"Drift monitor could not record the rows: {e}")
             
             return result
         except Exception as e:
-            raise UsVisaException(e , sys) from e 
\ No newline at end of file
+            raise UsVisaException(e , sys) from e 
+    
+    def predict_batch(self , dataframe : pd.DataFrame) -> Tuple[List[Optional[str]] , Dict[int , List[str]]]:
+        """ 
+        This method checks the rows of the dataframe against the schema and scores the valid ones with
+        one model call, a row with an unknown category or an out of range value would fail the whole batch
+        Returns: list of predicted labels (Certified / Denied, None for an invalid row), one per row,
+        and the "column:rule" violations of the invalid rows by row position
+        """
+        
+        try:
+            logging.info(f"Entered predict_batch method of USvisaClassifier class [rows = {len(dataframe)}]")
+            
+            if len(dataframe) == 0:
+                return [] , {}
+            
+            validation_result = self.schema_validator.validate(dataframe , light = True)
+            row_mask = validation_result.row_mask
+            
+            labels = [None] * len(dataframe)
+            if row_mask.any():
+                predictions = self.predict(dataframe = dataframe[row_mask] if not row_mask.all() else dataframe)
+                
+                # map the encoded target back to its label
+                valid_labels = pd.Series(predictions).map(TargetValueMapping().reverse_mapping()).tolist()
+                for row , label in zip(np.flatnonzero(row_mask).tolist() , valid_labels):
+                    labels[row] = label
+            
+            invalid_rows = validation_result.get_row_violations()
+            if len(invalid_rows) > 0:
+                logging.info(f"Rows not scored for breaking the schema: {len(invalid_rows)}")
+            
+            logging.info("Exited predict_batch method of USvisaClassifier class")
+            return labels , invalid_rows
+        except Exception as e:
+            raise UsVisaException(e , sys) from e 
+    
+    def warm_up(self , rounds : int) -> Dict:
+        """ 
+        This method loads the resident model and runs synthetic predictions through UsVisaModel.predict,
+        so the first real request does not pay for the s3 download, unpickling and first call allocations.
+        The prediction cache is bypassed on purpose, it must not be filled with synthetic rows.
+        Returns: timings of the load and of the warm-up predictions
+        """
+        
+        try:
+            logging.info("Entered warm_up method of USvisaClassifier class")
+            
+            start_time = time.perf_counter()
+            model , model_version = self.model_cache.get_model_and_version()
+            load_seconds = time.perf_counter() - start_time
+            
+            # the probe rows of the compiled preprocessor hit every known category
+            compiled_preprocessor = getattr(model , "compiled_preprocessor" , None)
+            if compiled_preprocessor is not None:
+                sample_df = compiled_preprocessor.get_probe_frame()
+            else:
+                sample_df = pd.DataFrame([UsVisaData.sample_record])
+            
+            # one row and small frames take the fast path, large frames the ColumnTransformer
+            large_df = sample_df.sample(n = PREDICTION_FAST_PATH_MAX_ROWS + 1 , replace = True , random_state = 42)
+            warmup_frames = [sample_df.head(1) , sample_df , large_df]
+            
+            start_time = time.perf_counter()
+            for _ in range(rounds):
+                for warmup_df in warmup_frames:
+                    model.predict(dataframe = warmup_df)
+            warmup_seconds = time.perf_counter() - start_time
+            
+            logging.info(
+                f"Model version [{model_version}] loaded in {load_seconds:.3f}s, "
+                f"warmed up in {warmup_seconds:.3f}s"
+            )
+            logging.info("Exited warm_up method of USvisaClassifier class")
+            
+            return {
+                "model_version": model_version,
+                "load_seconds": load_seconds,
+                "warmup_seconds": warmup_seconds,
+                "warmup_rounds": rounds,
+            }
+        except Exception as e:
+            raise UsVisaException(e , sys) from e 
+
+
+# module level entry points, so they can be shipped to a process pool worker
+def predict_usvisa(dataframe : pd.DataFrame):
+    return UsVisaClassifier().predict(dataframe = dataframe)
+
+
+def predict_usvisa_batch(dataframe : pd.DataFrame) -> Tuple[List[Optional[str]] , Dict[int , List[str]]]:
+    return UsVisaClassifier().predict_batch(dataframe = dataframe)
+
+
+def warm_up_usvisa_model(rounds : int) -> Dict:
+    return UsVisaClassifier().warm_up(rounds = rounds)
+
+
+def init_usvisa_worker(rounds : int) -> None:
+    """ 
+    Initializer of the inference worker processes: every process loads and warms up its own
+    resident model before its first task. A failure is only logged, the first task loads the model then.
+    """
+    try:
+        warm_up_usvisa_model(rounds = rounds)
+    except Exception as e:
+        logging.info(f"Warm-up of inference worker process [{os.getpid()}] failed: {e}")
+
+
+def get_usvisa_drift_report() -> Dict:
+    return UsVisaClassifier().drift_monitor.get_drift_report()
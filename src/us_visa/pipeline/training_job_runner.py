@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import uuid
+import threading
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Optional
+
+from src.us_visa.exception import UsVisaException
+from src.us_visa.logger import logging
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec = "seconds")
+
+
+class TrainingJobStatus:
+    """
+    This class reads and writes the status file of one training job.
+    The worker process writes it, the web app reads it, so the file is the only shared state.
+    """
+
+    def __init__(self, status_file_path: str):
+        self.status_file_path = status_file_path
+
+    def read(self) -> Optional[Dict]:
+        if not os.path.exists(self.status_file_path):
+            return None
+        with open(self.status_file_path, "r") as file_obj:
+            return json.load(file_obj)
+
+    def write(self, status: Dict) -> None:
+        os.makedirs(os.path.dirname(self.status_file_path), exist_ok = True)
+        # write next to the final file and rename, a reader never sees half a file
+        tmp_file_path = f"{self.status_file_path}.{os.getpid()}.tmp"
+        with open(tmp_file_path, "w") as file_obj:
+            json.dump(status, file_obj, indent = 2)
+        os.replace(tmp_file_path, self.status_file_path)
+
+    def update(self, **fields) -> Dict:
+        status = self.read() or {}
+        status.update(fields)
+        self.write(status)
+        return status
+
+    def update_stage(self, stage_name: str, stage_status: str, details: Dict) -> None:
+        status = self.read() or {}
+        stage = status.setdefault("stages", {}).setdefault(stage_name, {})
+        stage["status"] = stage_status
+        if stage_status == "running":
+            stage["started_at"] = _now()
+        else:
+            stage["finished_at"] = _now()
+        stage.update(details)
+        status["current_stage"] = stage_name
+        self.write(status)
+
+
+def run_training_job(job_id: str, status_file_path: str) -> None:
+    """
+    Entry point of the worker process: runs the whole training pipeline for one job
+    """
+    # imported here so the web process does not import the training stack
+    from src.us_visa.pipeline.training_pipeline import TrainingPipeline
+
+    job_status = TrainingJobStatus(status_file_path)
+    job_status.update(status = "running", started_at = _now(), pid = os.getpid())
+
+    try:
+        training_pipeline = TrainingPipeline(progress_callback = job_status.update_stage)
+        training_pipeline.run_training_pipeline()
+        job_status.update(status = "completed", finished_at = _now())
+
+    except Exception as e:
+        job_status.update(status = "failed", finished_at = _now(), error = str(e))
+        raise
+
+
+class TrainingJobRunner:
+    """
+    This class runs TrainingPipeline jobs in a separate worker process, one at a time.
+    A submission while another job is still waiting returns the waiting job instead of queueing a duplicate.
+    """
+
+    def __init__(self, jobs_dir: str):
+        """
+        :param jobs_dir: directory where the status file of every job is written
+        """
+        self.jobs_dir = jobs_dir
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # a fresh process per job: the artifact timestamp in config_entity is taken at import time
+            self._executor = ProcessPoolExecutor(
+                max_workers = 1,
+                mp_context = multiprocessing.get_context("spawn"),
+                max_tasks_per_child = 1
+            )
+        return self._executor
+
+    def _status_file_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _queued_job_id(self) -> Optional[str]:
+        for job_id, future in self._futures.items():
+            status = TrainingJobStatus(self._status_file_path(job_id)).read() or {}
+            if not future.done() and status.get("status") == "queued":
+                return job_id
+        return None
+
+    def submit(self) -> Dict:
+        """
+        Queues a training run and returns its job id right away
+        """
+        try:
+            with self._lock:
+                queued_job_id = self._queued_job_id()
+                if queued_job_id is not None:
+                    logging.info(f"Training job [{queued_job_id}] is already queued, not submitting a new one")
+                    return {"job_id": queued_job_id, "deduplicated": True}
+
+                job_id = uuid.uuid4().hex
+                status_file_path = self._status_file_path(job_id)
+                TrainingJobStatus(status_file_path).write({
+                    "job_id": job_id,
+                    "status": "queued",
+                    "submitted_at": _now(),
+                    "stages": {},
+                })
+
+                future = self._get_executor().submit(run_training_job, job_id, status_file_path)
+                future.add_done_callback(lambda f, job_id = job_id: self._on_job_done(job_id, f))
+                self._futures[job_id] = future
+                logging.info(f"Submitted training job [{job_id}]")
+                return {"job_id": job_id, "deduplicated": False}
+
+        except Exception as e:
+            raise UsVisaException(e, sys) from e
+
+    def _on_job_done(self, job_id: str, future: Future) -> None:
+        with self._lock:
+            self._futures.pop(job_id, None)
+
+        exception = future.exception()
+        if exception is None:
+            logging.info(f"Training job [{job_id}] finished")
+            return
+
+        logging.info(f"Training job [{job_id}] failed: {exception}")
+        # the worker could have died before writing its own status
+        job_status = TrainingJobStatus(self._status_file_path(job_id))
+        if (job_status.read() or {}).get("status") in ("queued", "running"):
+            job_status.update(status = "failed", finished_at = _now(), error = str(exception))
+
+    def get_status(self, job_id: str) -> Optional[Dict]:
+        """
+        Returns the status of the job with its per stage progress and durations (None for an unknown job)
+        """
+        try:
+            # job ids are uuid hex strings, anything else is not a job of ours
+            if not job_id.isalnum():
+                return None
+            return TrainingJobStatus(self._status_file_path(job_id)).read()
+        except Exception as e:
+            raise UsVisaException(e, sys) from e
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait = False, cancel_futures = True)
+            self._executor = None
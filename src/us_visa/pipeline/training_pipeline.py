@@ -1,4 +1,7 @@
 import sys 
+import time
+from typing import Callable , Dict , Optional
+
 from src.us_visa.logger import logging
 from src.us_visa.exception import UsVisaException
 
@@ -10,7 +13,9 @@ from src.us_visa.components.model_trainer import ModelTrainer
 from src.us_visa.components.model_evaluation import ModelEvaluation
 from src.us_visa.components.model_pusher import ModelPusher
 
+from src.us_visa.entity.artifact_cache import ArtifactCache
 from src.us_visa.entity.config_entity import(
+    training_pipeline_config,
     DataIngestionConfig , DataValidationConfig, 
     DataTransformationConfig , ModelTrainerConfig, 
     ModelEvaluationConfig , ModelPusherConfig
@@ -24,7 +29,20 @@ from src.us_visa.entity.artifact_entity import (
 
 
 class TrainingPipeline:
-    def __init__(self):
+    # stage names reported to the progress callback, in the order they run
+    stage_names = ["ingestion", "validation", "transformation", "trainer", "evaluation", "pusher"]
+    
+    def __init__(self , progress_callback : Optional[Callable[[str , str , Dict] , None]] = None):
+        """ 
+        progress_callback: called as progress_callback(stage_name , status , details) when a stage
+        starts ("running"), ends ("completed") or fails ("failed"). details holds duration_seconds and
+        the stage_details of the stage artifact (e.g. the drift report write time and size).
+        """
+        self.progress_callback = progress_callback
+        self.stage_durations : Dict[str , float] = {}
+        # per-run object cache, created by run_training_pipeline when the in-memory handoff is on
+        self.artifact_cache : Optional[ArtifactCache] = None
+        
         # Do the data ingestion
         self.data_ingestion_config = DataIngestionConfig()
         
@@ -51,7 +69,10 @@ class TrainingPipeline:
         try:
             logging.info("Entered start_data_ingestion method from TrainingPipeline class")
             
-            data_ingestion = DataIngestion(data_ingestion_config = self.data_ingestion_config)
+            data_ingestion = DataIngestion(
+                data_ingestion_config = self.data_ingestion_config,
+                artifact_cache = self.artifact_cache
+            )
             
             logging.info("Calling initiate data ingestion from start_data_ingestion method of TrainingPipeline class")
             
@@ -73,7 +94,8 @@ class TrainingPipeline:
             
             data_validation = DataValidation(
                 data_validation_config = self.data_validation_config,
-                data_ingestion_artifact = data_ingestion_artifact
+                data_ingestion_artifact = data_ingestion_artifact,
+                artifact_cache = self.artifact_cache
             )
             
             # initiate the data validation
@@ -93,7 +115,8 @@ class TrainingPipeline:
             data_transformation = DataTransformation(
                 data_transformation_config = self.data_transformation_config,
                 data_ingestion_artifact = data_ingestion_artifact,
-                data_validation_artifact = data_validation_artifact
+                data_validation_artifact = data_validation_artifact,
+                artifact_cache = self.artifact_cache
             )
             
             # initiate  data transformation
@@ -148,7 +171,8 @@ class TrainingPipeline:
         try:
             logging.info("Entered into run_model_pusher")
             model_pusher = ModelPusher(
-                model_evaluation_artifact = model_evaluation_artifact
+                model_evaluation_artifact = model_evaluation_artifact,
+                model_pusher_config = self.model_pusher_config
             )
             
             model_pusher_artifact = model_pusher.initiate_model_pusher()
@@ -159,33 +183,73 @@ class TrainingPipeline:
             raise UsVisaException(e , sys) from e 
         
         
+    def _report_progress(self , stage_name : str , status : str , details : Dict) -> None:
+        if self.progress_callback is None:
+            return
+        try:
+            self.progress_callback(stage_name , status , details)
+        except Exception as e:
+            # progress reporting must never break the training run
+            logging.info(f"progress callback failed for stage [{stage_name}]: {e}")
+    
+    def run_stage(self , stage_name : str , stage_function : Callable , **kwargs):
+        """ 
+        Runs one stage of the pipeline, times it and reports its progress
+        """
+        self._report_progress(stage_name , "running" , {})
+        start_time = time.perf_counter()
+        
+        try:
+            artifact = stage_function(**kwargs)
+        except Exception:
+            duration = time.perf_counter() - start_time
+            self._report_progress(stage_name , "failed" , {"duration_seconds": duration})
+            raise
+        
+        duration = time.perf_counter() - start_time
+        self.stage_durations[stage_name] = duration
+        # timings measured inside the stage, reported next to its duration
+        stage_details = getattr(artifact , "stage_details" , None) or {}
+        logging.info(f"Stage [{stage_name}] completed in {duration:.2f} seconds {stage_details}")
+        self._report_progress(stage_name , "completed" , {"duration_seconds": duration , **stage_details})
+        return artifact
+    
     def run_training_pipeline(self , ) -> None:
         """ 
         This method of TrainingPipeline class is responsible for running complete training pipeline
         """
         
+        if training_pipeline_config.in_memory_handoff:
+            self.artifact_cache = ArtifactCache(max_workers = training_pipeline_config.persist_workers)
+        
         try:
             # 1. Run the data ingestion  
-            data_ingestion_artifact = self.start_data_ingestion()
+            data_ingestion_artifact = self.run_stage("ingestion" , self.start_data_ingestion)
             logging.info("Data Ingestion is Done!!")
             
             # 2. Run the data validation
-            data_validation_artifact = self.start_data_validation(data_ingestion_artifact = data_ingestion_artifact)
+            data_validation_artifact = self.run_stage(
+                "validation" , self.start_data_validation,
+                data_ingestion_artifact = data_ingestion_artifact
+            )
             #print(f"data_validation_artifact: {data_validation_artifact}")
             
             # 3. Run the data transformation
-            data_transformation_artifact = self.start_data_transformation(
+            data_transformation_artifact = self.run_stage(
+                "transformation" , self.start_data_transformation,
                 data_ingestion_artifact = data_ingestion_artifact,
                 data_validation_artifact = data_validation_artifact
             )
             
             # 4. Run the model trainer
-            model_trainer_artifact = self.start_model_trainer(
+            model_trainer_artifact = self.run_stage(
+                "trainer" , self.start_model_trainer,
                 data_transformation_artifact = data_transformation_artifact
             )
             
             # 5. Run the model evaluation
-            model_evaluation_artifact = self.start_model_evaluation(
+            model_evaluation_artifact = self.run_stage(
+                "evaluation" , self.start_model_evaluation,
                 data_ingestion_artifact = data_ingestion_artifact, 
                 model_trainer_artifact = model_trainer_artifact
             )
@@ -193,12 +257,23 @@ class TrainingPipeline:
             # check current model is accepted or not
             if not model_evaluation_artifact.is_model_accepted:
                 logging.info("Model is not accepted. So cloud model remain same")
+                self._report_progress("pusher" , "skipped" , {"reason": "model not accepted"})
                 return None 
                 
             # 6. Run the model pusher   
-            model_pusher_artifact = self.start_model_pusher(model_evaluation_artifact = model_trainer_artifact)
+            model_pusher_artifact = self.run_stage(
+                "pusher" , self.start_model_pusher,
+                model_evaluation_artifact = model_evaluation_artifact
+            )
+            logging.info(f"Stage durations (seconds): {self.stage_durations}")
             logging.info("End of run_training pipeline")
             logging.info(model_pusher_artifact.bucket_name)
           
         except Exception as e:
-            raise UsVisaException(e , sys)
\ No newline at end of file
+            raise UsVisaException(e , sys)
+        
+        finally:
+            # every artifact file is on disk before the run returns
+            if self.artifact_cache is not None:
+                self.artifact_cache.close()
+                self.artifact_cache = None
\ No newline at end of file
@@ -1,5 +1,8 @@
 import os 
 import sys 
+import json
+import time
+from typing import Dict , Iterable , Iterator , List , Optional
 
 import numpy as np
 import dill
@@ -8,14 +11,325 @@ from pandas import DataFrame
 import pandas as pd 
 from src.us_visa.exception import UsVisaException
 from src.us_visa.logger import logging
+from src.us_visa.constants import ARTIFACT_FORMAT_EXTENSIONS , ARTIFACT_COMPRESSION , DATA_INGESTION_SPLIT_HASH_KEY , CURRENT_YEAR
 
 
-def read_csv(file_path: str) -> DataFrame:
+def get_artifact_format(file_path: str) -> str:
+    """
+    returns the artifact format (csv, parquet, feather) of a file from its extension
+    """
+    extension = os.path.splitext(file_path)[1]
+    for artifact_format , format_extension in ARTIFACT_FORMAT_EXTENSIONS.items():
+        if extension == format_extension:
+            return artifact_format
+    raise ValueError(f"Unknown artifact format for [{file_path}]")
+
+
+def apply_schema_dtypes(df: DataFrame, schema_config: Optional[dict]) -> DataFrame:
+    """
+    casts the columns of df to the types of the schema columns:
+    numeric columns are made numeric, category columns are stored as plain values
+    """
+    if schema_config is None:
+        return df
+
+    df = df.copy()
+    for column in schema_config["columns"]:
+        for name , dtype in column.items():
+            if name not in df.columns:
+                continue
+            if dtype in ("int" , "float"):
+                df[name] = pd.to_numeric(df[name])
+            elif isinstance(df[name].dtype , pd.CategoricalDtype):
+                df[name] = df[name].astype(object)
+    return df
+
+
+def write_dataframe(df: DataFrame, file_path: str, schema_config: Optional[dict] = None) -> None:
+    """
+    writes df in the format given by the extension of file_path (csv, parquet or feather),
+    parquet and feather files are compressed
+    """
+    try:
+        start_time = time.perf_counter()
+        dir_path = os.path.dirname(file_path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+
+        df = apply_schema_dtypes(df , schema_config)
+        artifact_format = get_artifact_format(file_path)
+
+        if artifact_format == "parquet":
+            df.to_parquet(file_path , index = False , compression = ARTIFACT_COMPRESSION)
+        elif artifact_format == "feather":
+            df.reset_index(drop = True).to_feather(file_path , compression = ARTIFACT_COMPRESSION)
+        else:
+            df.to_csv(file_path , index = False , header = True)
+
+        logging.info(
+            f"Wrote {df.shape} to [{file_path}] in {time.perf_counter() - start_time:.3f}s, "
+            f"{os.path.getsize(file_path) / 1024 ** 2:.2f} MB"
+        )
+    except Exception as e:
+        raise UsVisaException(e , sys) from e
+
+
+class DataFrameAppender:
+    """
+    writes a file (csv, parquet or feather by extension) chunk by chunk, so a dataset larger than
+    memory can be written one chunk at a time. The first chunk fixes the columns and their types,
+    the next chunks are converted to them. Use it as a context manager, the file is complete on exit.
+    """
+
+    def __init__(self, file_path: str, schema_config: Optional[dict] = None):
+        self.file_path = file_path
+        self.schema_config = schema_config
+        self.artifact_format = get_artifact_format(file_path)
+        self.n_rows = 0
+        self._schema = None
+        self._writer = None
+
+    def __enter__(self) -> "DataFrameAppender":
+        dir_path = os.path.dirname(self.file_path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+        return self
+
+    def append(self, df: DataFrame) -> None:
+        try:
+            df = apply_schema_dtypes(df , self.schema_config)
+            if self.artifact_format == "csv":
+                # the first chunk creates the file with the header, the next ones are appended
+                df.to_csv(self.file_path , index = False , header = self._schema is None ,
+                          mode = "w" if self._schema is None else "a")
+                self._schema = list(df.columns)
+            else:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+
+                table = pa.Table.from_pandas(df , schema = self._schema , preserve_index = False)
+                if self._writer is None:
+                    self._schema = table.schema
+                    if self.artifact_format == "parquet":
+                        self._writer = pq.ParquetWriter(self.file_path , self._schema , compression = ARTIFACT_COMPRESSION)
+                    else:
+                        # feather v2 is the arrow ipc file format
+                        self._writer = pa.ipc.new_file(
+                            self.file_path , self._schema , options = pa.ipc.IpcWriteOptions(compression = ARTIFACT_COMPRESSION)
+                        )
+                self._writer.write_table(table)
+            self.n_rows += len(df)
+        except Exception as e:
+            raise UsVisaException(e , sys) from e
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if exc_type is None:
+            if self._schema is None:
+                raise ValueError(f"No chunk was written to [{self.file_path}]")
+            logging.info(
+                f"Wrote {self.n_rows} rows to [{self.file_path}] chunk by chunk, "
+                f"{os.path.getsize(self.file_path) / 1024 ** 2:.2f} MB"
+            )
+
+
+def get_schema_category_columns(schema_config: dict) -> List[str]:
+    return [name for column in schema_config["columns"] for name , dtype in column.items() if dtype == "category"]
+
+
+def get_feature_engineered_columns(schema_config: dict, keep_columns: Iterable[str] = ()) -> Dict[str , str]:
+    """
+    returns {column: schema type} of a dataset after the feature engineering of DataTransformation:
+    company_age is added as the last column, like DataTransformation adds it, and the drop columns
+    are removed (except keep_columns)
+    """
+    drop_columns = set(schema_config["drop_columns"]) - set(keep_columns)
+    columns = {}
+    for column in schema_config["columns"]:
+        for name , dtype in column.items():
+            if name not in drop_columns:
+                columns[name] = dtype
+    columns["company_age"] = "int"
+    return columns
+
+
+def is_feature_engineered(df: DataFrame) -> bool:
+    """
+    True for a dataset exported with the feature engineering pushed down to mongodb
+    """
+    return "company_age" in df.columns and "yr_of_estab" not in df.columns
+
+
+def read_dataframe(file_path: str, columns: Optional[List[str]] = None, schema_config: Optional[dict] = None) -> DataFrame:
+    """
+    reads a csv, parquet or feather file (by extension), only the given columns when columns is set.
+    With schema_config the columns are typed on read: category columns as pandas category,
+    numeric columns in the narrowest lossless width, and schema violations are reported
+    """
     try:
-        df = pd.read_csv(file_path)
+        start_time = time.perf_counter()
+        artifact_format = get_artifact_format(file_path)
+        category_columns = get_schema_category_columns(schema_config) if schema_config is not None else []
+
+        if artifact_format == "parquet":
+            # string columns are decoded straight into dictionary (category) arrays
+            df = pd.read_parquet(file_path , columns = columns , read_dictionary = category_columns or None)
+        elif artifact_format == "feather":
+            df = pd.read_feather(file_path , columns = columns)
+        else:
+            df = pd.read_csv(file_path , usecols = columns , dtype = {column: "category" for column in category_columns})
+
+        if schema_config is not None:
+            df = enforce_schema_dtypes(df , schema_config)
+
+        logging.info(
+            f"Read {df.shape} from [{file_path}] in {time.perf_counter() - start_time:.3f}s, "
+            f"{df.memory_usage(deep = True).sum() / 1024 ** 2:.2f} MB in memory"
+        )
         return df
     except Exception as e:
-        raise UsVisaException(e , sys)
+        raise UsVisaException(e , sys) from e
+
+
+def iter_dataframe_chunks(file_path: str, chunk_size: int, columns: Optional[List[str]] = None) -> Iterator[DataFrame]:
+    """
+    yields a csv, parquet or feather file (by extension) as dataframes of at most chunk_size rows,
+    without loading the whole file in memory
+    """
+    try:
+        artifact_format = get_artifact_format(file_path)
+
+        if artifact_format == "parquet":
+            import pyarrow.parquet as pq
+
+            parquet_file = pq.ParquetFile(file_path)
+            for batch in parquet_file.iter_batches(batch_size = chunk_size , columns = columns):
+                yield batch.to_pandas()
+        elif artifact_format == "feather":
+            import pyarrow.feather as feather
+
+            # memory mapped, only the batch being converted is paged in
+            table = feather.read_table(file_path , columns = columns , memory_map = True)
+            for batch in table.to_batches(max_chunksize = chunk_size):
+                yield batch.to_pandas()
+        else:
+            yield from pd.read_csv(file_path , usecols = columns , chunksize = chunk_size)
+    except Exception as e:
+        raise UsVisaException(e , sys) from e
+
+
+def get_hash_buckets(keys: pd.Series, n_buckets: int) -> np.ndarray:
+    """
+    maps every key to a bucket in [0, n_buckets) with siphash over the utf-8 text of the key.
+    The hash key is fixed, so a key lands in the same bucket on every run, process and machine
+    """
+    hashes = pd.util.hash_array(
+        keys.astype(str).to_numpy(dtype = object) , hash_key = DATA_INGESTION_SPLIT_HASH_KEY , categorize = False
+    )
+    return (hashes % np.uint64(n_buckets)).astype(np.int64)
+
+
+def read_dataframe_artifact(file_path: str, dataframe: Optional[DataFrame] = None, schema_config: Optional[dict] = None) -> DataFrame:
+    """
+    returns the in-memory dataframe handed over by the previous stage when there is one
+    (typed like read_dataframe would type the file), otherwise reads file_path
+    """
+    if dataframe is None:
+        return read_dataframe(file_path , schema_config = schema_config)
+
+    logging.info(f"Using the in-memory dataframe of [{file_path}]")
+    # shallow copy, the handed over frame is shared with the background writer
+    dataframe = dataframe.copy(deep = False)
+    return enforce_schema_dtypes(dataframe , schema_config) if schema_config is not None else dataframe
+
+
+def narrow_integral(series: pd.Series) -> pd.Series:
+    """
+    returns a float series of whole numbers without missing values as int32 (int64 when the values
+    do not fit), the way the mongodb export stores the integral columns. Other series are returned as is.
+    """
+    if not pd.api.types.is_float_dtype(series.dtype):
+        return series
+
+    values = series.to_numpy(dtype = np.float64)
+    if len(values) == 0 or not np.isfinite(values).all() or not (values == np.floor(values)).all():
+        return series
+    int32_info = np.iinfo(np.int32)
+    dtype = np.int32 if values.min() >= int32_info.min and values.max() <= int32_info.max else np.int64
+    return pd.Series(values.astype(dtype) , index = series.index , name = series.name)
+
+
+def downcast_numeric(series: pd.Series) -> pd.Series:
+    """
+    returns series in the narrowest dtype that holds every value exactly
+    """
+    if pd.api.types.is_integer_dtype(series.dtype):
+        return pd.to_numeric(series , downcast = "integer")
+
+    values = series.to_numpy(dtype = np.float64)
+    finite_values = values[np.isfinite(values)]
+    if len(finite_values) == len(values) and np.array_equal(finite_values , np.floor(finite_values)):
+        return pd.to_numeric(series.astype(np.int64) , downcast = "integer")
+    if np.array_equal(finite_values.astype(np.float32).astype(np.float64) , finite_values):
+        return series.astype(np.float32)
+    return series.astype(np.float64)
+
+
+def get_numerical_ranges(schema_config: dict) -> Dict[str , Dict[str , float]]:
+    """
+    returns the numerical_ranges of schema.yaml, a bound given as "current_year" is the current year
+    """
+    return {
+        name: {bound: CURRENT_YEAR if value == "current_year" else value for bound , value in value_range.items()}
+        for name , value_range in schema_config.get("numerical_ranges" , {}).items()
+    }
+
+
+def enforce_schema_dtypes(df: DataFrame, schema_config: dict) -> DataFrame:
+    """
+    casts df to the dtypes of schema.yaml and reports the values that break the schema
+    (unknown categories, out of range numbers, non numeric values).
+    Offending values are kept, the report is logged and stored in df.attrs["schema_violations"]
+    """
+    category_values = schema_config.get("category_values" , {})
+    numerical_ranges = get_numerical_ranges(schema_config)
+    violations = {}
+
+    for column in schema_config["columns"]:
+        for name , dtype in column.items():
+            if name not in df.columns:
+                continue
+
+            if dtype == "category":
+                series = df[name] if isinstance(df[name].dtype , pd.CategoricalDtype) else df[name].astype("category")
+                known_values = category_values.get(name)
+                if known_values is not None:
+                    unknown_values = [value for value in series.cat.categories if value not in known_values]
+                    if len(unknown_values) > 0:
+                        violations[name] = {"unknown_categories": unknown_values}
+                    # known vocabulary first, so the codes are the same for every file
+                    series = series.cat.set_categories(list(known_values) + unknown_values)
+                else:
+                    # a frame sliced from a larger one still carries the vocabulary of the whole
+                    series = series.cat.remove_unused_categories()
+                df[name] = series
+            else:
+                series = pd.to_numeric(df[name] , errors = "coerce")
+                non_numeric = int(series.isna().sum() - df[name].isna().sum())
+                value_range = numerical_ranges.get(name , {})
+                below_min = int((series < value_range["min"]).sum()) if "min" in value_range else 0
+                above_max = int((series > value_range["max"]).sum()) if "max" in value_range else 0
+                if non_numeric or below_min or above_max:
+                    violations[name] = {"non_numeric": non_numeric , "below_min": below_min , "above_max": above_max}
+                df[name] = downcast_numeric(series)
+
+    if len(violations) > 0:
+        logging.info(f"Schema violations: {violations}")
+    df.attrs["schema_violations"] = violations
+    return df
+
 
 def read_yaml_file(file_path: str) -> dict:
     try:
@@ -36,6 +350,35 @@ def write_yaml_file(file_path: str, content: object, replace: bool = False) -> N
             yaml.dump(content, file)
     except Exception as e:
         raise UsVisaException(e, sys) from e
+
+
+def _to_json_value(obj: object) -> object:
+    # numpy scalars and arrays left in a report
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def write_json_file(file_path: str, content: object) -> int:
+    """
+    Writes content as compact json with orjson when it is installed (the C encoder of the json
+    module otherwise), much faster than the yaml emitter for reports. Returns the size in bytes.
+    """
+    try:
+        try:
+            import orjson
+            data = orjson.dumps(content, default = _to_json_value, option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+        except ImportError:
+            data = json.dumps(content, default = _to_json_value, separators = (",", ":")).encode()
+
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as file:
+            file.write(data)
+        return len(data)
+    except Exception as e:
+        raise UsVisaException(e, sys) from e
     
 
 def save_object(file_path: str, obj: object) -> None:
@@ -88,19 +431,51 @@ def save_numpy_array_data(file_path: str, array: np.array):
 
 
 
-def load_numpy_array_data(file_path: str) -> np.array:
+def load_numpy_array_data(file_path: str, mmap_mode: Optional[str] = None) -> np.array:
     """
     load numpy array data from file
     file_path: str location of file to load
+    mmap_mode: "r" maps the file instead of reading it into memory
     return: np.array data loaded
     """
     try:
+        if mmap_mode is not None:
+            return np.load(file_path, mmap_mode=mmap_mode)
+
         with open(file_path, 'rb') as file_obj:
             return np.load(file_obj)
     except Exception as e:
         raise UsVisaException(e, sys) from e
 
 
+def concatenate_numpy_array_files(file_paths: List[str], output_file_path: str) -> tuple:
+    """
+    concatenate the arrays of several .npy files (same dtype and trailing shape) along the first axis
+    into one .npy file, one input array in memory at a time
+    file_paths: list of .npy files in output order
+    output_file_path: str location of the concatenated file
+    return: shape of the concatenated array
+    """
+    try:
+        arrays = [np.load(file_path, mmap_mode="r") for file_path in file_paths]
+        shape = (sum(array.shape[0] for array in arrays),) + arrays[0].shape[1:]
+
+        dir_path = os.path.dirname(output_file_path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+
+        output = np.lib.format.open_memmap(output_file_path, mode="w+", dtype=arrays[0].dtype, shape=shape)
+        start = 0
+        for array in arrays:
+            output[start:start + array.shape[0]] = array
+            start += array.shape[0]
+        output.flush()
+        del output
+        return shape
+    except Exception as e:
+        raise UsVisaException(e, sys) from e
+
+
 
 def drop_columns(df: DataFrame, cols: list)-> DataFrame:
 
@@ -112,7 +487,7 @@ def drop_columns(df: DataFrame, cols: list)-> DataFrame:
     logging.info("Entered drop_columns methon of utils")
 
     try:
-        df = df.drop(columns = cols , axis = 1)
+        df = df.drop(columns = cols)
         logging.info(f"Dropped columns: {cols}")
         logging.info("Exited the drop_columns method of utils")
         return df
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the package is imported as src.us_visa, like app.py and main.py do from the repo root
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+VISA_DATASET_PATH = os.path.join(ROOT_DIR, "notebooks", "visadataset.csv")
+
+
+@pytest.fixture(scope = "session", autouse = True)
+def run_from_root_dir():
+    # the config paths (config/schema.yaml, ...) are relative to the repo root
+    working_dir = os.getcwd()
+    os.chdir(ROOT_DIR)
+    yield
+    os.chdir(working_dir)
+
+
+@pytest.fixture(scope = "session")
+def visa_dataframe() -> pd.DataFrame:
+    """
+    The raw rows of the US visa dataset
+    """
+    return pd.read_csv(VISA_DATASET_PATH)
@@ -0,0 +1,81 @@
+import io
+import os
+
+import pytest
+from botocore.exceptions import ClientError
+
+from src.us_visa.cloud_storage.aws_storage import StorageService
+from src.us_visa.cloud_storage.local_model_cache import LocalModelCache
+
+
+BUCKET_NAME = "model-bucket"
+MODEL_KEY = "model.pkl"
+
+
+class FakeBody(io.BytesIO):
+    def __init__(self, content: bytes, bodies: list):
+        super().__init__(content)
+        bodies.append(self)
+
+
+class FakeS3Client:
+    """
+    get_object of one s3 object, answers a matching If-None-Match with 304 like s3 does
+    """
+
+    def __init__(self, content: bytes, etag: str):
+        self.content = content
+        self.etag = etag
+        self.calls = []
+        self.bodies = []
+        # called before a 304 is answered
+        self.on_not_modified = lambda: None
+
+    def get_object(self, Bucket: str, Key: str, IfNoneMatch: str = None) -> dict:
+        self.calls.append(IfNoneMatch)
+        if IfNoneMatch == f'"{self.etag}"':
+            self.on_not_modified()
+            raise ClientError({"Error": {"Code": "304", "Message": "Not Modified"}}, "GetObject")
+        return {"Body": FakeBody(self.content, self.bodies), "ETag": f'"{self.etag}"'}
+
+
+@pytest.fixture
+def storage_service(tmp_path) -> StorageService:
+    # without S3Client, the fake client stands in for s3
+    storage_service = StorageService.__new__(StorageService)
+    storage_service.s3_client = FakeS3Client(content = b"model v1", etag = "v1")
+    storage_service.local_model_cache = LocalModelCache(cache_dir = str(tmp_path), max_size_bytes = 10 ** 6)
+    return storage_service
+
+
+def test_first_download_is_one_plain_get(storage_service):
+    assert storage_service.get_model_bytes(MODEL_KEY, BUCKET_NAME) == b"model v1"
+    assert storage_service.s3_client.calls == [None]
+
+
+def test_not_modified_model_is_read_from_the_local_cache(storage_service):
+    storage_service.get_model_bytes(MODEL_KEY, BUCKET_NAME)
+
+    assert storage_service.get_model_bytes(MODEL_KEY, BUCKET_NAME) == b"model v1"
+    assert storage_service.s3_client.calls == [None, '"v1"']
+
+
+def test_changed_model_is_downloaded_once(storage_service):
+    s3_client = storage_service.s3_client
+    storage_service.get_model_bytes(MODEL_KEY, BUCKET_NAME)
+    s3_client.content, s3_client.etag = b"model v2", "v2"
+
+    assert storage_service.get_model_bytes(MODEL_KEY, BUCKET_NAME) == b"model v2"
+    # the conditional get is the download, no second plain get
+    assert s3_client.calls == [None, '"v1"']
+    assert all(body.closed for body in s3_client.bodies)
+    assert storage_service.local_model_cache.get_cached_etag(BUCKET_NAME, MODEL_KEY) == "v2"
+
+
+def test_model_evicted_during_the_request_is_downloaded_again(storage_service):
+    storage_service.get_model_bytes(MODEL_KEY, BUCKET_NAME)
+    # another worker evicts the blob between the etag lookup and the read
+    storage_service.s3_client.on_not_modified = lambda: os.remove(storage_service.local_model_cache.blob_path("v1"))
+
+    assert storage_service.get_model_bytes(MODEL_KEY, BUCKET_NAME) == b"model v1"
+    assert storage_service.s3_client.calls == [None, '"v1"', None]
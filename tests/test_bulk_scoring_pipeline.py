@@ -0,0 +1,34 @@
+import pandas as pd
+import pytest
+
+from src.us_visa.pipeline.bulk_scoring_pipeline import BulkScoringPipeline
+
+
+CHUNK_SIZE = 1000
+N_ROWS = 5500
+
+
+@pytest.fixture(params = ["csv", "parquet"])
+def input_file_path(request, visa_dataframe, tmp_path) -> str:
+    input_file_path = str(tmp_path / f"applicants.{request.param}")
+    dataframe = visa_dataframe.iloc[:N_ROWS]
+    if request.param == "csv":
+        dataframe.to_csv(input_file_path, index = False)
+    else:
+        dataframe.to_parquet(input_file_path, index = False)
+    return input_file_path
+
+
+@pytest.mark.parametrize("skip_chunks", [0, 2, 5, 6])
+def test_resume_reads_the_chunks_after_the_checkpoint(input_file_path, tmp_path, skip_chunks):
+    pipeline = BulkScoringPipeline(
+        input_file_path = input_file_path, output_file_path = str(tmp_path / "predictions.csv"), chunk_size = CHUNK_SIZE
+    )
+
+    all_chunks = list(pipeline.read_chunks())
+    resumed_chunks = list(pipeline.read_chunks(skip_chunks = skip_chunks))
+
+    assert [len(chunk) for chunk in all_chunks] == [1000] * 5 + [500]
+    assert len(resumed_chunks) == len(all_chunks) - skip_chunks
+    for chunk, resumed_chunk in zip(all_chunks[skip_chunks:], resumed_chunks):
+        pd.testing.assert_frame_equal(chunk.reset_index(drop = True), resumed_chunk.reset_index(drop = True))
@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.us_visa.components.data_transformation import DataTransformation
+from src.us_visa.constants import CURRENT_YEAR, TARGET_COLUMN
+from src.us_visa.entity.compiled_preprocessor import CompiledPreprocessor
+from src.us_visa.entity.config_entity import DataTransformationConfig
+
+
+N_TRAIN_ROWS = 4000
+N_TEST_ROWS = 1000
+
+
+def get_feature_frame(dataframe: pd.DataFrame) -> pd.DataFrame:
+    # the feature engineering of DataTransformation.get_input_and_target_features
+    dataframe = dataframe[dataframe["no_of_employees"] > 0]
+    dataframe = dataframe.assign(company_age = CURRENT_YEAR - dataframe["yr_of_estab"])
+    return dataframe.drop(columns = ["case_id", "yr_of_estab", TARGET_COLUMN]).reset_index(drop = True)
+
+
+def get_preprocessor():
+    return DataTransformation(DataTransformationConfig(), None, None).get_data_transformation_object()
+
+
+def assert_bit_identical(expected: np.ndarray, actual: np.ndarray) -> None:
+    expected = np.ascontiguousarray(expected, dtype = np.float64)
+    assert expected.shape == actual.shape
+    # compares the bits, so NaN must be the same NaN and -0.0 is not 0.0
+    assert np.array_equal(expected.view(np.int64), actual.view(np.int64))
+
+
+@pytest.fixture(scope = "module")
+def feature_frame(visa_dataframe) -> pd.DataFrame:
+    return get_feature_frame(visa_dataframe).astype({"no_of_employees": np.float64, "company_age": np.float64})
+
+
+@pytest.fixture(scope = "module")
+def train_frame(feature_frame) -> pd.DataFrame:
+    train_frame = feature_frame.iloc[:N_TRAIN_ROWS].copy()
+    # missing values in a OneHot, an Ordinal, a Yeo-Johnson and a StandardScaler column
+    train_frame.loc[0:4, "continent"] = np.nan
+    train_frame.loc[5:9, "education_of_employee"] = np.nan
+    train_frame.loc[10:14, "company_age"] = np.nan
+    train_frame.loc[15:19, "prevailing_wage"] = np.nan
+    return train_frame
+
+
+@pytest.fixture(scope = "module")
+def test_frame(feature_frame, train_frame) -> pd.DataFrame:
+    test_frame = feature_frame.iloc[N_TRAIN_ROWS:N_TRAIN_ROWS + N_TEST_ROWS].reset_index(drop = True)
+    # the rows with missing values, and the edges of the Yeo-Johnson columns
+    test_frame.iloc[:20] = train_frame.iloc[:20].to_numpy()
+    test_frame.loc[20, "company_age"] = -5.0
+    test_frame.loc[21, "company_age"] = 0.0
+    test_frame.loc[22, "no_of_employees"] = 1.0
+    test_frame.loc[23, "no_of_employees"] = 1e7
+    test_frame.loc[24, "company_age"] = 1e4
+    return test_frame
+
+
+@pytest.fixture(scope = "module")
+def preprocessor(train_frame):
+    return get_preprocessor().fit(train_frame)
+
+
+@pytest.fixture(scope = "module")
+def compiled_preprocessor(preprocessor) -> CompiledPreprocessor:
+    return CompiledPreprocessor.compile(preprocessor)
+
+
+def test_fitted_on_the_visa_dataset(preprocessor):
+    assert isinstance(preprocessor.named_transformers_["OneHotEncoder"].categories_[0][-1], float)
+    assert preprocessor.named_transformers_["Transformer"].named_steps["transformer"].method == "yeo-johnson"
+
+
+def test_transform_frame_is_bit_identical(preprocessor, compiled_preprocessor, test_frame):
+    expected = preprocessor.transform(test_frame)
+
+    assert np.isnan(expected).any()
+    assert_bit_identical(expected, compiled_preprocessor.transform_frame(test_frame))
+
+
+def test_transform_records_is_bit_identical(preprocessor, compiled_preprocessor, test_frame):
+    records = test_frame.to_dict("records")
+    # a NaN of a json payload is another float object than np.nan
+    for record in records[:10]:
+        record["continent"] = float("nan")
+        record["education_of_employee"] = float("nan")
+
+    expected = preprocessor.transform(pd.DataFrame(records))
+    assert_bit_identical(expected, compiled_preprocessor.transform_records(records))
+
+
+def test_yeo_johnson_columns_are_bit_identical(preprocessor, compiled_preprocessor, feature_frame):
+    # a spread of the Yeo-Johnson inputs, negative and zero values included
+    values = np.concatenate([np.linspace(-100.0, 100.0, 201), np.geomspace(1.0, 1e7, 200), [np.nan]])
+    probe_frame = pd.concat([feature_frame.iloc[:1]] * len(values), ignore_index = True)
+    probe_frame["no_of_employees"] = values
+    probe_frame["company_age"] = values[::-1]
+
+    assert_bit_identical(preprocessor.transform(probe_frame), compiled_preprocessor.transform_frame(probe_frame))
+
+
+@pytest.mark.parametrize("column, value", [
+    ("continent", "Antarctica"),
+    ("unit_of_wage", "Day"),
+    ("education_of_employee", "PhD"),
+    ("full_time_position", "maybe"),
+])
+def test_unseen_category_raises_like_column_transformer(preprocessor, compiled_preprocessor, test_frame, column, value):
+    unseen_frame = test_frame.iloc[20:30].copy()
+    unseen_frame.loc[unseen_frame.index[3], column] = value
+
+    with pytest.raises(ValueError, match = "unknown categories"):
+        preprocessor.transform(unseen_frame)
+    with pytest.raises(ValueError, match = "unknown categories"):
+        compiled_preprocessor.transform_frame(unseen_frame)
+    with pytest.raises(ValueError, match = "unknown categories"):
+        compiled_preprocessor.transform_records(unseen_frame.to_dict("records"))
+
+
+def test_missing_value_not_seen_in_fit_raises_like_column_transformer(feature_frame):
+    preprocessor = get_preprocessor().fit(feature_frame.iloc[:N_TRAIN_ROWS])
+    compiled_preprocessor = CompiledPreprocessor.compile(preprocessor)
+    missing_frame = feature_frame.iloc[N_TRAIN_ROWS:N_TRAIN_ROWS + 10].copy()
+    missing_frame.loc[missing_frame.index[0], "continent"] = np.nan
+
+    with pytest.raises(ValueError, match = "unknown categories"):
+        preprocessor.transform(missing_frame)
+    with pytest.raises(ValueError, match = "unknown categories"):
+        compiled_preprocessor.transform_frame(missing_frame)
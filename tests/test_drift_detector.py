@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.us_visa.constants import SCHEMA_FILE_PATH, TARGET_COLUMN
+from src.us_visa.entity.drift_detector import DriftDetector
+from src.us_visa.utils.main_utils import read_yaml_file
+
+pytest.importorskip("evidently")
+from evidently.model_profile import Profile  # noqa: E402
+from evidently.model_profile.sections import DataDriftProfileSection  # noqa: E402
+
+
+# evidently stattest_name of each DriftDetector stattest
+EVIDENTLY_STATTEST_NAMES = {
+    "ks": "K-S p_value",
+    "chisquare": "chi-square p_value",
+    "z": "Z-test p_value",
+    "jensenshannon": "Jensen-Shannon distance",
+    "wasserstein": "Wasserstein distance (normed)",
+}
+
+
+def get_evidently_metrics(reference_df: pd.DataFrame, current_df: pd.DataFrame) -> dict:
+    # evidently 0.2.8 predates the pandas string dtype, it gets the strings as objects
+    to_object = lambda df: df.astype({column: object for column in df.columns if pd.api.types.is_string_dtype(df[column])})
+    profile = Profile(sections = [DataDriftProfileSection()])
+    profile.calculate(to_object(reference_df), to_object(current_df))
+    return profile.object()["data_drift"]["data"]["metrics"]
+
+
+@pytest.fixture(scope = "module")
+def drift_frame(visa_dataframe) -> pd.DataFrame:
+    # case_id is unique per row, every id would be a category of its own in both reports
+    rows = np.random.default_rng(42).permutation(len(visa_dataframe))
+    return visa_dataframe.drop(columns = ["case_id"]).iloc[rows].reset_index(drop = True)
+
+
+def get_drifted_frame(dataframe: pd.DataFrame) -> pd.DataFrame:
+    # the denied applications of Asia and Europe with higher wages: most columns drift
+    drifted_frame = dataframe[
+        (dataframe[TARGET_COLUMN] == "Denied") & dataframe["continent"].isin(["Asia", "Europe"])
+    ].copy()
+    drifted_frame["prevailing_wage"] = drifted_frame["prevailing_wage"] * 1.5
+    drifted_frame["yr_of_estab"] = drifted_frame["yr_of_estab"] - 10
+    return drifted_frame
+
+
+@pytest.mark.parametrize("n_rows, is_drifted", [
+    (800, False),
+    (800, True),
+    (3000, False),
+    (3000, True),
+])
+def test_drift_report_matches_evidently(drift_frame, n_rows, is_drifted):
+    # <= 1000 reference rows tests with ks / chisquare / z, more with wasserstein / jensenshannon
+    reference_df = drift_frame.iloc[:n_rows]
+    current_df = drift_frame.iloc[n_rows:]
+    current_df = (get_drifted_frame(current_df) if is_drifted else current_df).iloc[:n_rows]
+
+    detector = DriftDetector.from_schema(read_yaml_file(SCHEMA_FILE_PATH))
+    report = detector.detect(reference_df, current_df)
+    metrics = get_evidently_metrics(reference_df, current_df)
+
+    assert report["dataset_drift"] == metrics["dataset_drift"] == is_drifted
+    assert report["n_features"] == metrics["n_features"]
+    assert report["n_drifted_features"] == metrics["n_drifted_features"]
+    for column, result in report["features"].items():
+        assert EVIDENTLY_STATTEST_NAMES[result["stattest"]] == metrics[column]["stattest_name"], column
+        assert result["drift_score"] == pytest.approx(metrics[column]["drift_score"], rel = 1e-6, abs = 1e-12), column
+        assert result["drift_detected"] == metrics[column]["drift_detected"], column
@@ -0,0 +1,71 @@
+import asyncio
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.us_visa.components.data_transformation import DataTransformation
+from src.us_visa.constants import CURRENT_YEAR, TARGET_COLUMN
+from src.us_visa.entity.config_entity import DataTransformationConfig
+from src.us_visa.pipeline.bounded_executor import BoundedExecutor
+from src.us_visa.pipeline.micro_batcher import UsVisaMicroBatcher
+
+
+@pytest.fixture(scope = "module")
+def feature_frame(visa_dataframe) -> pd.DataFrame:
+    dataframe = visa_dataframe[visa_dataframe["no_of_employees"] > 0].iloc[:2000]
+    dataframe = dataframe.assign(company_age = CURRENT_YEAR - dataframe["yr_of_estab"])
+    return dataframe.drop(columns = ["case_id", "yr_of_estab", TARGET_COLUMN]).reset_index(drop = True)
+
+
+@pytest.fixture(scope = "module")
+def predict_fn(feature_frame):
+    # the fitted encoders raise on an unknown category and the scalers on a non-numeric wage,
+    # like the model behind UsVisaClassifier.predict
+    preprocessor = DataTransformation(DataTransformationConfig(), None, None).get_data_transformation_object()
+    preprocessor.fit(feature_frame)
+    return lambda dataframe: np.where(preprocessor.transform(dataframe)[:, -1] > 0, "Certified", "Denied")
+
+
+async def score_requests(batcher: UsVisaMicroBatcher, requests: list) -> list:
+    return await asyncio.gather(*[batcher.submit(request) for request in requests], return_exceptions = True)
+
+
+def get_requests(feature_frame: pd.DataFrame) -> list:
+    requests = [feature_frame.iloc[[row]].reset_index(drop = True) for row in range(8)]
+    requests[2] = requests[2].assign(continent = "Antarctica")
+    requests[5] = requests[5].astype({"prevailing_wage": object}).assign(prevailing_wage = "a lot")
+    return requests
+
+
+def test_bad_request_does_not_fail_its_batch(feature_frame, predict_fn):
+    executor = BoundedExecutor(name = "test-inference", max_workers = 2, max_pending = 16)
+    # one batch: the window is long and every request is queued before it closes
+    batcher = UsVisaMicroBatcher(predict_fn = predict_fn, max_batch_size = 8, max_wait_ms = 1000, executor = executor)
+    requests = get_requests(feature_frame)
+
+    try:
+        results = asyncio.run(score_requests(batcher, requests))
+    finally:
+        executor.shutdown()
+
+    assert batcher.get_stats()["total_batches"] == 1
+    assert batcher.get_stats()["total_failed_batches"] == 1
+    for position, (request, result) in enumerate(zip(requests, results)):
+        if position in (2, 5):
+            assert isinstance(result, Exception)
+        else:
+            np.testing.assert_array_equal(result, predict_fn(request))
+
+
+def test_single_bad_request_gets_its_error(feature_frame, predict_fn):
+    executor = BoundedExecutor(name = "test-inference", max_workers = 1, max_pending = 4)
+    batcher = UsVisaMicroBatcher(predict_fn = predict_fn, max_batch_size = 8, max_wait_ms = 1, executor = executor)
+
+    try:
+        results = asyncio.run(score_requests(batcher, get_requests(feature_frame)[2:3]))
+    finally:
+        executor.shutdown()
+
+    assert isinstance(results[0], ValueError)
+    assert batcher.get_stats()["total_failed_batches"] == 0
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+from src.us_visa.pipeline.prediction_cache import PredictionCache
+
+
+FEATURE_COLUMNS = ["continent", "no_of_employees", "prevailing_wage"]
+NUMERIC_COLUMNS = ["no_of_employees", "prevailing_wage"]
+MODEL_VERSION = "v1"
+
+
+def get_cache() -> PredictionCache:
+    return PredictionCache(feature_columns = FEATURE_COLUMNS, numeric_columns = NUMERIC_COLUMNS, max_size = 100, ttl_seconds = 60)
+
+
+def test_numbers_share_the_key_of_their_float64_cast():
+    cache = get_cache()
+    dataframe = pd.DataFrame({
+        "continent": ["Asia"] * 3,
+        "no_of_employees": ["42", 42, 42.0],
+        "prevailing_wage": [" 1000.5 ", 1000.5, "1000.5"],
+    })
+
+    keys = cache.make_keys(dataframe)
+
+    assert keys[0] == keys[1] == keys[2]
+    # the cast of the preprocessor gives the same values as the key
+    np.testing.assert_array_equal(dataframe[NUMERIC_COLUMNS].to_numpy(dtype = np.float64), [list(key[1:]) for key in keys])
+
+
+def test_category_is_keyed_as_the_model_sees_it():
+    cache = get_cache()
+    cache.put_many(cache.make_keys(pd.DataFrame({"continent": ["Asia"], "no_of_employees": [42], "prevailing_wage": [1000.5]})), ["Certified"], MODEL_VERSION)
+
+    padded_df = pd.DataFrame({"continent": [" Asia "], "no_of_employees": [42], "prevailing_wage": [1000.5]})
+
+    # " Asia " is an unknown category for the encoder, it must not get the prediction of "Asia"
+    assert cache.get_many(cache.make_keys(padded_df), MODEL_VERSION) == [None]
+
+
+def test_value_that_is_not_a_number_keeps_its_raw_key():
+    cache = get_cache()
+    keys = cache.make_keys(pd.DataFrame({"continent": ["Asia"], "no_of_employees": ["many"], "prevailing_wage": [1.0]}))
+
+    assert keys == [("Asia", "many", 1.0)]
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.us_visa.components.data_transformation import DataTransformation
+from src.us_visa.configuration.mongo_db_connection import MongoDbClient
+from src.us_visa.constants import CURRENT_YEAR, TARGET_COLUMN
+from src.us_visa.data_access.usvisa_data import USvisaData
+from src.us_visa.entity.config_entity import DataTransformationConfig
+
+mongomock = pytest.importorskip("mongomock")
+
+
+COLLECTION_NAME = "visa_data"
+N_DOCUMENTS = 3000
+# documents with a missing value stored as "na", and with no employees
+NA_DOCUMENTS = {
+    0: "no_of_employees",
+    1: "yr_of_estab",
+    2: "continent",
+    3: "prevailing_wage",
+    4: TARGET_COLUMN,
+    5: "education_of_employee",
+}
+NON_POSITIVE_EMPLOYEES = {10: 0, 11: -1, 12: -25}
+
+
+def get_documents(visa_dataframe: pd.DataFrame) -> list:
+    documents = visa_dataframe.iloc[:N_DOCUMENTS].to_dict("records")
+    for position, column in NA_DOCUMENTS.items():
+        documents[position][column] = "na"
+    for position, no_of_employees in NON_POSITIVE_EMPLOYEES.items():
+        documents[position]["no_of_employees"] = no_of_employees
+    return documents
+
+
+@pytest.fixture
+def usvisa_data(visa_dataframe, monkeypatch) -> USvisaData:
+    # MongoDbClient keeps the client on the class, every MongoDbClient() gets the mongomock one
+    monkeypatch.setattr(MongoDbClient, "client", mongomock.MongoClient())
+    mongo_client = MongoDbClient()
+    mongo_client.database[COLLECTION_NAME].insert_many(get_documents(visa_dataframe))
+    return USvisaData(mongo_client = mongo_client)
+
+
+def decode_categories(dataframe: pd.DataFrame) -> pd.DataFrame:
+    # the category order is the order of first appearance in the export, which rows come first
+    # differs between the two exports
+    dataframe = dataframe.reset_index(drop = True)
+    return dataframe.astype({
+        column: object for column in dataframe.columns if isinstance(dataframe[column].dtype, pd.CategoricalDtype)
+    })
+
+
+@pytest.mark.parametrize("n_partitions", [1, 3])
+def test_pushdown_matches_client_side_feature_engineering(usvisa_data, n_partitions):
+    data_transformation = DataTransformation(DataTransformationConfig(), None, None)
+
+    dataframe = usvisa_data.export_collection_data_as_dataframe(COLLECTION_NAME, n_partitions = n_partitions, n_workers = 2)
+    input_feature_df, target_feature_df = data_transformation.get_input_and_target_features(dataframe, "client")
+
+    pushdown_df = usvisa_data.export_collection_data_as_dataframe(
+        COLLECTION_NAME, n_partitions = n_partitions, n_workers = 2, feature_pushdown = True
+    )
+    pushdown_input_feature_df, pushdown_target_feature_df = data_transformation.get_input_and_target_features(pushdown_df, "pushdown")
+
+    pd.testing.assert_frame_equal(decode_categories(pushdown_input_feature_df), decode_categories(input_feature_df))
+    pd.testing.assert_series_equal(
+        pushdown_target_feature_df.reset_index(drop = True), target_feature_df.reset_index(drop = True)
+    )
+
+
+def test_pushdown_removes_rows_without_employees(usvisa_data, visa_dataframe):
+    pushdown_df = usvisa_data.export_collection_data_as_dataframe(COLLECTION_NAME, feature_pushdown = True)
+
+    documents = pd.DataFrame(get_documents(visa_dataframe))
+    no_of_employees = pd.to_numeric(documents["no_of_employees"], errors = "coerce")
+    kept_documents = documents[no_of_employees > 0].reset_index(drop = True)
+    yr_of_estab = pd.to_numeric(kept_documents["yr_of_estab"], errors = "coerce")
+
+    # the dataset has rows with negative no_of_employees of its own
+    assert len(pushdown_df) == len(kept_documents) < N_DOCUMENTS - 1 - len(NON_POSITIVE_EMPLOYEES)
+    assert list(pushdown_df.columns) == [
+        column for column in kept_documents.columns if column not in ("case_id", "yr_of_estab")
+    ] + ["company_age"]
+    # the "na" yr_of_estab has no company_age
+    np.testing.assert_array_equal(pushdown_df["company_age"].to_numpy(dtype = np.float64), (CURRENT_YEAR - yr_of_estab).to_numpy())
+    assert pushdown_df["no_of_employees"].dtype == np.int32
+    assert pushdown_df["continent"].isna().sum() == 1